@@ -0,0 +1,166 @@
+"""
+Compare the Flask server (`srcs.serve`, one gthread worker) with the ASGI
+variant of the api (`srcs.asgi`) under hundreds of concurrent annotator
+connections, each flipping pages and labelling rows of the same project.
+Slow clients, whose requests take a while to arrive, are simulated with
+--slow. Both servers run on a temporary project directory, with the same
+number of threads. Run it from the repo root:
+
+    python -m benchmarks.asgi --connections 300 --slow 0 0.2
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+import requests
+
+from srcs import utils
+
+PORT = 5099
+
+
+class Connection:
+    """ Minimal keep-alive HTTP/1.1 client connection, reading responses with a Content-Length. """
+    def __init__(self, port: int):
+        self.port = port
+        self.reader, self.writer = None, None
+
+    async def request(self, method: str, path: str, body: bytes = b'',
+                      slow: float = 0) -> int:
+        """ Send a request, the last header `slow` seconds after the others, and return the status. """
+        head = (f'{method} {path} HTTP/1.1\r\nHost: localhost\r\n'
+                f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n')
+        for attempt in range(2):  # the server may have closed an idle connection
+            try:
+                if self.writer is None:
+                    self.reader, self.writer = await asyncio.open_connection('127.0.0.1', self.port)
+                self.writer.write(head.encode('latin-1'))
+                if slow > 0:
+                    await self.writer.drain()
+                    await asyncio.sleep(slow)
+                self.writer.write(b'Connection: keep-alive\r\n\r\n' + body)
+                await self.writer.drain()
+                status = int((await self.reader.readuntil(b'\r\n')).split()[1])
+                length = 0
+                for line in (await self.reader.readuntil(b'\r\n\r\n')).split(b'\r\n'):
+                    if line.lower().startswith(b'content-length:'):
+                        length = int(line.split(b':')[1])
+                await self.reader.readexactly(length)
+                return status
+            except (ConnectionError, asyncio.IncompleteReadError):
+                self.close()
+                if attempt > 0:
+                    raise
+        return 0
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader, self.writer = None, None
+
+
+async def annotate(port: int, endpoints: dict, project_name: str, n_rows: int,
+                   n_requests: int, slow: float, latencies: list, errors: list):
+    """ Flip pages and label every other page, recording the latency of each request. """
+    connection = Connection(port)
+    try:
+        for i in range(n_requests):
+            row = random.randrange(n_rows)
+            if i % 2 == 0:
+                method, path, body = 'GET', f'{endpoints["GET_DATA"]}/{project_name}/{row}', b''
+            else:
+                method, path = 'PUT', f'{endpoints["UPDATE_LABEL_DATA"]}/{project_name}/{row}'
+                body = json.dumps({'new_labels': [f'l{row % 4}'],
+                                   'verified': '2021-08-01 10:00'}).encode()
+            start = time.perf_counter()
+            try:
+                status = await connection.request(method, path, body, slow)
+            except (ConnectionError, asyncio.IncompleteReadError, OSError):
+                status = 0
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(status)
+    finally:
+        connection.close()
+
+
+async def load(port: int, endpoints: dict, project_name: str, n_rows: int,
+               n_connections: int, n_requests: int, slow: float) -> dict:
+    """ Run concurrent annotators against a server and return throughput and latencies. """
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*[annotate(port, endpoints, project_name, n_rows, n_requests,
+                                    slow, latencies, errors) for _ in range(n_connections)])
+    seconds = time.perf_counter() - start
+    return {
+        'requests/s': len(latencies) / seconds,
+        'p50 (ms)': np.percentile(latencies, 50) * 1000,
+        'p99 (ms)': np.percentile(latencies, 99) * 1000,
+        'errors': len(errors),
+    }
+
+
+def start_server(command: list, folder: str, port: int) -> subprocess.Popen:
+    """ Start a server in a folder holding its config and wait until it answers. """
+    env = dict(os.environ, PYTHONPATH=os.getcwd())
+    server = subprocess.Popen(command, cwd=folder, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            requests.get(f'http://127.0.0.1:{port}/api/v1/projects', timeout=1)
+            return server
+        except requests.RequestException:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f'Server {command} did not start.')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--connections', type=int, default=300,
+                        help='Number of concurrent annotator connections.')
+    parser.add_argument('--requests', type=int, default=10,
+                        help='Number of requests sent by each connection.')
+    parser.add_argument('--rows', type=int, default=100000, help='Number of rows of the project.')
+    parser.add_argument('--threads', type=int, default=8, help='Number of threads of each server.')
+    parser.add_argument('--slow', type=float, nargs='+', default=[0, 0.2],
+                        help='Seconds between the first and last header of each request.')
+    args = parser.parse_args()
+
+    config = utils.load_yaml('./config.yaml')
+    endpoints = config['API_ENDPOINTS']
+    servers = {
+        'flask (gthread)': [sys.executable, '-m', 'srcs.serve', '--workers', '1',
+                            '--threads', str(args.threads)],
+        'asgi (uvicorn)': [sys.executable, '-m', 'srcs.asgi', '--threads', str(args.threads)],
+    }
+    with tempfile.TemporaryDirectory() as folder:
+        config['PROJECT_DIR'] = os.path.join(folder, 'projects')
+        config['API_ADDRESS'] = f'http://127.0.0.1:{PORT}'
+        with open(os.path.join(folder, 'config.yaml'), 'w') as file:
+            json.dump(config, file)  # json is valid yaml
+        url = config['API_ADDRESS']
+        print(f'{args.connections} connections x {args.requests} requests, '
+              f'{args.rows} rows, {args.threads} threads')
+        for name, command in servers.items():
+            server = start_server(command, folder, PORT)
+            try:
+                requests.put(f'{url}{endpoints["CREATE_PROJECT"]}/bench').raise_for_status()
+                requests.put(f'{url}{endpoints["ADD_DATA"]}/bench', params={'duplicates': 'keep'},
+                             json={'texts': [f'text {i}' for i in range(args.rows)]}).raise_for_status()
+                for slow in args.slow:
+                    result = asyncio.run(load(PORT, endpoints, 'bench', args.rows,
+                                              args.connections, args.requests, slow))
+                    print(f'{name:16} slow {slow:<4} ' + '  '.join(
+                        f'{key} {value:8.1f}' for key, value in result.items()))
+                requests.delete(f'{url}{endpoints["DELETE_PROJECT"]}/bench')
+            finally:
+                server.terminate()
+                server.wait()
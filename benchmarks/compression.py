@@ -0,0 +1,110 @@
+"""
+Measure the bytes and time saved by compressing bulk api payloads: a project of
+synthetic texts, partly labelled, is exported as csv and json lines and
+downloaded as json with each encoding the api supports. Time to the last byte
+is measured locally and estimated for a network link of --mbps. The import
+chunks sent gzip compressed by the client are compared with their raw size
+too. Run it from the repo root:
+
+    python -m benchmarks.compression --rows 1000000 --mbps 100
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+import numpy as np
+import requests
+
+from benchmarks.asgi import start_server
+from srcs import compression, utils
+from srcs.client import APIClient
+
+PORT = 5099
+IMPORT_CHUNK_SIZE = 50000
+LABELS = ['positive', 'negative', 'neutral', 'spam', 'question']
+
+
+def make_texts(n_rows: int, seed: int = 0) -> list:
+    """ Return `n_rows` texts of 8 to 40 words drawn from a Zipf-like vocabulary of 20000 words. """
+    rng = np.random.default_rng(seed)
+    letters = np.array(list('abcdefghijklmnopqrstuvwxyz'))
+    vocabulary = np.array([''.join(rng.choice(letters, rng.integers(3, 11)))
+                           for _ in range(20000)])
+    weights = 1 / np.arange(1, len(vocabulary) + 1)
+    lengths = rng.integers(8, 41, n_rows)
+    words = vocabulary[rng.choice(len(vocabulary), lengths.sum(), p=weights / weights.sum())]
+    ends = np.cumsum(lengths)
+    return [' '.join(words[end - n:end]) for n, end in zip(lengths, ends)]
+
+
+def fetch(url: str, encoding: str) -> dict:
+    """ Download a url accepting an encoding and return the bytes sent and seconds taken. """
+    start = time.perf_counter()
+    with requests.get(url, headers={'Accept-Encoding': encoding}, stream=True) as r:
+        r.raise_for_status()
+        sent = r.headers.get('Content-Encoding', 'identity')
+        wire, d = 0, None if sent == 'identity' else compression.decompressor(sent)
+        size = 0
+        for chunk in r.raw.stream(2 ** 16, decode_content=False):
+            wire += len(chunk)
+            size += len(chunk) if d is None else len(d.decompress(chunk))
+    return {'encoding': sent, 'bytes': wire, 'size': size, 'seconds': time.perf_counter() - start}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=1000000, help='Number of rows of the project.')
+    parser.add_argument('--labeled', type=float, default=0.3, help='Fraction of labelled rows.')
+    parser.add_argument('--mbps', type=float, default=100,
+                        help='Bandwidth (Mbit/s) of the network link to estimate transfer times.')
+    args = parser.parse_args()
+
+    config = utils.load_yaml('./config.yaml')
+    with tempfile.TemporaryDirectory() as folder:
+        config['PROJECT_DIR'] = os.path.join(folder, 'projects')
+        config['API_ADDRESS'] = f'http://127.0.0.1:{PORT}'
+        with open(os.path.join(folder, 'config.yaml'), 'w') as file:
+            json.dump(config, file)  # json is valid yaml
+        server = start_server([sys.executable, '-m', 'srcs.serve', '--workers', '1'], folder, PORT)
+        try:
+            client = APIClient(config['API_ADDRESS'], config['API_ENDPOINTS'], timeout=600)
+            client.create_project('bench')
+            texts = make_texts(args.rows)
+            raw, packed = 0, 0
+            for start in range(0, len(texts), IMPORT_CHUNK_SIZE):
+                data = ''.join(json.dumps(text) + '\n' for text in texts[start:start + IMPORT_CHUNK_SIZE])
+                raw += len(data.encode('utf-8'))
+                packed += len(compression.compress(data.encode('utf-8'), 'gzip'))
+            start = time.perf_counter()
+            client.import_texts('bench', texts, 'bench', chunk_size=IMPORT_CHUNK_SIZE)
+            print(f'import of {args.rows} rows: {raw / 2 ** 20:.1f} MB raw, {packed / 2 ** 20:.1f} MB '
+                  f'gzip ({raw / packed:.1f}x), {time.perf_counter() - start:.1f}s')
+
+            rng = np.random.default_rng(1)
+            labeled = rng.choice(args.rows, int(args.rows * args.labeled), replace=False)
+            for start in range(0, len(labeled), 10000):
+                client.update_labels('bench', [
+                    {'index': int(row), 'verified': f'2021-08-{row % 28 + 1:02d} 10:00',
+                     'labels': [LABELS[row % 5]] + ([LABELS[row % 3]] if row % 7 == 0 else [])}
+                    for row in labeled[start:start + 10000]])
+
+            payloads = {
+                'export csv': client.export_url('bench', 'all', 'csv'),
+                'export jsonl': client.export_url('bench', 'all', 'jsonl'),
+                'download json': client.url('DOWNLOAD_DATA', 'bench', 'all'),
+            }
+            print(f'{"payload":14} {"encoding":9} {"MB sent":>8} {"ratio":>6} {"local s":>8} '
+                  f'{"at " + str(int(args.mbps)) + " Mbit/s":>14}')
+            for name, url in payloads.items():
+                for encoding in ('identity', ) + compression.ENCODINGS:
+                    result = fetch(url, encoding)
+                    link = result['seconds'] + result['bytes'] * 8 / (args.mbps * 1e6)
+                    print(f'{name:14} {result["encoding"]:9} {result["bytes"] / 2 ** 20:8.1f} '
+                          f'{result["size"] / result["bytes"]:6.1f} {result["seconds"]:8.1f} '
+                          f'{link:13.1f}s')
+        finally:
+            server.terminate()
+            server.wait()
@@ -0,0 +1,206 @@
+"""
+Load test of the api with concurrent annotators on synthetic projects of
+growing size, e.g. 1k to 5M rows, under a temporary project directory. Each
+annotator follows the flow of the app: it gets the project info, then pages
+through the data, labelling about every other page, revalidates the project
+info now and then and occasionally exports the labelled data. Throughput and
+p50/p95/p99 latencies are reported per endpoint. With --save, results are kept
+as the baseline of their engine, size and number of annotators in --baseline,
+later runs report the change against it and exit with 1 on a regression. Run
+it from the repo root:
+
+    python -m benchmarks.load --rows 1000 100000 1000000 5000000 --annotators 16 --save
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import requests
+
+from benchmarks.asgi import start_server
+from benchmarks.compression import make_texts
+from srcs import utils
+from srcs.client import APIClient
+from srcs.storage import load_storage
+
+PORT = 5099
+CHUNK_SIZE = 500000  # rows generated and written at a time
+LABELS = ['positive', 'negative', 'neutral', 'spam', 'question']
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'load.json')
+PERCENTILES = (50, 95, 99)
+
+
+def populate(config: dict, project_name: str, n_rows: int):
+    """ Create a project of `n_rows` synthetic texts with the storage engine of the config. """
+    storage = load_storage(config)
+    storage.create_project(project_name, '2021-08-01 10:00:00', 'load test')
+    storage.update_project(project_name, 'load test', LABELS)
+    for start in range(0, n_rows, CHUNK_SIZE):
+        texts = make_texts(min(CHUNK_SIZE, n_rows - start), seed=start)
+        if start == 0:
+            storage.add_texts(project_name, texts)
+        else:
+            storage.append_texts(project_name, texts)
+
+
+def annotate(client: APIClient, project_name: str, n_rows: int, deadline: float,
+             export_rate: float, seed: int, latencies: dict, errors: dict):
+    """ Run the flow of one annotator until the deadline, recording the latency of each call. """
+    rng = random.Random(seed)
+
+    def timed(endpoint: str, function, *args):
+        start = time.perf_counter()
+        try:
+            function(*args)
+        except requests.RequestException:
+            errors[endpoint] += 1
+        latencies[endpoint].append(time.perf_counter() - start)
+
+    def export():
+        with client.session.get(client.export_url(project_name, 'labeled', 'csv'),
+                                stream=True, timeout=client.timeout) as r:
+            r.raise_for_status()
+            for _ in r.iter_content(2 ** 16):
+                pass
+
+    timed('GET_PROJECT_INFO', client.get_project_info, project_name)
+    page = rng.randrange(n_rows)
+    while time.perf_counter() < deadline:
+        timed('GET_DATA', client.get_data, project_name, page)
+        if rng.random() < 0.5:
+            labels = rng.sample(LABELS, rng.randint(1, 2))
+            timed('UPDATE_LABEL_DATA', client.update_label, project_name, page, labels,
+                  '2021-08-01 10:00')
+            timed('GET_PROJECT_INFO', client.get_project_info, project_name)
+        if rng.random() < export_rate:
+            timed('EXPORT_DATA', export)
+        page = rng.randrange(n_rows) if rng.random() < 0.05 else (page + 1) % n_rows
+
+
+def run(config: dict, project_name: str, n_rows: int, n_annotators: int, seconds: float,
+        export_rate: float) -> dict:
+    """
+    Run concurrent annotators on a project and return the results of each
+    endpoint, {endpoint: {'requests': int, 'errors': int, 'rps': float,
+    'p50': ms, 'p95': ms, 'p99': ms}}, with the total under "ALL".
+    """
+    latencies, errors = defaultdict(list), defaultdict(int)
+    clients = [APIClient(config['API_ADDRESS'], config['API_ENDPOINTS'], timeout=600,
+                         retries=0, pool_size=1) for _ in range(n_annotators)]
+    deadline = time.perf_counter() + seconds
+    threads = [threading.Thread(target=annotate, args=(
+        client, project_name, n_rows, deadline, export_rate, i, latencies, errors))
+        for i, client in enumerate(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies['ALL'] = [x for values in list(latencies.values()) for x in values]
+    errors['ALL'] = sum(errors.values())
+    return {endpoint: {
+        'requests': len(values),
+        'errors': errors[endpoint],
+        'rps': round(len(values) / elapsed, 1),
+        **{f'p{p}': round(float(np.percentile(values, p)) * 1000, 1) for p in PERCENTILES},
+    } for endpoint, values in latencies.items()}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """ Print results next to their baseline and return the endpoints whose p95 or throughput regressed. """
+    regressions = []
+    print(f'  {"endpoint":18} {"requests":>8} {"errors":>6} {"req/s":>8} '
+          + ' '.join(f'{"p" + str(p) + " ms":>9}' for p in PERCENTILES) + '  vs baseline')
+    for endpoint, result in sorted(results.items(), key=lambda x: x[0] == 'ALL'):
+        line = f'  {endpoint:18} {result["requests"]:8} {result["errors"]:6} {result["rps"]:8.1f} ' \
+               + ' '.join(f'{result[f"p{p}"]:9.1f}' for p in PERCENTILES)
+        old = baseline.get(endpoint)
+        if old is not None:
+            p95 = result['p95'] / max(old['p95'], 1e-3) - 1
+            rps = result['rps'] / max(old['rps'], 1e-3) - 1
+            line += f'  p95 {p95:+.0%} req/s {rps:+.0%}'
+            # exports are too rare to compare their latency
+            if endpoint != 'EXPORT_DATA' and (p95 > tolerance or (endpoint == 'ALL' and rps < -tolerance)):
+                regressions.append(endpoint)
+                line += '  REGRESSION'
+        print(line)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 100000, 1000000],
+                        help='Number of rows of each synthetic project.')
+    parser.add_argument('--annotators', type=int, default=16, help='Number of concurrent annotators.')
+    parser.add_argument('--seconds', type=float, default=30, help='Duration of the test of each project.')
+    parser.add_argument('--export-rate', type=float, default=0.002,
+                        help='Probability of an export after each page.')
+    parser.add_argument('--engine', default=None, help='Storage engine, the one of the config by default.')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of worker processes, API_WORKERS of the config by default.')
+    parser.add_argument('--asgi', action='store_true', help='Serve the ASGI variant of the api.')
+    parser.add_argument('--router', type=int, default=None,
+                        help='Serve the api with this number of processes behind `srcs.router`.')
+    parser.add_argument('--baseline', default=BASELINE, help='Json file keeping the baseline results.')
+    parser.add_argument('--save', action='store_true', help='Save the results as the new baseline.')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Relative p95 slowdown or throughput drop reported as a regression.')
+    args = parser.parse_args()
+
+    config = utils.load_yaml('./config.yaml')
+    engine = args.engine or config.get('STORAGE_ENGINE', 'csv')
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baselines = json.load(file)
+    regressions = []
+    with tempfile.TemporaryDirectory() as folder:
+        config['PROJECT_DIR'] = os.path.join(folder, 'projects')
+        config['API_ADDRESS'] = f'http://127.0.0.1:{PORT}'
+        config['STORAGE_ENGINE'] = engine
+        with open(os.path.join(folder, 'config.yaml'), 'w') as file:
+            json.dump(config, file)  # json is valid yaml
+        for n_rows in args.rows:
+            start = time.perf_counter()
+            with ProcessPoolExecutor(1) as pool:  # memory of the generated data is freed at once
+                pool.submit(populate, config, f'load_{n_rows}', n_rows).result()
+            print(f'created {n_rows} rows in {time.perf_counter() - start:.1f}s')
+
+        if args.router:
+            command = [sys.executable, '-m', 'srcs.router', '--workers', str(args.router)]
+        else:
+            command = [sys.executable, '-m', 'srcs.serve'] + \
+                (['--workers', str(args.workers)] if args.workers else [])
+        command += ['--asgi'] if args.asgi else []
+        server = start_server(command, folder, PORT)
+        try:
+            for n_rows in args.rows:
+                key = f'{engine}{"/asgi" if args.asgi else ""}{f"/router {args.router}" if args.router else ""}' \
+                      f'/{n_rows} rows/{args.annotators} annotators'
+                print(f'{key}, {args.seconds:.0f}s')
+                results = run(config, f'load_{n_rows}', n_rows, args.annotators, args.seconds,
+                              args.export_rate)
+                regressions += [f'{key} {x}' for x in compare(results, baselines.get(key, {}), args.tolerance)]
+                if args.save:
+                    baselines[key] = results
+        finally:
+            server.terminate()
+            server.wait()
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with utils.atomic_path(args.baseline) as tmp, open(tmp, 'w') as file:
+            json.dump(baselines, file, indent=2, sort_keys=True)
+        print(f'saved baseline to {args.baseline}')
+    elif len(regressions) > 0:
+        print('regressions:\n  ' + '\n  '.join(regressions))
+        sys.exit(1)
@@ -0,0 +1,60 @@
+"""
+Measure the full-text search index on a synthetic project: time to build it
+with a pool of worker processes, its size on disk and query latency of rare,
+common and multi-word queries. Run it from the repo root:
+
+    python -m benchmarks.search --rows 1000000
+"""
+import os
+import time
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from srcs.search import SearchIndex, tokenize
+
+CHUNK_SIZE = 50000
+
+
+def make_texts(n_rows: int, n_words: int = 50000, seed: int = 0) -> list:
+    """ Return `n_rows` random texts of 5 to 50 words with Zipf distributed word frequencies. """
+    rng = np.random.default_rng(seed)
+    words = np.array([f'w{i}' for i in range(n_words)], dtype=object)
+    frequencies = 1 / np.arange(1, n_words + 1)
+    lengths = rng.integers(5, 51, n_rows)
+    drawn = words[rng.choice(n_words, lengths.sum(), p=frequencies / frequencies.sum())]
+    return [' '.join(drawn[end - length:end])
+            for end, length in zip(np.cumsum(lengths), lengths)]
+
+
+def timed(function, repeat: int = 1) -> float:
+    """ Return the average seconds taken by `function`. """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=200000, help='Number of rows.')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of worker processes, one per cpu by default.')
+    args = parser.parse_args()
+
+    texts = make_texts(args.rows)
+    with tempfile.TemporaryDirectory() as folder, ProcessPoolExecutor(args.workers) as pool:
+        index = SearchIndex(folder)
+        starts = range(0, len(texts), CHUNK_SIZE)
+        build = timed(lambda: index.rebuild(pool.map(
+            tokenize, [texts[i:i + CHUNK_SIZE] for i in starts], starts)))
+        size = sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder))
+        print(f'{args.rows} rows')
+        print(f'{"build (s)":36}{build:10.3f}')
+        print(f'{"size (MB)":36}{size / 2 ** 20:10.3f}')
+        for query in ('w40000', 'w100', 'w0', 'w100 w2000 w40000'):
+            total = index.search(query)[0]
+            seconds = timed(lambda: index.search(query), repeat=20)
+            print(f'{f"{query!r} ({total} rows, ms)":36}{seconds * 1000:10.3f}')
@@ -0,0 +1,80 @@
+"""
+Compare the csv and arrow storage engines on a synthetic project: file size,
+time to write the data at once and in chunks, like a chunked import, to read
+single rows and ranges without the dataset cache, to select labeled rows and to
+load the whole dataset. Run it from the repo root:
+
+    python -m benchmarks.storage_formats --rows 1000000
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+
+import numpy as np
+
+from srcs.storage import CSVStorage
+from srcs.storage.arrow_storage import ArrowStorage
+
+WORDS = ['label', 'data', 'text', 'help', 'cry', 'for', 'some', '"quoted"', 'multi\nline']
+
+
+def make_texts(n_rows: int, seed: int = 0) -> list:
+    """ Return `n_rows` random texts of 5 to 50 words. """
+    rng = random.Random(seed)
+    return [' '.join(rng.choices(WORDS, k=rng.randint(5, 50))) for _ in range(n_rows)]
+
+
+def timed(function, repeat: int = 1) -> float:
+    """ Return the average seconds taken by `function`. """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+
+def run(engine_class, project_dir: str, texts: list, n_reads: int, chunk_size: int) -> dict:
+    """ Benchmark one storage engine, the dataset cache is disabled for reads. """
+    storage = engine_class(project_dir, cache_bytes=2 ** 40)
+    storage.create_project('chunks', '2021-01-01 00:00', '')
+    results = {'append chunks (s)': timed(lambda: [
+        storage.append_texts('chunks', texts[start:start + chunk_size])
+        for start in range(0, len(texts), chunk_size)])}
+    storage.delete_project('chunks')
+    storage.create_project('bench', '2021-01-01 00:00', '')
+    results['write (s)'] = timed(lambda: storage.add_texts('bench', texts))
+    labeled = random.Random(1).sample(range(len(texts)), len(texts) // 10)
+    storage.update_labels('bench', [(i, ['a'], '2021-01-01 10:00') for i in labeled])
+    storage.compact('bench')
+    results['size (MB)'] = os.path.getsize(storage.data_path('bench')) / 2 ** 20
+
+    storage.cache.max_bytes = 0
+    storage.cache.invalidate('bench')
+    rows = np.random.default_rng(2).integers(0, len(texts), n_reads)
+    results['get_row (ms)'] = timed(lambda: [storage.get_row('bench', int(i)) for i in rows]) \
+        / n_reads * 1000
+    results['get_range 100 (ms)'] = timed(
+        lambda: [storage.get_range('bench', int(i), 100) for i in rows[:100]]) / 100 * 1000
+    results['labeled rows (s)'] = timed(lambda: storage.get_rows('bench', labeled_only=True))
+    results['full load (s)'] = timed(lambda: storage.read_data('bench'))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=200000, help='Number of rows.')
+    parser.add_argument('--reads', type=int, default=1000, help='Number of single row reads.')
+    parser.add_argument('--chunk-size', type=int, default=20000, help='Number of rows of an appended chunk.')
+    args = parser.parse_args()
+
+    texts = make_texts(args.rows)
+    results = {}
+    for name, engine_class in (('csv', CSVStorage), ('arrow', ArrowStorage)):
+        with tempfile.TemporaryDirectory() as project_dir:
+            results[name] = run(engine_class, project_dir, texts, args.reads, args.chunk_size)
+
+    print(f'{args.rows} rows')
+    print(f'{"":20}' + ''.join(f'{name:>12}' for name in results))
+    for metric in results['csv']:
+        print(f'{metric:20}' + ''.join(f'{results[name][metric]:12.3f}' for name in results))
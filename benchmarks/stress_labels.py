@@ -0,0 +1,109 @@
+"""
+Stress test of concurrent labelling: many clients label disjoint rows of the
+same project at once, each adding its own new label along the way, then the
+stored labels, statistics and query results are checked for lost updates.
+Start the api, e.g. `python -m srcs.serve`, then run it from the repo root:
+
+    python -m benchmarks.stress_labels --clients 32 --rows 3200
+"""
+import os
+import sys
+import time
+import argparse
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from srcs import utils
+
+BATCH_SIZE = 5  # rows of every other request sent together to UPDATE_LABELS
+
+
+def expected_labels(row: int, n_clients: int) -> list:
+    """ Return the labels client `row % n_clients` gives to a row. """
+    return [f'l{row % 8}', f'c{row % n_clients}']
+
+
+def label_rows(url: str, endpoints: dict, project_name: str, client: int,
+               n_clients: int, n_rows: int) -> int:
+    """
+    Label the rows of one client, alternating single updates and batches, and
+    query the next unlabeled row now and then. Return the number of requests sent.
+    """
+    session = requests.Session()
+    verified = datetime.now().strftime('%Y-%m-%d %H:%M')
+    rows = list(range(client, n_rows, n_clients))
+    n_requests, i = 0, 0
+    while i < len(rows):
+        if n_requests % 2 == 0:
+            r = session.put(f'{url}{endpoints["UPDATE_LABEL_DATA"]}/{project_name}/{rows[i]}',
+                            json={'new_labels': expected_labels(rows[i], n_clients),
+                                  'verified': verified})
+            i += 1
+        else:
+            batch = rows[i:i + BATCH_SIZE]
+            r = session.put(f'{url}{endpoints["UPDATE_LABELS"]}/{project_name}',
+                            json={'updates': [{'index': row, 'verified': verified,
+                                               'labels': expected_labels(row, n_clients)}
+                                              for row in batch]})
+            i += len(batch)
+        r.raise_for_status()
+        n_requests += 1
+        if n_requests % 10 == 0:  # keep the query indexes of the workers busy
+            session.get(f'{url}{endpoints["QUERY_DATA"]}/{project_name}',
+                        params={'unlabeled': 'true', 'limit': 1}).raise_for_status()
+    return n_requests
+
+
+def check(url: str, endpoints: dict, project_name: str, n_clients: int, n_rows: int) -> int:
+    """ Print and return the number of rows whose labels or statistics were lost. """
+    data = requests.get(f'{url}{endpoints["DOWNLOAD_DATA"]}/{project_name}/all').json()
+    lost = [row for row, label in enumerate(data['label'])
+            if sorted(label.split(', ')) != sorted(expected_labels(row, n_clients))]
+    info = requests.get(f'{url}{endpoints["GET_PROJECT_INFO"]}/{project_name}').json()
+    counts = {}
+    for row in range(n_rows):
+        for label in expected_labels(row, n_clients):
+            counts[label] = counts.get(label, 0) + 1
+    unlabeled = requests.get(f'{url}{endpoints["QUERY_DATA"]}/{project_name}',
+                             params={'unlabeled': 'true'}).json()['rows']
+    print(f'rows with lost labels: {len(lost)}')
+    print(f'labeled rows counted: {info["progress"]} of {n_rows}')
+    print(f'label counts match: {info["labelCounts"] == counts}')
+    print(f'rows queried as unlabeled: {len(unlabeled)}')
+    return len(lost) + n_rows - int(info['progress']) + len(unlabeled) + \
+        (info['labelCounts'] != counts)
+
+
+if __name__ == '__main__':
+    config = utils.load_yaml('./config.yaml')
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--url', action='append', default=None,
+                        help='Base url of an api server, repeat it to spread the clients '
+                             'over several servers, API_ADDRESS of the config by default.')
+    parser.add_argument('--clients', type=int, default=32, help='Number of concurrent clients.')
+    parser.add_argument('--rows', type=int, default=3200, help='Number of rows to label.')
+    args = parser.parse_args()
+    urls = args.url or [config['API_ADDRESS']]
+    endpoints = config['API_ENDPOINTS']
+    project_name = f'stress_{os.getpid()}'
+
+    requests.put(f'{urls[0]}{endpoints["CREATE_PROJECT"]}/{project_name}').raise_for_status()
+    try:
+        requests.put(f'{urls[0]}{endpoints["ADD_DATA"]}/{project_name}',
+                     params={'duplicates': 'keep'},
+                     json={'texts': [f'text {row}' for row in range(args.rows)]}).raise_for_status()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.clients) as pool:
+            n_requests = sum(pool.map(
+                lambda client: label_rows(urls[client % len(urls)], endpoints, project_name,
+                                          client, args.clients, args.rows),
+                range(args.clients)))
+        seconds = time.perf_counter() - start
+        print(f'{args.clients} clients sent {n_requests} requests labelling {args.rows} rows '
+              f'in {seconds:.1f}s ({args.rows / seconds:.0f} rows/s)')
+        errors = check(urls[0], endpoints, project_name, args.clients, args.rows)
+    finally:
+        requests.delete(f'{urls[0]}{endpoints["DELETE_PROJECT"]}/{project_name}')
+    sys.exit(1 if errors > 0 else 0)
@@ -1,12 +1,22 @@
 import os
-import shutil
-import pandas as pd
+import time
+import hashlib
+import functools
+import numpy as np
 from datetime import datetime
-from flask import Flask, request
+from concurrent.futures import Executor
+from flask import Flask, Response, g, request, send_file
 from flask_cors import cross_origin
 from flask_restful import Api
+from typing import Callable, Hashable
 
-from srcs import utils
+from srcs import compression, exports, imports, jobs, metrics, search, utils
+from srcs.dedup import HashIndex
+from srcs.imports import ImportTracker
+from srcs.jobs import JobQueue
+from srcs.search import SearchIndex
+from srcs.storage import bitmask, load_storage
+from srcs.warmup import Warmup
 
 CONFIG = utils.load_yaml('./config.yaml')
 API_ENDPOINTS = CONFIG['API_ENDPOINTS']
@@ -15,26 +25,223 @@ PROJECT_DIR = CONFIG['PROJECT_DIR']
 os.makedirs(PROJECT_DIR, exist_ok=True)
 app = Flask(__name__)
 app.config['CORS_HEADERS'] = 'Content-Type'
+app.wsgi_app = compression.DecompressRequests(app.wsgi_app)
 api = Api(app)
+metrics.configure(PROJECT_DIR)
+STORAGE = load_storage(CONFIG)
+IMPORTS = ImportTracker(os.path.join(PROJECT_DIR, imports.FOLDER))
+JOBS = JobQueue(os.path.join(PROJECT_DIR, jobs.FOLDER), CONFIG, CONFIG.get('JOB_WORKERS') or 1,
+                CONFIG.get('JOB_TTL_S', jobs.TTL))
+# recently modified projects are loaded in background once the api serves, requests are served meanwhile
+WARMUP = Warmup(STORAGE, CONFIG.get('WARM_MEMORY_MB', 0) * 2 ** 20, CONFIG.get('WARM_PROJECTS', 0))
+MAX_RANGE_LIMIT = 1000  # max number of data returned by a range request
+MAX_QUERY_LIMIT = 10000  # max number of data indices returned by a query
+EXPORT_CHUNK_SIZE = exports.CHUNK_SIZE  # number of rows formatted at a time when exporting
+MAX_SEARCH_LIMIT = 100  # max number of data returned by a search
+SEARCH_POOL = None  # worker processes tokenizing texts, started on first use
+
+
+def search_pool() -> Executor:
+    """ Return the pool of worker processes tokenizing texts for the search index. """
+    global SEARCH_POOL
+    if SEARCH_POOL is None:
+        from concurrent.futures import ProcessPoolExecutor  # only needed by large imports
+        SEARCH_POOL = ProcessPoolExecutor(CONFIG.get('SEARCH_WORKERS'))
+    return SEARCH_POOL
+
+
+@app.before_request
+def start_warmup():
+    """
+    Start the warm-up on the first request if the server did not start it, see
+    `APIServer.load`. It is not started on import, so processes importing the
+    api without serving it, e.g. the job processes, do not run it.
+    """
+    WARMUP.start()
+
+
+@app.before_request
+def start_timer():
+    """ Keep the start time of a request to record its latency. """
+    g.start_time = time.perf_counter()
+
+
+@app.after_request
+def record_metrics(response: Response) -> Response:
+    """
+    Record the latency of a request once its response is closed, i.e. its last
+    byte is sent, so streamed exports are measured as a whole.
+    """
+    start = g.get('start_time', time.perf_counter())
+    route, method = request.endpoint or 'unknown', request.method
+    response.call_on_close(lambda: metrics.record_request(
+        route, method, response.status_code, time.perf_counter() - start))
+    return response
+
+
+@app.after_request
+def compress_response(response: Response) -> Response:
+    """ Compress responses with the encoding accepted by the client, see `compression.compress_response`. """
+    return compression.compress_response(
+        response, request.headers.get('Accept-Encoding', ''),
+        CONFIG.get('COMPRESS_MIN_BYTES', compression.MIN_BYTES),
+        CONFIG.get('COMPRESS_LEVEL', compression.LEVEL))
+
+
+def conditional(stamp: Callable[..., Hashable]):
+    """
+    Decorator of GET routes answering conditional requests. Responses get a weak
+    ETag derived from the version stamp returned by `stamp`, called with the
+    arguments of the route, and requests whose If-None-Match holds the current
+    ETag are answered with 304 Not Modified without running the route. The stamp
+    is taken before the route runs, so a response is never older than its ETag.
+    """
+    def decorator(route: Callable) -> Callable:
+        @functools.wraps(route)
+        def wrapper(*args, **kwargs):
+            etag = hashlib.sha1(repr(stamp(*args, **kwargs)).encode()).hexdigest()[:20]
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+            else:
+                response = app.make_response(route(*args, **kwargs))
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = 'no-cache'  # revalidate on every use
+            return response
+        return wrapper
+    return decorator
 
 
 @app.route(f'{API_ENDPOINTS["ADD_DATA"]}/<project_name>', methods=['PUT'])
 @cross_origin()
 def add_text_data(project_name: str):
     """
-    Add texts to be labelled. This api expects json data as follows:
+    Add texts to be labelled, replacing existing data. Duplicated texts, ignoring
+    case and spacing, are skipped unless the "duplicates" query parameter is
+    "keep". This api expects json data as follows:
     {
         'texts': List[str],
     }
 
     Args:
         project_name (str): Project name.
+
+    Returns:
+        {
+            'success': True, bool,
+            'new': Number of texts added, int,
+            'duplicates': Number of duplicated texts skipped, int,
+        }
     """
-    new_data = request.get_json()
-    new_data['verified'] = ['0'] * len(new_data['texts'])
-    new_data['label'] = None
-    df = pd.DataFrame(new_data)
-    df.to_csv(os.path.join(PROJECT_DIR, project_name, 'data.csv'), index=False)
+    texts = request.get_json()['texts']
+    hashes, keep = imports.find_duplicates(texts)
+    if request.args.get('duplicates') == 'keep':
+        keep[:] = True
+    with IMPORTS.lock:
+        texts = [text for text, k in zip(texts, keep) if k]
+        STORAGE.add_texts(project_name, texts)
+        HashIndex(os.path.join(PROJECT_DIR, project_name)).rebuild(
+            [(hashes[keep], np.arange(keep.sum()))])
+        SearchIndex(os.path.join(PROJECT_DIR, project_name)).rebuild(
+            imports.tokenize_texts(texts, pool=search_pool))
+    return {
+        'success': True,
+        'new': int(keep.sum()),
+        'duplicates': int((~keep).sum()),
+    }, 200, {'ContentType': 'application/json'}
+
+
+def import_status(state: dict, total: int = None) -> dict:
+    """ Format the state of an upload into a response. """
+    return {
+        'upload_id': state['upload_id'],
+        'next_seq': state['next_seq'],
+        'rows': state['rows'],
+        'duplicates': state.get('duplicates', 0),
+        'total': total,
+        'rows_per_second': round(state['rows'] / state['seconds'], 1) if state['seconds'] > 0 else None,
+    }
+
+
+@app.route(f'{API_ENDPOINTS["IMPORT_DATA"]}/<project_name>/<upload_id>/<int:seq>', methods=['PUT'])
+@cross_origin()
+def import_chunk(project_name: str, upload_id: str, seq: int):
+    """
+    Append a chunk of texts to be labelled to a project, keeping existing data
+    and labels. A large import is sent as chunks numbered 0, 1, 2, ... under an
+    upload id chosen by the client. A chunk which has been committed already is
+    acknowledged without being appended again, so an interrupted upload resumes
+    by asking the import status for "next_seq" and sending from there.
+
+    The body is either json lines ("application/x-ndjson"), one string or
+    {"text": str} per line, or csv ("text/csv") with the texts in the column
+    given by the "column" query parameter, the first column by default. Texts
+    duplicating existing data or each other, ignoring case and spacing, are
+    skipped unless the "duplicates" query parameter is "keep".
+
+    Args:
+        project_name (str): Project name.
+        upload_id (str): Upload id.
+        seq (int): Sequence number of the chunk.
+
+    Returns:
+        {
+            'upload_id': Upload id, str,
+            'next_seq': Sequence number of the next chunk expected, int,
+            'rows': Number of rows ingested by this upload, int,
+            'duplicates': Number of duplicated texts skipped by this upload, int,
+            'total': Number of data in the project, int,
+            'new': Number of texts added from this chunk, int, only if appended,
+            'chunk_duplicates': Number of duplicated texts skipped from this
+                                chunk, int, only if appended,
+            'rows_per_second': Ingestion rate of this upload, float,
+            'chunk_rows_per_second': Ingestion rate of this chunk, float, only
+                                     if the chunk was appended,
+        }
+    """
+    with IMPORTS.lock:
+        state = IMPORTS.status(project_name, upload_id)
+        if seq < state['next_seq']:  # committed already, e.g. a retry
+            return {**import_status(state, STORAGE.count(project_name)), 'duplicate': True}
+        if seq > state['next_seq']:
+            return {**import_status(state, STORAGE.count(project_name)),
+                    'error': 'chunk out of order'}, 409
+
+        texts = imports.parse_texts(request.get_data(), request.content_type or '',
+                                    request.args.get('column'))
+        chunk = imports.append_chunk(STORAGE, IMPORTS, PROJECT_DIR, project_name, state, texts,
+                                     request.args.get('duplicates') == 'keep', search_pool)
+    return {
+        **import_status(state, chunk['total']),
+        'new': chunk['new'],
+        'chunk_duplicates': chunk['duplicates'],
+        'chunk_rows_per_second': round(chunk['new'] / chunk['seconds'], 1),
+    }
+
+
+@app.route(f'{API_ENDPOINTS["IMPORT_DATA"]}/<project_name>/<upload_id>', methods=['GET'])
+@cross_origin()
+def get_import_status(project_name: str, upload_id: str):
+    """
+    Get the status of a chunked upload, see `import_chunk`.
+
+    Args:
+        project_name (str): Project name.
+        upload_id (str): Upload id.
+    """
+    return import_status(IMPORTS.status(project_name, upload_id), STORAGE.count(project_name))
+
+
+@app.route(f'{API_ENDPOINTS["IMPORT_DATA"]}/<project_name>/<upload_id>', methods=['DELETE'])
+@cross_origin()
+def finish_import(project_name: str, upload_id: str):
+    """
+    Forget the state of a finished upload.
+
+    Args:
+        project_name (str): Project name.
+        upload_id (str): Upload id.
+    """
+    IMPORTS.discard(project_name, upload_id)
     return {'success': True}, 200, {'ContentType': 'application/json'}
 
 
@@ -56,14 +263,11 @@ def download_data(project_name: str, all_or_labeled: str):
             'label': Comma separated labels, List[str],
         }
     """
-    df = pd.read_csv(os.path.join(PROJECT_DIR, project_name, 'data.csv'))
-    if all_or_labeled == 'labeled':
-        df = df[df['verified'] != '0']
+    df = STORAGE.get_rows(project_name, all_or_labeled == 'labeled')
     # process the labels
-    df['label'] = df['label'].apply(lambda x: str(x).replace(':sep:', ', '))
     text = df.texts.to_list()
     verified = df.verified.to_list()
-    label = df.label.to_list()
+    label = bitmask.join_all(df['mask'], STORAGE.get_vocabulary(project_name), ', ').tolist()
     return {
         'text': text,
         'verified': verified,
@@ -71,8 +275,38 @@ def download_data(project_name: str, all_or_labeled: str):
     }
 
 
+@app.route(f'{API_ENDPOINTS["EXPORT_DATA"]}/<project_name>/<all_or_labeled>', methods=['GET'])
+@cross_origin()
+def export_data(project_name: str, all_or_labeled: str):
+    """
+    Stream all data or just labeled data as a file download, formatted as csv
+    (default) or as json lines according to the "format" query parameter. Rows
+    are read and sent in chunks, so memory usage does not grow with the data.
+
+    Args:
+        project_name (str): Project name.
+        all_or_labeled (str): Specify 'labeled' to export labeled data else
+                              all data will be exported.
+
+    Returns:
+        csv with "text", "verified" and comma separated "label" columns, or json
+        lines of {"text": str, "verified": str, "label": List[str]}.
+    """
+    file_format = request.args.get('format', 'csv')
+    if file_format not in exports.FORMATS:
+        return {'success': False, 'error': f'unknown format "{file_format}"'}, 400
+    chunks = STORAGE.iter_rows(project_name, all_or_labeled == 'labeled', EXPORT_CHUNK_SIZE)
+    filename = f'{project_name}_{all_or_labeled}.{file_format}'
+    return Response(
+        exports.format_rows(chunks, STORAGE.get_vocabulary(project_name), file_format),
+        mimetype=exports.FORMATS[file_format],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'},
+    )
+
+
 @app.route(f'{API_ENDPOINTS["GET_DATA"]}/<project_name>/<int:current_page>', methods=['GET'])
 @cross_origin()
+@conditional(lambda project_name, current_page: STORAGE.project_stamp(project_name))
 def get_data(project_name: str, current_page: int):
     """
     Get and return data, verification datetime and label in a dictionary.
@@ -89,16 +323,11 @@ def get_data(project_name: str, current_page: int):
             'label': ":sep:" separated labels, str,
         }
     """
-    try:
-        df = pd.read_csv(os.path.join(PROJECT_DIR, project_name, 'data.csv'))
-        total = len(df)
+    total = STORAGE.count(project_name) or 0
+    if total > 0:
         current_page = min(total - 1, current_page)
-        text = df.texts.iloc[current_page]
-        verified = str(df.verified.iloc[current_page])
-        label = str(df.label.iloc[current_page])
-        label = [] if label == 'nan' else label.split(':sep:')
-    except FileNotFoundError:
-        total = 0
+        text, verified, label = STORAGE.get_row(project_name, current_page)
+    else:  # if no data been added
         text = None
         verified = None
         label = None
@@ -109,8 +338,134 @@ def get_data(project_name: str, current_page: int):
         'label': label,
     }
 
+
+@app.route(f'{API_ENDPOINTS["GET_DATA_RANGE"]}/<project_name>', methods=['GET'])
+@cross_origin()
+@conditional(STORAGE.project_stamp)
+def get_data_range(project_name: str):
+    """
+    Get and return a window of consecutive data, specified by the "offset" and
+    "limit" (at most MAX_RANGE_LIMIT) query parameters.
+
+    Args:
+        project_name (str): Project name.
+
+    Returns:
+        {
+            'total': Total number of data in current project, int,
+            'offset': Index of the first data in the window, int,
+            'text': Text data in the window, List[str],
+            'verified': Verification datetime of the data, List[str],
+            'label': Labels of the data, List[List[str]],
+        }
+    """
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = min(MAX_RANGE_LIMIT, max(0, request.args.get('limit', 100, type=int)))
+    total = STORAGE.count(project_name) or 0
+    rows = STORAGE.get_range(project_name, offset, limit) if offset < total else []
+    return {
+        'total': total,
+        'offset': offset,
+        'text': [row[0] for row in rows],
+        'verified': [row[1] for row in rows],
+        'label': [row[2] for row in rows],
+    }
+
+
+@app.route(f'{API_ENDPOINTS["QUERY_DATA"]}/<project_name>', methods=['GET'])
+@cross_origin()
+def query_data(project_name: str):
+    """
+    Find data matching all conditions given as query parameters, from the
+    "start" index onwards, at most "limit" (at most MAX_QUERY_LIMIT) per page:
+        unlabeled: "true" for unlabeled data only, "false" for labeled data only,
+        has: Label the data must have, may be repeated,
+        lacks: Label the data must not have, may be repeated,
+        before: Only data verified before this datetime,
+        after: Only data verified after this datetime.
+    For example, the next unlabeled data after page 10 is the first index
+    found with "?unlabeled=true&start=11&limit=1".
+
+    Args:
+        project_name (str): Project name.
+
+    Returns:
+        {
+            'total': Total number of data in current project, int,
+            'start': Index the search started from, int,
+            'rows': Indices of the matching data, List[int],
+            'next': Start index of the next page, None if no more data match, int,
+        }
+    """
+    start = max(0, request.args.get('start', 0, type=int))
+    limit = min(MAX_QUERY_LIMIT, max(0, request.args.get('limit', 100, type=int)))
+    unlabeled = request.args.get('unlabeled')
+    if unlabeled is not None:
+        unlabeled = unlabeled.lower() in ('true', '1')
+    try:
+        rows, next_start = STORAGE.query(
+            project_name, start, limit, unlabeled=unlabeled,
+            has=request.args.getlist('has'), lacks=request.args.getlist('lacks'),
+            before=request.args.get('before'), after=request.args.get('after'))
+    except KeyError as e:
+        return {'success': False, 'error': f'unknown label {e}'}, 400
+    except ValueError as e:
+        return {'success': False, 'error': str(e)}, 400
+    return {
+        'total': STORAGE.count(project_name) or 0,
+        'start': start,
+        'rows': rows,
+        'next': next_start,
+    }
+
+
+@app.route(f'{API_ENDPOINTS["SEARCH_DATA"]}/<project_name>', methods=['GET'])
+@cross_origin()
+def search_data(project_name: str):
+    """
+    Find data containing the words of the "q" query parameter, ranked by
+    relevance, skipping the "start" best ranked data and returning at most
+    "limit" (at most MAX_SEARCH_LIMIT). Words are matched case-insensitively
+    and data containing any of them are returned, best matching first.
+
+    Args:
+        project_name (str): Project name.
+
+    Returns:
+        {
+            'total': Number of matching data, int,
+            'start': Rank of the first data returned, int,
+            'rows': Indices of the data, List[int],
+            'scores': Relevance of the data, List[float],
+            'snippets': Part of the text around the first matching word, List[str],
+        }
+    """
+    query = request.args.get('q', '')
+    start = max(0, request.args.get('start', 0, type=int))
+    limit = min(MAX_SEARCH_LIMIT, max(0, request.args.get('limit', 20, type=int)))
+    index = SearchIndex(os.path.join(PROJECT_DIR, project_name))
+    if not index.exists():
+        with IMPORTS.lock:  # not built yet, build it once no import is going on
+            index = imports.search_index(STORAGE, PROJECT_DIR, project_name, search_pool)
+    total, rows, scores = index.search(query, start, limit)
+    found = []
+    for row, score in zip(rows.tolist(), scores.tolist()):
+        try:
+            found.append((row, score, search.snippet(STORAGE.get_row(project_name, row)[0], query)))
+        except IndexError:  # dropped by an import in the meantime
+            continue
+    return {
+        'total': total,
+        'start': start,
+        'rows': [row for row, _, _ in found],
+        'scores': [round(score, 4) for _, score, _ in found],
+        'snippets': [text for _, _, text in found],
+    }
+
+
 @app.route(f'{API_ENDPOINTS["GET_PROJECT_INFO"]}/<project_name>', methods=['GET'])
 @cross_origin()
+@conditional(STORAGE.project_stamp)
 def get_project_info(project_name: str):
     """
     Get and return project information in a dictionary.
@@ -125,31 +480,55 @@ def get_project_info(project_name: str):
             'description': Project description, str,
             'label': List of labels defined, List[str],
             'progress': Number of labeled data in current project, str,
+            'labelCounts': Number of data per label, Dict[str, int],
         }
     """
-    df = pd.read_csv(os.path.join(PROJECT_DIR, 'projects.csv'))
-    selected_df = df.loc[df.project == project_name].reset_index()
-    label = selected_df.label[0]
-    label = [] if str(label) == 'nan' else label.split(':sep:')
+    info = STORAGE.get_project(project_name)
     # get proportion of labeled data
-    try:
-        df = pd.read_csv(os.path.join(PROJECT_DIR, project_name, 'data.csv'))
-        progress = str(len(df) - df['verified'].value_counts()['0'])
-    except FileNotFoundError:  # if no data been added
-        progress = None
-    except KeyError:  # if no labeled data
-        progress = '0'
+    stats = STORAGE.get_stats(project_name)
     return {
         'project': project_name,
-        'createDate': selected_df.createDate[0],
-        'description': selected_df.description[0],
-        'label': label,
-        'progress': progress,
+        'createDate': info['createDate'],
+        'description': info['description'],
+        'label': info['label'],
+        'progress': None if stats is None else str(stats['labeled']),  # None if no data
+        'labelCounts': {} if stats is None else stats['labels'],
+    }
+
+
+@app.route(f'{API_ENDPOINTS["GET_LABEL_STATS"]}/<project_name>', methods=['GET'])
+@cross_origin()
+def get_label_stats(project_name: str):
+    """
+    Count data per label and per pair of labels.
+
+    Args:
+        project_name (str): Project name.
+
+    Returns:
+        {
+            'label': List of labels defined, List[str],
+            'counts': Number of data having each label, List[int],
+            'cooccurrence': Number of data having both labels i and j, List[List[int]],
+        }
+    """
+    vocabulary = STORAGE.get_vocabulary(project_name)
+    matrix = np.zeros((len(vocabulary), len(vocabulary)), dtype='int64')
+    if STORAGE.count(project_name):
+        for df in STORAGE.iter_rows(project_name, labeled_only=True, chunk_size=EXPORT_CHUNK_SIZE):
+            matrix += bitmask.cooccurrence(df['mask'].to_numpy(), len(vocabulary))
+    bits = [bit for bit, name in enumerate(vocabulary) if name]
+    matrix = matrix[np.ix_(bits, bits)]
+    return {
+        'label': [vocabulary[bit] for bit in bits],
+        'counts': np.diag(matrix).tolist(),
+        'cooccurrence': matrix.tolist(),
     }
 
 
 @app.route(API_ENDPOINTS['LOAD_PROJECTS'], methods=['GET'])
 @cross_origin()
+@conditional(STORAGE.projects_stamp)
 def get_all_projects():
     """
     Get and return list of projects.
@@ -159,13 +538,61 @@ def get_all_projects():
             'projects': List of project names, List[str]
         }
     """
-    try:
-        df = pd.read_csv(os.path.join(PROJECT_DIR, 'projects.csv'))
-        projects = df.project.to_list()
-    except FileNotFoundError:
-        projects = []
+    return {'projects': STORAGE.list_projects()}
+
+
+@app.route(API_ENDPOINTS['READY'], methods=['GET'])
+@cross_origin()
+def get_ready():
+    """
+    Report the warm-up of recently modified projects after the api starts,
+    answered with 503 until it is finished, so a load balancer only routes
+    requests to warm workers.
 
-    return {'projects': projects}
+    Returns:
+        Progress of the warm-up, see `Warmup.status`.
+    """
+    status = WARMUP.status()
+    return status, 200 if status['ready'] else 503, {'ContentType': 'application/json'}
+
+
+@app.route(f'{API_ENDPOINTS["WARM_PROJECT"]}/<project_name>', methods=['PUT'])
+@cross_origin()
+def warm_project(project_name: str):
+    """
+    Load the data and indexes of a project into memory ahead of its requests,
+    within WARM_MEMORY_MB, e.g. when the router hands it over to this process.
+
+    Returns:
+        {
+            'project': Project name, str
+            'memory_mb': Memory taken by the project, float
+        }
+    """
+    if project_name not in STORAGE.list_projects():
+        return {'success': False, 'error': f'unknown project "{project_name}"'}, 404
+    nbytes = STORAGE.warm(project_name, CONFIG.get('WARM_MEMORY_MB', 0) * 2 ** 20)
+    return {'project': project_name, 'memory_mb': round(nbytes / 2 ** 20, 1)}, \
+        200, {'ContentType': 'application/json'}
+
+
+@app.route(f'{API_ENDPOINTS["WARM_PROJECT"]}/<project_name>', methods=['DELETE'])
+@cross_origin()
+def release_project(project_name: str):
+    """ Drop the data and indexes of a project kept in memory, e.g. once another process serves it. """
+    STORAGE.release(project_name)
+    return {'success': True}, 200, {'ContentType': 'application/json'}
+
+
+@app.route(API_ENDPOINTS['METRICS'], methods=['GET'])
+@cross_origin()
+def get_metrics():
+    """
+    Get the metrics of all workers in the Prometheus text format: request counts
+    and latency histograms per route, bytes read and written per project file
+    and time spent parsing and writing csv files, see `srcs.metrics`.
+    """
+    return Response(metrics.render(metrics.REGISTRY.collect()), content_type=metrics.CONTENT_TYPE)
 
 
 @app.route(f'{API_ENDPOINTS["CREATE_PROJECT"]}/<project_name>', methods=['PUT'])
@@ -177,23 +604,11 @@ def create_project(project_name: str):
     Args:
         project_name (str): Project name.
     """
-    # create folder
-    os.makedirs(os.path.join(PROJECT_DIR, project_name), exist_ok=True)
-    # add project info
-    to_append = {
-        'project': [project_name],
-        'createDate': [str(datetime.now()).split('.')[0][:-3]],
-        'description': ['Add description at here.'],  # default description
-        'label': None,  # default label
-    }
-    df_to_append = pd.DataFrame(to_append)
-    try:
-        df = pd.read_csv(os.path.join(PROJECT_DIR, 'projects.csv'))
-        df = df.append(df_to_append, ignore_index=True)
-    except FileNotFoundError:
-        df = df_to_append
-
-    df.to_csv(os.path.join(PROJECT_DIR, 'projects.csv'), index=False)
+    STORAGE.create_project(
+        project_name,
+        str(datetime.now()).split('.')[0][:-3],
+        'Add description at here.',  # default description
+    )
     return {'success': True}, 200, {'ContentType': 'application/json'}
 
 
@@ -206,15 +621,152 @@ def delete_project(project_name):
     Args:
         project_name (str): Project name.
     """
-    # delete folder
-    shutil.rmtree(os.path.join(PROJECT_DIR, project_name))
-    # delete project info
-    df = pd.read_csv(os.path.join(PROJECT_DIR, 'projects.csv'))
-    df = df[df['project'] != project_name]
-    df.to_csv(os.path.join(PROJECT_DIR, 'projects.csv'), index=False)
+    imports.delete_project(STORAGE, IMPORTS, PROJECT_DIR, project_name)
     return {'success': True}, 200, {'ContentType': 'application/json'}
 
 
+def job_status(state: dict) -> dict:
+    """ Add the address of the file written by a finished job to its state, see `JobQueue.status`. """
+    if state['status'] == 'done' and (state['result'] or {}).get('file'):
+        state['result_url'] = f'{API_ENDPOINTS["JOBS"]}/{state["id"]}/result'
+    return state
+
+
+@app.route(f'{API_ENDPOINTS["JOBS"]}/import/<project_name>', methods=['POST'])
+@cross_origin()
+def start_import(project_name: str):
+    """
+    Start a job appending the texts of a file to a project, see `import_chunk`
+    for the body, "column" and "duplicates" query parameters. The file is stored
+    with the job, so the request returns once it is received.
+
+    Args:
+        project_name (str): Project name.
+
+    Returns:
+        State of the job, see `JobQueue.status`.
+    """
+    if project_name not in STORAGE.list_projects():
+        return {'success': False, 'error': f'unknown project "{project_name}"'}, 404
+    state = JOBS.submit('import', project_name, iter(lambda: request.stream.read(2 ** 20), b''),
+                        content_type=request.content_type or '', column=request.args.get('column'),
+                        keep_duplicates=request.args.get('duplicates') == 'keep')
+    return job_status(state), 202, {'ContentType': 'application/json'}
+
+
+@app.route(f'{API_ENDPOINTS["JOBS"]}/export/<project_name>/<all_or_labeled>', methods=['POST'])
+@cross_origin()
+def start_export(project_name: str, all_or_labeled: str):
+    """
+    Start a job writing all data or just labeled data to a file, downloaded from
+    the "result_url" of the job once done, see `export_data` for the "format"
+    query parameter.
+
+    Args:
+        project_name (str): Project name.
+        all_or_labeled (str): Specify 'labeled' to export labeled data else
+                              all data will be exported.
+
+    Returns:
+        State of the job, see `JobQueue.status`.
+    """
+    file_format = request.args.get('format', 'csv')
+    if file_format not in exports.FORMATS:
+        return {'success': False, 'error': f'unknown format "{file_format}"'}, 400
+    if project_name not in STORAGE.list_projects():
+        return {'success': False, 'error': f'unknown project "{project_name}"'}, 404
+    state = JOBS.submit('export', project_name, all_or_labeled=all_or_labeled, format=file_format)
+    return job_status(state), 202, {'ContentType': 'application/json'}
+
+
+@app.route(f'{API_ENDPOINTS["JOBS"]}/delete/<project_name>', methods=['POST'])
+@cross_origin()
+def start_delete(project_name: str):
+    """
+    Start a job deleting a project with its indexes, see `delete_project`.
+
+    Args:
+        project_name (str): Project name.
+
+    Returns:
+        State of the job, see `JobQueue.status`.
+    """
+    return job_status(JOBS.submit('delete', project_name)), 202, {'ContentType': 'application/json'}
+
+
+@app.route(API_ENDPOINTS['JOBS'], methods=['GET'])
+@cross_origin()
+def list_jobs():
+    """
+    List the jobs, most recent first, or only those of the project given by the
+    "project" query parameter.
+
+    Returns:
+        {
+            'jobs': States of the jobs, see `JobQueue.status`, List[dict],
+        }
+    """
+    return {'jobs': [job_status(state) for state in JOBS.list(request.args.get('project'))]}
+
+
+@app.route(f'{API_ENDPOINTS["JOBS"]}/<job_id>', methods=['GET'])
+@cross_origin()
+def get_job(job_id: str):
+    """
+    Get the state and progress of a job.
+
+    Args:
+        job_id (str): Job id.
+
+    Returns:
+        State of the job, see `JobQueue.status`.
+    """
+    state = JOBS.status(job_id)
+    if state is None:
+        return {'success': False, 'error': f'unknown job "{job_id}"'}, 404
+    return job_status(state)
+
+
+@app.route(f'{API_ENDPOINTS["JOBS"]}/<job_id>', methods=['DELETE'])
+@cross_origin()
+def cancel_job(job_id: str):
+    """
+    Cancel a job which is not finished, a running job stops after its current
+    chunk, or forget a finished job and remove its files.
+
+    Args:
+        job_id (str): Job id.
+
+    Returns:
+        State of the cancelled job, see `JobQueue.status`, or {'success': True}.
+    """
+    state = JOBS.status(job_id)
+    if state is None:
+        return {'success': False, 'error': f'unknown job "{job_id}"'}, 404
+    if state['status'] not in jobs.FINISHED:
+        return job_status(JOBS.cancel(job_id))
+    JOBS.delete(job_id)
+    return {'success': True}, 200, {'ContentType': 'application/json'}
+
+
+@app.route(f'{API_ENDPOINTS["JOBS"]}/<job_id>/result', methods=['GET'])
+@cross_origin()
+def get_job_result(job_id: str):
+    """
+    Download the file written by a finished job, e.g. an export.
+
+    Args:
+        job_id (str): Job id.
+    """
+    path = JOBS.result_path(job_id)
+    if path is None:
+        return {'success': False, 'error': f'no result for job "{job_id}"'}, 404
+    filename = os.path.basename(path)
+    response = send_file(os.path.abspath(path), exports.FORMATS.get(filename.rsplit('.', 1)[-1]))
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
 @app.route(f'{API_ENDPOINTS["UPDATE_LABEL_DATA"]}/<project_name>/<int:current_page>', methods=['PUT'])
 @cross_origin()
 def update_label_data(project_name: str, current_page: int):
@@ -224,6 +776,8 @@ def update_label_data(project_name: str, current_page: int):
         'new_labels': List of labels, List[str],
         'verified': Verification datetime, str,
     }
+    Labels the project does not define yet are added to it. A project has at
+    most 63 labels, an update going over answers 400 and is not written.
 
     Args:
         project_name (str): Project name.
@@ -231,13 +785,83 @@ def update_label_data(project_name: str, current_page: int):
     """
     new_labels = request.get_json()['new_labels']
     verified = request.get_json()['verified']
-    df = pd.read_csv(os.path.join(PROJECT_DIR, project_name, 'data.csv'))
-    df.verified.iloc[current_page] = verified
-    df.label.iloc[current_page] = ':sep:'.join(new_labels)
-    df.to_csv(os.path.join(PROJECT_DIR, project_name, 'data.csv'), index=False)
+    try:
+        STORAGE.update_label(project_name, current_page, new_labels, verified)
+    except ValueError as e:
+        return {'success': False, 'error': str(e)}, 400, {'ContentType': 'application/json'}
     return {'success': True}, 200, {'ContentType': 'application/json'}
 
 
+@app.route(f'{API_ENDPOINTS["UPDATE_LABELS"]}/<project_name>', methods=['PUT'])
+@cross_origin()
+def update_labels(project_name: str):
+    """
+    Update the labels of many data at once. This api expects json data as follows:
+    {
+        'updates': [
+            {
+                'index': Data index, int,
+                'labels': List of labels, List[str],
+                'verified': Verification datetime, str, optional, defaults to
+                            the current datetime or '0' if labels is empty,
+                            null stands for the default,
+            },
+            ...
+        ],
+    }
+    All valid updates are written together, if an index appears more than once
+    its last update wins. Labels the project does not define yet are added to
+    it. A project has at most 63 labels, a batch going over answers 400 and none
+    of its updates is written.
+
+    Args:
+        project_name (str): Project name.
+
+    Returns:
+        {
+            'success': True if all updates are written, bool,
+            'results': Status of each update, List[{'index': int, 'success': bool,
+                       'error': str, only if failed}],
+            'progress': Number of labeled data in current project, str,
+        }
+    """
+    total = STORAGE.count(project_name) or 0
+    now = str(datetime.now()).split('.')[0][:-3]
+    updates, results = [], []
+    for update in request.get_json()['updates']:
+        index = update.get('index') if isinstance(update, dict) else None
+        labels = update.get('labels') if isinstance(update, dict) else None
+        if not isinstance(index, int) or isinstance(index, bool) or not 0 <= index < total:
+            results.append({'index': index, 'success': False, 'error': 'invalid index'})
+        elif not isinstance(labels, list) or not all(isinstance(x, str) for x in labels):
+            results.append({'index': index, 'success': False, 'error': 'invalid labels'})
+        else:
+            verified = update.get('verified')
+            if verified is None:  # absent or null
+                verified = now if len(labels) > 0 else '0'
+            try:
+                if not isinstance(verified, str):
+                    raise ValueError(f'invalid verified {verified!r}')
+                STORAGE.check_verified(verified)
+            except ValueError:
+                results.append({'index': index, 'success': False, 'error': 'invalid verified'})
+                continue
+            updates.append((index, labels, verified))
+            results.append({'index': index, 'success': True})
+
+    if len(updates) > 0:
+        try:
+            STORAGE.update_labels(project_name, updates)
+        except ValueError as e:
+            return {'success': False, 'error': str(e)}, 400, {'ContentType': 'application/json'}
+    stats = STORAGE.get_stats(project_name)
+    return {
+        'success': len(updates) == len(results),
+        'results': results,
+        'progress': None if stats is None else str(stats['labeled']),
+    }, 200, {'ContentType': 'application/json'}
+
+
 @app.route(f'{API_ENDPOINTS["UPDATE_PROJECT_INFO"]}/<project_name>', methods=['POST'])
 @cross_origin()
 def update_project_info(project_name):
@@ -248,21 +872,22 @@ def update_project_info(project_name):
         'createDate': Project creation datetime, str,
         'description': Project description, str,
         'label': List of defined labels, List[str],
+        'renames': New name of renamed labels, Dict[str, str], optional,
     }
+    Labels no longer defined are removed from the data.
 
     Args:
         project_name (str): Project name.
     """
     new_info = request.get_json()
-    new_description = new_info['description']
-    new_label = ':sep:'.join(new_info['label'])
-    df = pd.read_csv(os.path.join(PROJECT_DIR, 'projects.csv'))
-    id = df.project == project_name
-    df.loc[id, 'description'] = new_description
-    df.loc[id, 'label'] = new_label
-    df.to_csv(os.path.join(PROJECT_DIR, 'projects.csv'), index=False)
+    try:
+        STORAGE.update_project(project_name, new_info['description'], new_info['label'],
+                               new_info.get('renames'))
+    except ValueError as e:
+        return {'success': False, 'error': str(e)}, 400, {'ContentType': 'application/json'}
     return {'success': True}, 200, {'ContentType': 'application/json'}
 
 
 if __name__ == '__main__':
+    metrics.reset(PROJECT_DIR)
     app.run(debug=True)
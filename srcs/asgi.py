@@ -0,0 +1,175 @@
+"""
+ASGI variant of the REST API, serving the same routes and json contracts as
+`srcs.api` from an event loop. Connections, request bodies and responses are
+handled by the loop, so hundreds of slow annotator connections do not hold a
+thread each, while the blocking storage work of the routes runs in a bounded
+pool of API_THREADS threads. Streamed responses, e.g. exports, are sent chunk
+by chunk as they are generated. Run it from the repo root:
+
+    python -m srcs.asgi --threads 8
+"""
+import sys
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Callable, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from srcs import api, metrics
+
+STREAM_CHUNK_BYTES = 2 ** 16  # chunks of a streamed response are sent in pieces of this size
+EXECUTOR = ThreadPoolExecutor(api.CONFIG.get('API_THREADS'), thread_name_prefix='asgi')
+
+
+def wsgi_environ(scope: dict, body: bytes) -> dict:
+    """ Return the WSGI environ of an ASGI http request. """
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f'HTTP_{name}'
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+def call_app(environ: dict, emit: Callable[[dict, bytes], None]) -> Tuple[dict, bytes]:
+    """
+    Run the Flask app on a request, in a thread of the pool. Responses larger than
+    STREAM_CHUNK_BYTES are handed to `emit` piece by piece, which blocks until a
+    piece is sent, the rest is returned.
+
+    Args:
+        environ (dict): WSGI environ of the request.
+        emit (Callable[[dict, bytes], None]): Function sending the response
+            status and headers, if not sent yet, and a piece of its body.
+
+    Returns:
+        {'status': int, 'headers': List[Tuple[str, str]]}, dict, and the last
+        piece of the response body, bytes.
+    """
+    response = {}
+
+    def start_response(status: str, headers: List[Tuple[str, str]], exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = headers
+
+    body = api.app(environ, start_response)
+    try:
+        pieces, size = [], 0
+        for chunk in body:
+            pieces.append(chunk)
+            size += len(chunk)
+            if size >= STREAM_CHUNK_BYTES:
+                emit(response, b''.join(pieces))
+                pieces, size = [], 0
+        return response, b''.join(pieces)
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+
+
+async def read_body(receive: Callable) -> Optional[bytes]:
+    """ Return the body of a request, None if the client disconnected. """
+    body = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            return b''.join(body)
+
+
+async def app(scope: dict, receive: Callable, send: Callable):
+    """ ASGI application serving the routes of `srcs.api`. """
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                EXECUTOR.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+
+    body = await read_body(receive)
+    if body is None:
+        return
+    loop = asyncio.get_running_loop()
+    state = {'started': False, 'disconnected': False}
+
+    async def watch_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        state['disconnected'] = True
+
+    async def send_piece(response: dict, piece: bytes, more_body: bool):
+        if not state['started']:
+            await send({
+                'type': 'http.response.start',
+                'status': response['status'],
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                            for name, value in response['headers']],
+            })
+            state['started'] = True
+        await send({'type': 'http.response.body', 'body': piece, 'more_body': more_body})
+
+    def emit(response: dict, piece: bytes):
+        if state['disconnected']:  # stop generating a stream nobody reads
+            raise ConnectionAbortedError('Client disconnected.')
+        asyncio.run_coroutine_threadsafe(send_piece(response, piece, True), loop).result()
+
+    watcher = asyncio.ensure_future(watch_disconnect())
+    try:
+        response, rest = await loop.run_in_executor(EXECUTOR, call_app,
+                                                    wsgi_environ(scope, body), emit)
+    except ConnectionAbortedError:
+        return
+    except Exception:
+        if state['started']:  # too late to change the status, drop the connection
+            raise
+        response, rest = {'status': 500, 'headers': [('Content-Type', 'text/plain')]}, \
+            b'Internal Server Error'
+    finally:
+        watcher.cancel()
+    await send_piece(response, rest, False)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--threads', type=int, default=None,
+                        help='Number of threads running storage work, API_THREADS of the '
+                             'config by default.')
+    args = parser.parse_args()
+    if args.threads:
+        EXECUTOR = ThreadPoolExecutor(args.threads, thread_name_prefix='asgi')
+    metrics.reset(api.PROJECT_DIR)  # metrics of a previous server
+    address = urlparse(api.CONFIG['API_ADDRESS'])
+    uvicorn.run(app, host=address.hostname, port=address.port or 80,
+                log_level='warning', timeout_keep_alive=30)
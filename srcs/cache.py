@@ -0,0 +1,136 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional, Sequence, Tuple, Union
+
+import pandas as pd
+
+
+class DatasetCache:
+    """
+    Least recently used cache of parsed project datasets, bounded by a memory
+    budget. A cached dataset is reused as long as the modification time and size
+    of its source files and its version counter are unchanged. Source files are
+    given either as a single path or as a sequence of paths, where the first one
+    must exist and the others are optional companion files, e.g. journals.
+
+    Args:
+        max_bytes (int): Memory budget of all cached datasets in bytes.
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = OrderedDict()  # key -> (stamp, df, nbytes)
+        self._versions = {}
+        self._lock = threading.RLock()
+
+    def get(self, key: Hashable, path: Union[str, Sequence[str]],
+            loader: Callable[..., pd.DataFrame]) -> pd.DataFrame:
+        """
+        Return the cached dataset of a key, (re)loading it from the file if the
+        cached copy is missing or stale.
+
+        Args:
+            key (Hashable): Cache key, usually the project name.
+            path (Union[str, Sequence[str]]): Path(s) to the source files.
+            loader (Callable[..., pd.DataFrame]): Function to parse the file(s),
+                called with the given path.
+        """
+        stamp = self._stamp(key, path)  # raises FileNotFoundError
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        df = loader(path)
+        self._put(key, stamp, df)
+        return df
+
+    def peek(self, key: Hashable, path: Union[str, Sequence[str]]) -> Optional[pd.DataFrame]:
+        """ Return the cached dataset of a key if it is fresh, else None without loading it. """
+        try:
+            stamp = self._stamp(key, path)
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[1] if entry is not None and entry[0] == stamp else None
+
+    def update(self, key: Hashable, path: Union[str, Sequence[str]], df: pd.DataFrame):
+        """
+        Store a dataset that was just written to its source file, so the write
+        does not force the next read to parse the file again.
+
+        Args:
+            key (Hashable): Cache key, usually the project name.
+            path (Union[str, Sequence[str]]): Path(s) to the source files.
+            df (pd.DataFrame): Dataset that was written.
+        """
+        with self._lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+            self._put(key, self._stamp(key, path), df)
+
+    def refresh(self, key: Hashable, path: Union[str, Sequence[str]]):
+        """
+        Mark the cached dataset of a key as fresh after it was modified in place
+        and the change was written to its source files. Like `update`, this
+        increases the version counter, but the memory usage of the dataset is not
+        measured again.
+        """
+        with self._lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (self._stamp(key, path), entry[1], entry[2])
+
+    def bump(self, key: Hashable) -> int:
+        """ Increase the version counter of a key to invalidate its cached dataset. """
+        with self._lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+            self._pop(key)
+            return self._versions[key]
+
+    def invalidate(self, key: Hashable):
+        """ Drop the cached dataset of a key. """
+        with self._lock:
+            self._pop(key)
+
+    def size(self, key: Hashable) -> int:
+        """ Return the memory usage of the cached dataset of a key in bytes, 0 if not cached. """
+        with self._lock:
+            entry = self._entries.get(key)
+            return 0 if entry is None else entry[2]
+
+    def version(self, key: Hashable) -> int:
+        """ Return the version counter of a key. """
+        return self._versions.get(key, 0)
+
+    def _put(self, key: Hashable, stamp: Tuple, df: pd.DataFrame):
+        nbytes = int(df.memory_usage(index=True, deep=True).sum())
+        with self._lock:
+            self._pop(key)
+            if nbytes > self.max_bytes:  # never cache what does not fit
+                return
+            self._entries[key] = (stamp, df, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self.nbytes -= evicted
+
+    def _pop(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[2]
+
+    def _stamp(self, key: Hashable, path: Union[str, Sequence[str]]) -> Tuple:
+        paths = [path] if isinstance(path, str) else list(path)
+        stat = os.stat(paths[0])
+        stamp = [stat.st_mtime_ns, stat.st_size]
+        for companion in paths[1:]:
+            try:
+                stat = os.stat(companion)
+                stamp += [stat.st_mtime_ns, stat.st_size]
+            except FileNotFoundError:
+                stamp += [None, None]
+        return tuple(stamp) + (self._versions.get(key, 0), )
@@ -0,0 +1,576 @@
+"""
+Python client of the REST API, used by the Streamlit app and by scripts, e.g.
+
+    client = APIClient.from_config('./config.yaml')
+    client.import_texts('my_project', texts, upload_id='my_dump_2021_08')
+    with client.label_batch('my_project') as batch:
+        for index, labels in predictions:
+            batch.add(index, labels)
+"""
+import gzip
+import json
+import time
+import asyncio
+import functools
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from srcs import utils
+
+TIMEOUT = 60  # seconds to wait for the server to connect or respond
+RETRIES = 3  # number of times a failed request is sent again
+BACKOFF = 0.5  # seconds before the first retry, doubled for each next one
+POOL_SIZE = 10  # number of keep-alive connections kept to the server
+CACHE_SIZE = 256  # number of GET responses kept with their ETag for revalidation
+BATCH_SIZE = 500  # number of label updates sent together by a label batch
+FLUSH_INTERVAL = 1  # seconds a label writer waits for more updates before sending them
+MAX_FLUSH_INTERVAL = 60  # seconds between retries of a label writer failing to send
+IMPORT_CHUNK_SIZE = 5000  # number of texts sent per import request
+COMPRESS_LEVEL = 1  # gzip level of compressed request bodies
+RETRY_STATUSES = (502, 503, 504)  # responses of an overloaded or restarting server
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE')  # safe to send twice
+
+
+class APIClient:
+    """
+    Client of the REST API keeping a pool of keep-alive connections. Requests
+    time out after `timeout` seconds. Requests failing to connect, timing out or
+    answered by a 502, 503 or 504 are retried `retries` times with exponential
+    backoff, except POST requests, which are only retried if they could not be
+    sent. Responses of GET requests carrying an ETag are cached and revalidated
+    with If-None-Match, a 304 Not Modified answer is served from the cache.
+    Responses are received compressed, bulk request bodies, i.e. import chunks,
+    are sent gzip compressed if `compress`. It is safe to use from several threads.
+
+    Args:
+        address (str): API address, e.g. "http://127.0.0.1:5000".
+        endpoints (Dict[str, str]): Path of each endpoint, API_ENDPOINTS of the config.
+        timeout (float): Seconds to wait for the server to connect or respond.
+        retries (int): Number of times a failed request is sent again.
+        backoff (float): Seconds before the first retry, doubled for each next one.
+        pool_size (int): Number of keep-alive connections.
+        cache_size (int): Number of GET responses cached with their ETag.
+        compress (bool): Compress bulk request bodies if True.
+    """
+    def __init__(self, address: str, endpoints: Dict[str, str], timeout: float = TIMEOUT,
+                 retries: int = RETRIES, backoff: float = BACKOFF, pool_size: int = POOL_SIZE,
+                 cache_size: int = CACHE_SIZE, compress: bool = True):
+        self.address = address.rstrip('/')
+        self.endpoints = endpoints
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.cache_size = cache_size
+        self.compress = compress
+        self._cache = OrderedDict()  # (url, params) -> (etag, body), least recently used first
+        self._cache_lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @classmethod
+    def from_config(cls, config: str) -> 'APIClient':
+        """ Create a client from the API_ADDRESS, API_ENDPOINTS and CLIENT_* settings of a config file. """
+        config = utils.load_yaml(config)
+        return cls(config['API_ADDRESS'], config['API_ENDPOINTS'],
+                   timeout=config.get('CLIENT_TIMEOUT_S') or TIMEOUT,
+                   retries=config.get('CLIENT_RETRIES', RETRIES))
+
+    def close(self):
+        """ Close the pooled connections. """
+        self.session.close()
+
+    def url(self, endpoint: str, *path) -> str:
+        """ Return the address of an endpoint followed by path parts, e.g. the project name. """
+        return '/'.join([self.address + self.endpoints[endpoint]] + [str(part) for part in path])
+
+    def request(self, method: str, endpoint: str, *path, **kwargs) -> requests.Response:
+        """
+        Send a request to an endpoint, retrying it if it fails, see the class
+        description. Raise requests.RequestException if the last attempt fails.
+
+        Args:
+            method (str): HTTP method.
+            endpoint (str): Endpoint name, e.g. "GET_DATA".
+            path: Parts of the path following the endpoint, e.g. the project name.
+            kwargs: Arguments of `requests.Session.request`, e.g. params or json.
+        """
+        url = self.url(endpoint, *path)
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+                if response.status_code not in RETRY_STATUSES or last:
+                    return response
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if last or not (method in IDEMPOTENT_METHODS or
+                                isinstance(e, requests.ConnectTimeout)):
+                    raise
+            time.sleep(self.backoff * 2 ** attempt)
+
+    def json(self, method: str, endpoint: str, *path, **kwargs) -> dict:
+        """
+        Send a request like `request` and return its json response, see `parse`.
+        GET requests are revalidated against the cache, see the class description.
+        """
+        if method != 'GET' or self.cache_size <= 0:
+            return self.parse(self.request(method, endpoint, *path, **kwargs))
+
+        key = (self.url(endpoint, *path), repr(sorted((kwargs.get('params') or {}).items())))
+        with self._cache_lock:
+            cached = self._cache.get(key)
+        if cached is not None:
+            kwargs['headers'] = {**kwargs.get('headers', {}), 'If-None-Match': cached[0]}
+        response = self.request(method, endpoint, *path, **kwargs)
+        if response.status_code == 304 and cached is not None:
+            with self._cache_lock:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+            return json.loads(cached[1])  # parsed again, callers may modify the result
+
+        result = self.parse(response)
+        etag = response.headers.get('ETag')
+        with self._cache_lock:
+            if response.status_code == 200 and etag is not None:
+                self._cache[key] = (etag, response.content)
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            else:
+                self._cache.pop(key, None)
+        return result
+
+    @staticmethod
+    def parse(response: requests.Response) -> dict:
+        """ Return the json of a response, raise requests.HTTPError if it failed without an error message of the api. """
+        if response.status_code >= 400 and \
+                not response.headers.get('Content-Type', '').startswith('application/json'):
+            response.raise_for_status()
+        return response.json()
+
+    def list_projects(self) -> List[str]:
+        """ Return the names of all projects. """
+        return self.json('GET', 'LOAD_PROJECTS')['projects']
+
+    def create_project(self, project_name: str) -> dict:
+        """ Create a new project. """
+        return self.json('PUT', 'CREATE_PROJECT', project_name)
+
+    def delete_project(self, project_name: str) -> dict:
+        """ Delete a project together with its data. """
+        return self.json('DELETE', 'DELETE_PROJECT', project_name)
+
+    def get_project_info(self, project_name: str) -> dict:
+        """ Return information of a project, see `api.get_project_info`. """
+        return self.json('GET', 'GET_PROJECT_INFO', project_name)
+
+    def update_project_info(self, project_name: str, info: dict,
+                            renames: Optional[Dict[str, str]] = None) -> dict:
+        """
+        Update the description and labels of a project.
+
+        Args:
+            project_name (str): Project name.
+            info (dict): Project information with the new "description" and "label".
+            renames (Dict[str, str], optional): New name of renamed labels.
+        """
+        return self.json('POST', 'UPDATE_PROJECT_INFO', project_name,
+                         json={**info, 'renames': renames or {}})
+
+    def get_data(self, project_name: str, index: int) -> dict:
+        """ Return the data of a page index, see `api.get_data`. """
+        return self.json('GET', 'GET_DATA', project_name, index)
+
+    def get_data_range(self, project_name: str, offset: int, limit: int) -> dict:
+        """ Return a window of consecutive data, see `api.get_data_range`. """
+        return self.json('GET', 'GET_DATA_RANGE', project_name,
+                         params={'offset': offset, 'limit': limit})
+
+    def download_data(self, project_name: str, all_or_labeled: str) -> dict:
+        """ Return all data or just labeled data, see `api.download_data`. """
+        return self.json('GET', 'DOWNLOAD_DATA', project_name, all_or_labeled)
+
+    def export_url(self, project_name: str, all_or_labeled: str, file_format: str) -> str:
+        """ Return the address streaming an export of all data or just labeled data as "csv" or "jsonl". """
+        return f'{self.url("EXPORT_DATA", project_name, all_or_labeled)}?format={file_format}'
+
+    def query(self, project_name: str, start: int = 0, limit: int = 100, **conditions) -> dict:
+        """
+        Return indices of data matching some conditions, see `api.query_data`.
+
+        Args:
+            project_name (str): Project name.
+            start (int): Index to start searching from.
+            limit (int): Max number of indices.
+            conditions: Conditions of `api.query_data`, e.g. unlabeled='true' or
+                        has=List[str].
+        """
+        return self.json('GET', 'QUERY_DATA', project_name,
+                         params={'start': start, 'limit': limit, **conditions})
+
+    def search(self, project_name: str, query: str, start: int = 0, limit: int = 20) -> dict:
+        """ Return indices and snippets of the data best matching the words of a query, see `api.search_data`. """
+        return self.json('GET', 'SEARCH_DATA', project_name,
+                         params={'q': query, 'start': start, 'limit': limit})
+
+    def update_label(self, project_name: str, index: int, labels: List[str],
+                     verified: str) -> dict:
+        """ Set the labels and verification datetime of a data. """
+        return self.json('PUT', 'UPDATE_LABEL_DATA', project_name, index,
+                         json={'new_labels': labels, 'verified': verified})
+
+    def update_labels(self, project_name: str, updates: List[dict]) -> dict:
+        """
+        Update the labels of many data at once.
+
+        Args:
+            project_name (str): Project name.
+            updates (List[dict]): Updates of {'index': int, 'labels': List[str],
+                                  'verified': str, optional}.
+
+        Returns:
+            Status of each update and the new progress, see `api.update_labels`.
+        """
+        return self.json('PUT', 'UPDATE_LABELS', project_name, json={'updates': updates})
+
+    def label_batch(self, project_name: str,
+                    batch_size: Optional[int] = BATCH_SIZE) -> 'LabelBatch':
+        """ Return a batch coalescing label updates of a project, see `LabelBatch`. """
+        return LabelBatch(self, project_name, batch_size)
+
+    def import_texts(self, project_name: str, texts: List[str], upload_id: str,
+                     chunk_size: int = IMPORT_CHUNK_SIZE) -> dict:
+        """
+        Append texts to a project in chunks of json lines. An upload interrupted
+        earlier resumes from its next chunk if the same upload id is given.
+
+        Args:
+            project_name (str): Project name.
+            texts (List[str]): Texts to be labelled.
+            upload_id (str): Upload id, identifying the upload across retries.
+            chunk_size (int): Number of texts per request.
+
+        Returns:
+            Status of the upload, see `api.import_chunk`.
+        """
+        headers = {'content-type': 'application/x-ndjson', 'Accept-Charset': 'UTF-8'}
+        if self.compress:
+            headers['Content-Encoding'] = 'gzip'
+        status = self.json('GET', 'IMPORT_DATA', project_name, upload_id)
+        n_chunks = (len(texts) + chunk_size - 1) // chunk_size
+        for seq in range(status['next_seq'], n_chunks):
+            chunk = texts[seq * chunk_size:(seq + 1) * chunk_size]
+            data = ''.join(json.dumps(str(text), ensure_ascii=False) + '\n' for text in chunk)
+            data = data.encode('utf-8')
+            if self.compress:
+                data = gzip.compress(data, compresslevel=COMPRESS_LEVEL)
+            r = self.request('PUT', 'IMPORT_DATA', project_name, upload_id, seq,
+                             data=data, headers=headers)
+            r.raise_for_status()
+            status = r.json()
+
+        self.request('DELETE', 'IMPORT_DATA', project_name, upload_id)  # upload finished
+        return status
+
+    def start_import(self, project_name: str, data: bytes, content_type: str = 'text/csv',
+                     column: Optional[str] = None, keep_duplicates: bool = False) -> dict:
+        """
+        Start a background job appending the texts of a file to a project, see
+        `api.start_import`.
+
+        Args:
+            project_name (str): Project name.
+            data (bytes): Content of a csv or json lines file.
+            content_type (str): "text/csv" or "application/x-ndjson".
+            column (str, optional): Csv column containing the texts, the first one by default.
+            keep_duplicates (bool): Add duplicated texts too if True.
+
+        Returns:
+            State of the job, see `api.get_job`.
+        """
+        headers = {'content-type': content_type}
+        if self.compress:
+            headers['Content-Encoding'] = 'gzip'
+            data = gzip.compress(data, compresslevel=COMPRESS_LEVEL)
+        params = {'column': column} if column is not None else {}
+        if keep_duplicates:
+            params['duplicates'] = 'keep'
+        return self.json('POST', 'JOBS', 'import', project_name, data=data, headers=headers,
+                         params=params)
+
+    def start_export(self, project_name: str, all_or_labeled: str, file_format: str = 'csv') -> dict:
+        """ Start a background job exporting all data or just labeled data as "csv" or "jsonl", see `api.start_export`. """
+        return self.json('POST', 'JOBS', 'export', project_name, all_or_labeled,
+                         params={'format': file_format})
+
+    def start_delete(self, project_name: str) -> dict:
+        """ Start a background job deleting a project, see `api.start_delete`. """
+        return self.json('POST', 'JOBS', 'delete', project_name)
+
+    def get_job(self, job_id: str) -> dict:
+        """ Return the state and progress of a job, see `api.get_job`. """
+        return self.json('GET', 'JOBS', job_id)
+
+    def list_jobs(self, project_name: Optional[str] = None) -> List[dict]:
+        """ Return the states of the jobs, or of the jobs of a project, most recent first. """
+        params = {'project': project_name} if project_name is not None else {}
+        return self.json('GET', 'JOBS', params=params)['jobs']
+
+    def cancel_job(self, job_id: str) -> dict:
+        """ Cancel a job which is not finished, or forget a finished one, see `api.cancel_job`. """
+        return self.json('DELETE', 'JOBS', job_id)
+
+    def job_result_url(self, state: dict) -> Optional[str]:
+        """ Return the address downloading the file written by a finished job, e.g. an export. """
+        return self.address + state['result_url'] if state.get('result_url') else None
+
+    def wait_job(self, job_id: str, interval: float = 1) -> dict:
+        """ Poll a job every `interval` seconds until it is finished and return its state. """
+        while True:
+            state = self.get_job(job_id)
+            if 'status' not in state:  # unknown job
+                raise KeyError(state.get('error', job_id))
+            if state['status'] in ('done', 'failed', 'cancelled'):
+                return state
+            time.sleep(interval)
+
+
+class LabelBatch:
+    """
+    Label updates of a project waiting to be sent together through the
+    UPDATE_LABELS endpoint, once `batch_size` data are queued, on `flush` or at
+    the end of a with block. Updates of the same data are coalesced, only the
+    last one is sent. Updates of a failed flush are kept and sent with the next
+    one, unless the data was updated again in the meantime.
+
+    Args:
+        client (APIClient): Client sending the updates.
+        project_name (str): Project name.
+        batch_size (int, optional): Number of queued data triggering a flush,
+            only `flush` sends the updates if None.
+    """
+    def __init__(self, client: APIClient, project_name: str,
+                 batch_size: Optional[int] = BATCH_SIZE):
+        self.client = client
+        self.project_name = project_name
+        self.batch_size = batch_size
+        self._pending = {}  # index -> update
+        self._sending = {}  # index -> update of the flush in progress
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def __enter__(self) -> 'LabelBatch':
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def add(self, index: int, labels: List[str], verified: Optional[str] = None) -> Optional[dict]:
+        """
+        Queue a label update, replacing a queued update of the same data, and
+        flush the batch if it is full.
+
+        Args:
+            index (int): Data index.
+            labels (List[str]): New labels.
+            verified (str, optional): Verification datetime, the time of the
+                flush or '0' if `labels` is empty by default.
+
+        Returns:
+            Result of the flush if the batch was flushed, see `flush`, else None.
+        """
+        update = {'index': int(index), 'labels': list(labels)}
+        if verified is not None:
+            update['verified'] = verified
+        with self._lock:
+            self._pending.pop(update['index'], None)  # keep updates in order of arrival
+            self._pending[update['index']] = update
+            full = self.batch_size is not None and len(self._pending) >= self.batch_size
+        return self.flush() if full else None
+
+    def queued(self) -> Dict[int, dict]:
+        """ Return the updates not stored by the api yet, including those being sent, by data index. """
+        with self._lock:
+            return {**self._sending, **self._pending}
+
+    def flush(self) -> Optional[dict]:
+        """
+        Send the queued updates, None if there are none. Raise
+        requests.RequestException if they could not be sent, they stay queued
+        then, as on any other error.
+
+        Returns:
+            Status of each update and the new progress, see `api.update_labels`.
+        """
+        with self._lock:
+            updates, self._pending = self._pending, {}
+            self._sending = updates
+        if len(updates) == 0:
+            return None
+        try:
+            return self.client.update_labels(self.project_name, list(updates.values()))
+        except Exception:
+            with self._lock:  # newer updates of the same data win
+                self._pending = {**updates, **self._pending}
+            raise
+        finally:
+            with self._lock:
+                self._sending = {}
+
+
+class LabelWriter:
+    """
+    Write-behind queue of label updates, e.g. of an annotator session. `add`
+    returns at once, a background thread sends the queued updates of each
+    project through a `LabelBatch`, coalesced per data, after FLUSH_INTERVAL
+    seconds or as soon as `batch_size` are queued. A failed flush is retried with
+    exponential backoff, its error is kept in `error` until a flush succeeds.
+    Updates rejected by the api, one by one or as a whole batch, e.g. going over
+    the 63 labels of a project, are dropped rather than retried, their error is
+    kept in `error` too. The thread stops once the queue is empty and starts
+    again with the next update.
+
+    Args:
+        client (APIClient): Client sending the updates.
+        batch_size (int): Number of queued data of a project triggering a flush.
+        interval (float): Seconds to wait for more updates before sending them.
+    """
+    def __init__(self, client: APIClient, batch_size: int = BATCH_SIZE,
+                 interval: float = FLUSH_INTERVAL):
+        self.client = client
+        self.batch_size = batch_size
+        self.interval = interval
+        self.error = None  # message of the last failed flush, None once one succeeds
+        self._batches = {}  # project name -> LabelBatch
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()  # flushes in order, so newer updates win
+        self._wake = threading.Event()
+        self._thread = None
+
+    def add(self, project_name: str, index: int, labels: List[str], verified: Optional[str] = None):
+        """ Queue a label update, see `LabelBatch.add`. """
+        with self._lock:
+            batch = self._batches.get(project_name)
+            if batch is None:
+                batch = self._batches[project_name] = LabelBatch(self.client, project_name, None)
+            batch.add(index, labels, verified)
+            if len(batch) >= self.batch_size:
+                self._wake.set()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='label-writer', daemon=True)
+                self._thread.start()
+
+    def pending(self, project_name: Optional[str] = None) -> int:
+        """ Return the number of updates not stored by the api yet, of a project or of all projects. """
+        return sum(len(batch.queued()) for name, batch in list(self._batches.items())
+                   if project_name in (None, name))
+
+    def queued(self, project_name: str) -> Dict[int, dict]:
+        """ Return the updates of a project not stored by the api yet by data index, see `LabelBatch.queued`. """
+        batch = self._batches.get(project_name)
+        return {} if batch is None else batch.queued()
+
+    def flush(self, project_name: Optional[str] = None) -> Dict[str, dict]:
+        """
+        Send the queued updates of a project, or of all projects, and wait until
+        they are stored. Raise requests.RequestException if they could not be
+        sent, they stay queued then.
+
+        Returns:
+            Result of the flush of each project having queued updates, see
+            `api.update_labels`.
+        """
+        results = {}
+        with self._send_lock:
+            for name, batch in list(self._batches.items()):
+                if project_name not in (None, name):
+                    continue
+                try:
+                    result = batch.flush()
+                except requests.RequestException as e:
+                    self.error = str(e)
+                    raise
+                if result is None:
+                    continue
+                results[name] = result
+                if 'results' not in result:  # the whole batch was rejected, e.g. too many labels
+                    self.error = result.get('error') or 'label updates were rejected'
+                    continue
+                rejected = [x for x in result['results'] if not x['success']]
+                self.error = None if len(rejected) == 0 else \
+                    f'{len(rejected)} label updates were rejected: {rejected[0]["error"]}'
+        return results
+
+    def discard(self, project_name: str):
+        """ Drop the queued updates of a project, e.g. once it is deleted. """
+        with self._send_lock, self._lock:
+            self._batches.pop(project_name, None)
+
+    def _run(self):
+        failures = 0
+        while True:
+            self._wake.wait(min(self.interval * 2 ** failures, MAX_FLUSH_INTERVAL))
+            self._wake.clear()
+            try:
+                self.flush()
+                failures = 0
+            except requests.RequestException:
+                failures += 1
+            except Exception as e:  # e.g. an unexpected answer, the queue must keep being sent
+                self.error = str(e)
+                failures += 1
+            with self._lock:
+                if self.pending() == 0:
+                    self._thread = None
+                    return
+
+
+class AsyncAPIClient:
+    """
+    asyncio interface of an `APIClient`: every method of the client is a
+    coroutine here, e.g. `await client.get_data('my_project', 0)`. Requests
+    run in a pool of as many threads as the client has connections.
+
+    Args:
+        client (APIClient): Client sending the requests.
+    """
+    def __init__(self, client: APIClient):
+        self.client = client
+        self._executor = ThreadPoolExecutor(client.pool_size, thread_name_prefix='api-client')
+
+    @classmethod
+    def from_config(cls, config: str) -> 'AsyncAPIClient':
+        """ Create a client from the settings of a config file, see `APIClient.from_config`. """
+        return cls(APIClient.from_config(config))
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self.client, name)
+        if not callable(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        async def call(*args, **kwargs):
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, functools.partial(attribute, *args, **kwargs))
+        return call
+
+    async def __aenter__(self) -> 'AsyncAPIClient':
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        self.close()
+
+    def close(self):
+        """ Close the pooled connections and stop the threads. """
+        self._executor.shutdown(wait=False)
+        self.client.close()
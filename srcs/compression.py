@@ -0,0 +1,275 @@
+"""
+Compression of api responses negotiated through Accept-Encoding, gzip, deflate
+or zstd (requires zstandard), and decompression of request bodies sent with a
+Content-Encoding, e.g. chunks of large imports.
+"""
+import io
+import zlib
+from typing import Callable, Iterable, Iterator, Optional
+
+from flask import Response
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+MIN_BYTES = 1024  # responses smaller than this are not worth compressing
+LEVEL = 1  # zlib compression level of gzip and deflate, favouring speed
+ZSTD_LEVEL = 3
+MAX_BODY_BYTES = 2 ** 30  # max size of a decompressed request body
+READ_BYTES = 2 ** 16  # compressed bytes decompressed at a time
+ENCODINGS = ('zstd', 'gzip', 'deflate') if zstandard is not None else ('gzip', 'deflate')
+ERRORS = (zlib.error, ) if zstandard is None else (zlib.error, zstandard.ZstdError)
+
+
+class PlainTextError:
+    """ Mixin of http exceptions answered with their description in plain text, like the errors of `DecompressRequests`. """
+    def get_body(self, *args, **kwargs) -> str:
+        return self.description
+
+    def get_headers(self, *args, **kwargs) -> list:
+        return [('Content-Type', 'text/plain; charset=utf-8')]
+
+
+class BodyTooLarge(PlainTextError, RequestEntityTooLarge, ValueError):
+    """ A request body decompressing to more than the allowed size, answered with 413. """
+
+
+class CorruptBody(PlainTextError, BadRequest, ValueError):
+    """ A request body which cannot be decompressed, answered with 400. """
+
+
+def compressor(encoding: str, level: int = LEVEL):
+    """ Return a compression object of an encoding, with `compress` and `flush` methods. """
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    if encoding == 'gzip':
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS)  # zlib format, as http deflate
+
+
+def decompressor(encoding: str):
+    """ Return a decompression object of an encoding, raise ValueError if it is not supported. """
+    if encoding == 'zstd' and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompressobj()
+    if encoding in ('gzip', 'x-gzip'):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        return zlib.decompressobj(zlib.MAX_WBITS)
+    raise ValueError(f'unsupported content encoding "{encoding}"')
+
+
+def compress(data: bytes, encoding: str, level: int = LEVEL) -> bytes:
+    """ Compress data with an encoding. """
+    c = compressor(encoding, level)
+    return c.compress(data) + c.flush()
+
+
+def decompress(data: bytes, encoding: str, max_bytes: int = MAX_BODY_BYTES) -> bytes:
+    """
+    Decompress data sent with an encoding. Raise ValueError if the encoding is not
+    supported, CorruptBody if the data is corrupt, BodyTooLarge if it
+    decompresses to more than `max_bytes`.
+    """
+    d = decompressor(encoding)
+    out, size = [], 0
+    try:
+        for start in range(0, len(data), READ_BYTES):
+            piece = d.decompress(data[start:start + READ_BYTES])
+            size += len(piece)
+            if size > max_bytes:
+                raise BodyTooLarge(f'request body exceeds {max_bytes} bytes once decompressed')
+            out.append(piece)
+        if hasattr(d, 'flush'):
+            out.append(d.flush())
+    except ERRORS as e:
+        raise CorruptBody(f'corrupt {encoding} request body: {e}')
+    return b''.join(out)
+
+
+class LimitedInput:
+    """
+    Compressed body of a request read from its WSGI input stream, which must not
+    be read past its Content-Length.
+
+    Args:
+        stream: WSGI input stream.
+        length (int, optional): Size of the body, None if the stream ends with it.
+    """
+    def __init__(self, stream, length: Optional[int]):
+        self.stream = stream
+        self.remaining = length
+
+    def read(self, size: int = READ_BYTES) -> bytes:
+        if self.remaining is None:
+            return self.stream.read(size)
+        data = self.stream.read(min(size, self.remaining)) if self.remaining > 0 else b''
+        self.remaining -= len(data)
+        return data
+
+
+class DecompressedInput(io.RawIOBase):
+    """
+    Request body decompressed as it is read, at most READ_BYTES compressed bytes
+    at a time, so a large body is never held in memory as a whole. Raise
+    CorruptBody if it is corrupt, BodyTooLarge once more than `max_bytes` are
+    read.
+
+    Args:
+        source (LimitedInput): Compressed body.
+        encoding (str): Content encoding of the body.
+        max_bytes (int): Max size of the decompressed body.
+    """
+    def __init__(self, source: LimitedInput, encoding: str, max_bytes: int = MAX_BODY_BYTES):
+        self.source = source
+        self.encoding = encoding
+        self.max_bytes = max_bytes
+        self.size = 0
+        if encoding == 'zstd' and zstandard is not None:
+            self.zstd = zstandard.ZstdDecompressor().stream_reader(source, read_size=READ_BYTES)
+        else:
+            self.zstd = None
+            self.decompressor = decompressor(encoding)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        try:
+            data = self.decompress(len(buffer))
+        except ERRORS as e:
+            raise CorruptBody(f'corrupt {self.encoding} request body: {e}')
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise BodyTooLarge(f'request body exceeds {self.max_bytes} bytes once decompressed')
+        buffer[:len(data)] = data
+        return len(data)
+
+    def decompress(self, size: int) -> bytes:
+        """ Return up to `size` decompressed bytes, b'' at the end of the body. """
+        if self.zstd is not None:
+            return self.zstd.read(size)
+        d = self.decompressor
+        while True:
+            data = d.unconsumed_tail or (b'' if d.eof else self.source.read(READ_BYTES))
+            if len(data) == 0:
+                if not d.eof:
+                    raise zlib.error('incomplete or truncated stream')
+                return b''
+            piece = d.decompress(data, size)
+            if len(piece) > 0:
+                return piece
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """
+    Return the encoding to compress a response with according to an
+    Accept-Encoding header, the supported one with the highest quality, None if
+    it should not be compressed.
+    """
+    qualities = {}
+    for part in accept_encoding.lower().split(','):
+        name, _, params = part.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        qualities[name.strip()] = q
+    best, best_q = None, 0.0
+    for encoding in ENCODINGS:  # ties go to the first, i.e. the best compression
+        q = qualities.get(encoding, qualities.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress_stream(chunks: Iterable[bytes], encoding: str, level: int = LEVEL) -> Iterator[bytes]:
+    """ Compress a streamed response chunk by chunk. """
+    c = compressor(encoding, level)
+    try:
+        for chunk in chunks:
+            piece = c.compress(chunk)
+            if piece:
+                yield piece
+        yield c.flush()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def compress_response(response: Response, accept_encoding: str, min_bytes: int = MIN_BYTES,
+                      level: int = LEVEL) -> Response:
+    """
+    Compress a response in place with the encoding negotiated from the
+    Accept-Encoding header of its request. Streamed responses, e.g. exports, are
+    compressed as they are generated, others only if at least `min_bytes` long.
+
+    Args:
+        response (Response): Response of a route.
+        accept_encoding (str): Accept-Encoding header of the request.
+        min_bytes (int): Min size of a response to be compressed.
+        level (int): zlib compression level of gzip and deflate.
+    """
+    if response.status_code < 200 or response.status_code in (204, 206, 304) or \
+            'Content-Encoding' in response.headers or response.direct_passthrough:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate(accept_encoding)
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = compress_stream(response.iter_encoded(), encoding, level)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < min_bytes:
+            return response
+        response.set_data(compress(data, encoding, level))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+class DecompressRequests:
+    """
+    WSGI middleware decompressing request bodies sent with a Content-Encoding as
+    routes read them, see `DecompressedInput`. Bodies with an unsupported
+    encoding or an invalid Content-Length are answered with 400, bodies without a
+    Content-Length, e.g. chunked, with 411 unless the server marks where they
+    end.
+
+    Args:
+        app (Callable): WSGI application.
+        max_bytes (int): Max size of a decompressed request body.
+    """
+    def __init__(self, app: Callable, max_bytes: int = MAX_BODY_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    def __call__(self, environ: dict, start_response: Callable):
+        encoding = environ.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+        if encoding in ('', 'identity'):
+            return self.app(environ, start_response)
+        length = environ.get('CONTENT_LENGTH') or None
+        if length is None and not environ.get('wsgi.input_terminated'):
+            return Response('compressed request body without Content-Length',
+                            status=411)(environ, start_response)
+        try:
+            if length is not None:
+                if not length.isdigit():
+                    raise ValueError(f'invalid Content-Length "{length}"')
+                length = int(length)
+            body = DecompressedInput(LimitedInput(environ['wsgi.input'], length), encoding,
+                                     self.max_bytes)
+        except ValueError as e:
+            return Response(str(e), status=400)(environ, start_response)
+        # the size of the decompressed body is unknown, routes read it until its end
+        environ = {**environ, 'wsgi.input': io.BufferedReader(body, READ_BYTES),
+                   'wsgi.input_terminated': True}
+        environ.pop('CONTENT_LENGTH', None)
+        del environ['HTTP_CONTENT_ENCODING']
+        return self.app(environ, start_response)
@@ -0,0 +1,111 @@
+import os
+from typing import Iterable, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from srcs import utils
+
+
+def text_hashes(texts: List[str]) -> np.ndarray:
+    """
+    Return 64-bit hashes of texts normalized to lower case with whitespaces
+    collapsed, so texts differing only in case or spacing are duplicates.
+
+    Args:
+        texts (List[str]): Texts to be hashed.
+    """
+    texts = pd.Series(texts, dtype=object).astype(str)
+    texts = texts.str.lower().str.strip().str.replace(r'\s+', ' ', regex=True)
+    return pd.util.hash_pandas_object(texts, index=False).to_numpy(dtype='uint64')
+
+
+class HashIndex:
+    """
+    Persistent index from text hashes to row indices of a project, used to find
+    duplicated texts on import without reading the texts. Hashes are kept sorted
+    in a packed uint64 file with the row indices in a parallel int64 file, which
+    are memory-mapped and binary searched. New hashes go to a small sorted delta
+    level first, which is merged into the base level once it grows beyond an
+    eighth of it, so an import does not rewrite the whole index.
+
+    Args:
+        folder (str): Directory keeping the index files.
+    """
+    LEVELS = ('hashes', 'hashes.delta')
+
+    def __init__(self, folder: str):
+        self.folder = folder
+
+    def _paths(self, level: str) -> Tuple[str, str]:
+        return (os.path.join(self.folder, f'{level}.u64'),
+                os.path.join(self.folder, f'{level}.rows.i64'))
+
+    def exists(self) -> bool:
+        """ Check if the index has been built. """
+        return os.path.exists(self._paths(self.LEVELS[0])[0])
+
+    def _read(self, level: str, mmap: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        hash_path, row_path = self._paths(level)
+        if not os.path.exists(hash_path) or os.path.getsize(hash_path) == 0:
+            return np.empty(0, dtype='uint64'), np.empty(0, dtype='int64')
+        if mmap:
+            return (np.memmap(hash_path, dtype='uint64', mode='r'),
+                    np.memmap(row_path, dtype='int64', mode='r'))
+        return np.fromfile(hash_path, dtype='uint64'), np.fromfile(row_path, dtype='int64')
+
+    def _write(self, level: str, hashes: np.ndarray, rows: np.ndarray):
+        os.makedirs(self.folder, exist_ok=True)
+        for path, array in zip(self._paths(level), (hashes, rows)):
+            with utils.atomic_path(path) as tmp:
+                array.tofile(tmp)
+
+    def lookup(self, hashes: np.ndarray) -> np.ndarray:
+        """ Return the row index of each hash already in the index, -1 if not found. """
+        rows = np.full(len(hashes), -1, dtype='int64')
+        for level in self.LEVELS:
+            level_hashes, level_rows = self._read(level, mmap=True)
+            if len(level_hashes) == 0:
+                continue
+            pos = np.searchsorted(level_hashes, hashes).clip(max=len(level_hashes) - 1)
+            found = (level_hashes[pos] == hashes) & (rows < 0)
+            rows[found] = level_rows[pos[found]]
+        return rows
+
+    def add(self, hashes: np.ndarray, rows: np.ndarray):
+        """ Add hashes of new rows to the index. """
+        base_hashes, base_rows = self._read(self.LEVELS[0], mmap=True)
+        delta_hashes, delta_rows = self._read(self.LEVELS[1])
+        delta_hashes = np.concatenate([delta_hashes, hashes.astype('uint64')])
+        delta_rows = np.concatenate([delta_rows, rows.astype('int64')])
+        order = np.argsort(delta_hashes, kind='mergesort')
+        if len(delta_hashes) > max(2 ** 16, len(base_hashes) // 8):
+            self.rebuild([(np.concatenate([base_hashes, delta_hashes]),
+                           np.concatenate([base_rows, delta_rows]))])
+        else:
+            if not self.exists():
+                self._write(self.LEVELS[0], base_hashes, base_rows)
+            self._write(self.LEVELS[1], delta_hashes[order], delta_rows[order])
+
+    def truncate(self, total: int):
+        """ Drop hashes of rows from index `total` onwards. """
+        for level in self.LEVELS:
+            hashes, rows = self._read(level)
+            if (rows >= total).any():
+                self._write(level, hashes[rows < total], rows[rows < total])
+
+    def rebuild(self, chunks: Iterable[Tuple[np.ndarray, np.ndarray]]):
+        """ Replace the index with chunks of (hashes, row indices). """
+        chunks = list(chunks)
+        hashes = np.concatenate([np.empty(0, dtype='uint64')] + [c[0] for c in chunks])
+        rows = np.concatenate([np.empty(0, dtype='int64')] + [c[1] for c in chunks])
+        order = np.argsort(hashes, kind='mergesort')
+        self._write(self.LEVELS[0], hashes[order].astype('uint64'), rows[order].astype('int64'))
+        self._write(self.LEVELS[1], np.empty(0, dtype='uint64'), np.empty(0, dtype='int64'))
+
+    def remove(self):
+        """ Delete the index files. """
+        for level in self.LEVELS:
+            for path in self._paths(level):
+                if os.path.exists(path):
+                    os.remove(path)
@@ -0,0 +1,50 @@
+"""
+Formatting of exported data, shared by the export route, which streams it, and
+the export jobs, which write it to a file.
+"""
+import json
+from typing import Iterable, Iterator, List
+
+import pandas as pd
+
+from srcs import metrics
+from srcs.storage import bitmask
+
+FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}  # file format: mimetype
+CHUNK_SIZE = 10000  # number of rows formatted at a time
+
+
+def format_rows(chunks: Iterable[pd.DataFrame], vocabulary: List[str], file_format: str) -> Iterator[str]:
+    """
+    Format chunks of rows as csv with "text", "verified" and comma separated
+    "label" columns, or as json lines of {"text": str, "verified": str,
+    "label": List[str]}.
+
+    Args:
+        chunks (Iterable[pd.DataFrame]): Chunks of rows, see `Storage.iter_rows`.
+        vocabulary (List[str]): Labels of the bits of the label masks.
+        file_format (str): "csv" or "jsonl".
+
+    Returns:
+        Formatted pieces of the file, the csv header first, Iterator[str].
+    """
+    if file_format == 'csv':
+        yield 'text,verified,label\n'
+    for df in chunks:
+        if file_format == 'csv':
+            df = pd.DataFrame({
+                'text': df['texts'],
+                'verified': df['verified'],
+                'label': bitmask.join_all(df['mask'], vocabulary, ', '),
+            })
+            with metrics.csv_timer('to_csv', 'export'):
+                chunk = df.to_csv(index=False, header=False)
+            yield chunk
+            continue
+        labels = bitmask.decode_all(df['mask'], vocabulary)
+        for text, verified, mask in zip(df.texts, df.verified, df['mask']):
+            yield json.dumps({
+                'text': text,
+                'verified': verified,
+                'label': labels[mask],
+            }, ensure_ascii=False) + '\n'
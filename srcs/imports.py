@@ -0,0 +1,248 @@
+import io
+import os
+import json
+import shutil
+import time
+from concurrent.futures import Executor
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+from srcs import metrics, search, utils
+from srcs.dedup import HashIndex, text_hashes
+from srcs.locks import RWLock
+from srcs.search import SearchIndex
+from srcs.storage.base import Storage
+
+FOLDER = '.imports'  # folder of the upload states under the project directory
+INDEX_CHUNK_SIZE = 10000  # number of rows hashed at a time when building a hash index
+SEARCH_CHUNK_SIZE = 50000  # number of texts tokenized by a worker at a time
+
+
+class ImportTracker:
+    """
+    Keep the state of chunked uploads, one json file per upload, so an interrupted
+    upload resumes from its last committed chunk. Before a chunk is appended the
+    number of rows is recorded as pending, if the chunk never gets committed the
+    rows appended after that point are dropped when the chunk is sent again.
+
+    Args:
+        state_dir (str): Directory keeping the upload states.
+    """
+    def __init__(self, state_dir: str):
+        self.state_dir = state_dir
+        # serializes chunks of all uploads, across processes
+        self.lock = RWLock(os.path.join(state_dir, 'imports.lock'))
+
+    def _path(self, project_name: str, upload_id: str) -> str:
+        return os.path.join(self.state_dir, project_name, f'{upload_id}.json')
+
+    def status(self, project_name: str, upload_id: str) -> dict:
+        """
+        Return the state of an upload.
+
+        Returns:
+            {
+                'upload_id': Upload id, str,
+                'next_seq': Sequence number of the next chunk expected, int,
+                'rows': Number of rows ingested so far, int,
+                'duplicates': Number of duplicated texts skipped so far, int,
+                'seconds': Time spent ingesting the rows, float,
+                'pending': Number of rows before the chunk being appended, Optional[int],
+            }
+        """
+        try:
+            with open(self._path(project_name, upload_id), 'r') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {'upload_id': upload_id, 'next_seq': 0, 'rows': 0, 'duplicates': 0,
+                    'seconds': 0.0, 'pending': None}
+
+    def _save(self, project_name: str, state: dict):
+        path = self._path(project_name, state['upload_id'])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with utils.atomic_path(path) as tmp, open(tmp, 'w') as file:
+            json.dump(state, file)
+
+    def begin(self, project_name: str, state: dict, total: int):
+        """ Record that the next chunk is being appended after `total` rows. """
+        state['pending'] = total
+        self._save(project_name, state)
+
+    def commit(self, project_name: str, state: dict, rows: int, seconds: float,
+               duplicates: int = 0):
+        """ Record that the pending chunk of `rows` rows has been appended. """
+        state['next_seq'] += 1
+        state['rows'] += rows
+        state['duplicates'] += duplicates
+        state['seconds'] += seconds
+        state['pending'] = None
+        state['updated'] = time.time()
+        self._save(project_name, state)
+
+    def discard(self, project_name: str, upload_id: Optional[str] = None):
+        """ Drop the state of an upload, or of all uploads of a project. """
+        if upload_id is not None:
+            try:
+                os.remove(self._path(project_name, upload_id))
+            except FileNotFoundError:
+                pass
+        else:
+            shutil.rmtree(os.path.join(self.state_dir, project_name), ignore_errors=True)
+
+
+def parse_texts(body: bytes, content_type: str, column: str = None) -> list:
+    """
+    Parse texts from a chunk of csv (content type "text/csv") or json lines, where
+    each line is either a string or an object with a "text" field.
+
+    Args:
+        body (bytes): Chunk of rows.
+        content_type (str): Content type of the chunk.
+        column (str, optional): Csv column containing the texts, the first column
+                                if not given.
+    """
+    if content_type.startswith('text/csv'):
+        with metrics.csv_timer('read_csv', 'import'):
+            df = pd.read_csv(io.BytesIO(body), dtype=str, keep_default_na=False)
+        return df[column or df.columns[0]].to_list()
+    texts = []
+    for line in body.decode('utf-8').splitlines():
+        if line.strip():
+            row = json.loads(line)
+            texts.append(row['text'] if isinstance(row, dict) else row)
+    return texts
+
+
+def hash_index(storage: Storage, folder: str, project_name: str) -> HashIndex:
+    """ Return the text hash index of a project, building it for data added before it existed. """
+    index = HashIndex(os.path.join(folder, project_name))
+    if not index.exists() and (storage.count(project_name) or 0) > 0:
+        chunks, offset = [], 0
+        for df in storage.iter_rows(project_name, chunk_size=INDEX_CHUNK_SIZE):
+            chunks.append((text_hashes(df.texts.to_list()), np.arange(offset, offset + len(df))))
+            offset += len(df)
+        index.rebuild(chunks)
+    return index
+
+
+def tokenize_texts(texts: list, offset: int = 0, pool: Callable[[], Executor] = None) -> list:
+    """
+    Tokenize texts of consecutive rows for the search index, in chunks spread
+    over a worker pool if there is more than one chunk.
+
+    Args:
+        texts (list): Texts to be indexed.
+        offset (int): Row index of the first text.
+        pool (Callable, optional): Function returning the worker pool, chunks are
+                                   tokenized in this process if None.
+
+    Returns:
+        (postings, token counts) of each chunk, see `search.tokenize`.
+    """
+    starts = range(0, len(texts), SEARCH_CHUNK_SIZE)
+    if len(starts) <= 1:
+        return [search.tokenize(texts, offset)]
+    chunks = [texts[i:i + SEARCH_CHUNK_SIZE] for i in starts]
+    if pool is None:
+        return [search.tokenize(chunk, offset + i) for chunk, i in zip(chunks, starts)]
+    return list(pool().map(search.tokenize, chunks, [offset + i for i in starts]))
+
+
+def search_index(storage: Storage, folder: str, project_name: str,
+                 pool: Callable[[], Executor] = None) -> SearchIndex:
+    """ Return the search index of a project, building it for data added before it existed. """
+    index = SearchIndex(os.path.join(folder, project_name))
+    if not index.exists() and (storage.count(project_name) or 0) > 0:
+        chunks, offset = [], 0
+        for df in storage.iter_rows(project_name, chunk_size=SEARCH_CHUNK_SIZE):
+            texts = df.texts.to_list()
+            chunks.append(pool().submit(search.tokenize, texts, offset) if pool is not None
+                          else search.tokenize(texts, offset))
+            offset += len(df)
+        index.rebuild(chunk.result() if pool is not None else chunk for chunk in chunks)
+    return index
+
+
+def find_duplicates(texts: list, index: HashIndex = None) -> tuple:
+    """
+    Hash texts and mark the ones to be added, i.e. which are neither in the hash
+    index nor repeating an earlier text of the same list.
+
+    Args:
+        texts (list): Texts to be added.
+        index (HashIndex, optional): Hash index of existing texts.
+
+    Returns:
+        Hashes of the texts, np.ndarray, and boolean mask of texts to be added, np.ndarray.
+    """
+    hashes = text_hashes(texts)
+    keep = ~pd.Series(hashes).duplicated().to_numpy()
+    if index is not None:
+        keep &= index.lookup(hashes) < 0
+    return hashes, keep
+
+
+def append_chunk(storage: Storage, tracker: ImportTracker, folder: str, project_name: str,
+                 state: dict, texts: list, keep_duplicates: bool = False,
+                 pool: Callable[[], Executor] = None) -> dict:
+    """
+    Append the next chunk of an upload to a project and its indexes, skipping
+    duplicated texts unless `keep_duplicates`. The caller holds `tracker.lock`.
+
+    Args:
+        storage (Storage): Storage engine.
+        tracker (ImportTracker): Tracker of the upload.
+        folder (str): Project directory, keeping the indexes of the projects.
+        project_name (str): Project name.
+        state (dict): State of the upload, see `ImportTracker.status`, updated.
+        texts (list): Texts of the chunk.
+        keep_duplicates (bool): Add duplicated texts too if True.
+        pool (Callable, optional): Function returning the pool tokenizing texts.
+
+    Returns:
+        {
+            'total': Number of data in the project, int,
+            'new': Number of texts added, int,
+            'duplicates': Number of duplicated texts skipped, int,
+            'seconds': Time taken, float,
+        }
+    """
+    start = time.perf_counter()
+    index = hash_index(storage, folder, project_name)
+    words = search_index(storage, folder, project_name, pool)
+    if state['pending'] is not None:  # drop rows of an interrupted attempt
+        storage.truncate(project_name, state['pending'])
+        index.truncate(state['pending'])
+        words.truncate(state['pending'])
+    hashes, keep = find_duplicates(texts, index)
+    if keep_duplicates:
+        keep[:] = True
+    n_rows = storage.count(project_name) or 0
+    tracker.begin(project_name, state, n_rows)
+    texts = [text for text, k in zip(texts, keep) if k]
+    total = storage.append_texts(project_name, texts)
+    index.add(hashes[keep], n_rows + np.arange(keep.sum()))
+    for postings, lengths in tokenize_texts(texts, n_rows, pool):
+        words.add(postings, lengths)
+    seconds = time.perf_counter() - start
+    tracker.commit(project_name, state, int(keep.sum()), seconds, int((~keep).sum()))
+    return {'total': total, 'new': int(keep.sum()), 'duplicates': int((~keep).sum()), 'seconds': seconds}
+
+
+def delete_project(storage: Storage, tracker: ImportTracker, folder: str, project_name: str):
+    """
+    Delete a project with the state of its uploads and the indexes kept next to
+    its data, once no import or index build of the project is going on.
+
+    Args:
+        storage (Storage): Storage engine.
+        tracker (ImportTracker): Tracker of the uploads.
+        folder (str): Project directory, keeping the indexes of the projects.
+        project_name (str): Project name.
+    """
+    with tracker.lock:
+        storage.delete_project(project_name)
+        tracker.discard(project_name)
+        shutil.rmtree(os.path.join(folder, project_name), ignore_errors=True)
@@ -0,0 +1,439 @@
+"""
+Background jobs of the api: imports, exports and deletions of projects run in a
+pool of JOB_WORKERS processes instead of the request thread, which answers at
+once with the id of the job. The state of each job is kept in
+"<PROJECT_DIR>/.jobs/<job id>.json" and updated by the process running it, so
+any api worker reports its progress. Files of a job, i.e. the uploaded file of
+an import or the file written by an export, are kept in the folder of the same
+name until the job is deleted or finished for more than JOB_TTL_S seconds. A
+job is cancelled with a flag file, checked between the chunks of its work.
+Updates of the state of a job hold its lock, "<job id>.lock", and leave it
+unchanged once the job is finished.
+"""
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import Executor, Future
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterable, Iterator, List, Optional
+
+import pandas as pd
+
+from srcs import exports, imports, metrics, utils
+from srcs.locks import RWLock
+from srcs.storage import load_storage
+from srcs.storage.base import Storage
+
+FOLDER = '.jobs'  # folder of the jobs under the project directory
+UPLOAD = 'upload'  # name of the uploaded file of an import job
+FINISHED = ('done', 'failed', 'cancelled')
+TTL = 86400  # seconds finished jobs and their files are kept
+PROGRESS_INTERVAL = 0.5  # min seconds between two progress updates written by a job
+IMPORT_CHUNK_SIZE = 20000  # number of texts appended at a time by an import job
+JOB_ID = re.compile(r'[0-9a-f]{32}')
+STORAGE = None  # storage engine of a job process, created by its first job
+
+logger = logging.getLogger(__name__)
+
+
+class Cancelled(Exception):
+    """ Raised in a job which has been cancelled. """
+
+
+def alive(pid: int) -> bool:
+    """ Check if a process is running. """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # running as another user
+        return True
+    return True
+
+
+class Job:
+    """
+    A job as seen by the function running it, to read its parameters, keep its
+    files, report its progress and find out if it is cancelled.
+
+    Args:
+        folder (str): Folder of the jobs.
+        job_id (str): Job id.
+    """
+    def __init__(self, folder: str, job_id: str):
+        self.folder = folder
+        self.job_id = job_id
+        self.lock = RWLock(os.path.join(folder, f'{job_id}.lock'))
+        self.reported = 0.0
+        self.done, self.total = 0, None  # last progress reported
+
+    def path(self, name: str = '') -> str:
+        """ Return the path to a file of the job. """
+        return os.path.join(self.folder, self.job_id, name)
+
+    def load(self) -> dict:
+        """ Return the state of the job, raise FileNotFoundError if it was deleted. """
+        with open(os.path.join(self.folder, f'{self.job_id}.json'), 'r') as file:
+            return json.load(file)
+
+    def update(self, only_if: Optional[str] = None, **fields) -> dict:
+        """
+        Update fields of the state of the job and return it. The state of a
+        finished job, or of a job whose status is not `only_if` if given, is
+        returned unchanged, so the api and the job process do not overwrite the
+        status set by each other.
+        """
+        with self.lock:
+            state = self.load()
+            if state['status'] in FINISHED or only_if not in (None, state['status']):
+                return state
+            state.update(fields)
+            with utils.atomic_path(os.path.join(self.folder, f'{self.job_id}.json')) as tmp, \
+                    open(tmp, 'w') as file:
+                json.dump(state, file)
+        return state
+
+    def cancelled(self) -> bool:
+        """ Check if the job has been cancelled. """
+        return os.path.exists(os.path.join(self.folder, f'{self.job_id}.cancel'))
+
+    def progress(self, done: int, total: Optional[int]):
+        """ Report the amount of work done, at most every PROGRESS_INTERVAL seconds, raise Cancelled if cancelled. """
+        self.done, self.total = done, total
+        if self.cancelled():
+            raise Cancelled()
+        if time.monotonic() - self.reported >= PROGRESS_INTERVAL:
+            self.reported = time.monotonic()
+            self.update(done=done, total=total)
+
+
+def init_worker(project_dir: str):
+    """ Start the metrics of a job process, saved to the project directory like those of the api workers. """
+    metrics.REGISTRY = metrics.Registry()
+    metrics.configure(project_dir)
+
+
+def run_job(config: dict, folder: str, job_id: str):
+    """ Run a job in a job process, recording its outcome in its state. """
+    global STORAGE
+    job = Job(folder, job_id)
+    try:
+        state = job.load()
+    except FileNotFoundError:  # deleted while queued
+        return
+    if job.cancelled():
+        job.update(status='cancelled', finished=time.time())
+        return
+    if job.update(only_if='queued', status='running', pid=os.getpid(),
+                  started=time.time())['status'] != 'running':
+        return  # cancelled meanwhile
+    try:
+        if STORAGE is None:
+            STORAGE = load_storage(config)
+        result = RUNNERS[state['kind']](job, STORAGE, config['PROJECT_DIR'], state)
+    except Cancelled:
+        job.update(status='cancelled', done=job.done, total=job.total, finished=time.time())
+    except Exception as e:
+        logger.exception('Job %s failed', job_id)
+        job.update(status='failed', error=str(e), finished=time.time())
+    else:
+        job.update(status='done', result=result, finished=time.time())
+    finally:
+        metrics.REGISTRY.save(force=True)
+
+
+def read_texts(path: str, content_type: str, column: Optional[str], chunk_size: int) -> Iterator[list]:
+    """ Read the texts of an uploaded csv or json lines file in chunks, see `imports.parse_texts`. """
+    if content_type.startswith('text/csv'):
+        for df in pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=chunk_size):
+            yield df[column or df.columns[0]].to_list()
+        return
+    with open(path, 'rb') as file:
+        while True:
+            lines = file.readlines(chunk_size * 100)  # about 100 bytes per text
+            if len(lines) == 0:
+                return
+            yield imports.parse_texts(b''.join(lines), content_type)
+
+
+def count_lines(path: str) -> int:
+    """ Return the number of lines of a file. """
+    with open(path, 'rb') as file:
+        return sum(block.count(b'\n') for block in iter(lambda: file.read(2 ** 20), b''))
+
+
+def import_job(job: Job, storage: Storage, project_dir: str, state: dict) -> dict:
+    """
+    Append the texts of the uploaded file of an import job to its project, like
+    the chunks of an upload, see `api.import_chunk`. Chunks appended before a
+    cancellation are kept.
+
+    Returns:
+        {
+            'new': Number of texts added, int,
+            'duplicates': Number of duplicated texts skipped, int,
+            'total': Number of data in the project, int,
+        }
+    """
+    project_name, params = state['project'], state['params']
+    path = job.path(UPLOAD)
+    total = count_lines(path) - params['content_type'].startswith('text/csv')  # header
+    tracker = imports.ImportTracker(os.path.join(project_dir, imports.FOLDER))
+    result = {'new': 0, 'duplicates': 0, 'total': storage.count(project_name) or 0}
+    done = 0
+    try:
+        for texts in read_texts(path, params['content_type'], params.get('column'), IMPORT_CHUNK_SIZE):
+            job.progress(done, total)
+            with tracker.lock:
+                upload = tracker.status(project_name, job.job_id)
+                chunk = imports.append_chunk(storage, tracker, project_dir, project_name, upload, texts,
+                                             params.get('keep_duplicates', False))
+            done += len(texts)
+            result = {'new': result['new'] + chunk['new'],
+                      'duplicates': result['duplicates'] + chunk['duplicates'], 'total': chunk['total']}
+    finally:
+        tracker.discard(project_name, job.job_id)
+        os.remove(path)  # only needed while importing
+    job.update(done=done, total=done)
+    return result
+
+
+def export_job(job: Job, storage: Storage, project_dir: str, state: dict) -> dict:
+    """
+    Write all data or just labeled data of a project to a file of the job, see
+    `api.export_data`.
+
+    Returns:
+        {
+            'file': Name of the exported file, str,
+            'rows': Number of data exported, int,
+            'bytes': Size of the file, int,
+        }
+    """
+    project_name, params = state['project'], state['params']
+    labeled_only = params['all_or_labeled'] == 'labeled'
+    stats = storage.get_stats(project_name) or {'total': 0, 'labeled': 0}
+    total = stats['labeled' if labeled_only else 'total']
+    done = 0
+
+    def counted(chunks: Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+        nonlocal done
+        for df in chunks:
+            job.progress(done, total)
+            yield df
+            done += len(df)
+
+    filename = f'{project_name}_{params["all_or_labeled"]}.{params["format"]}'
+    chunks = storage.iter_rows(project_name, labeled_only, exports.CHUNK_SIZE) \
+        if storage.count(project_name) else []
+    with utils.atomic_path(job.path(filename)) as tmp, open(tmp, 'w', encoding='utf-8', newline='') as file:
+        for piece in exports.format_rows(counted(chunks), storage.get_vocabulary(project_name),
+                                         params['format']):
+            file.write(piece)
+    job.update(done=done, total=done)
+    return {'file': filename, 'rows': done, 'bytes': os.path.getsize(job.path(filename))}
+
+
+def delete_job(job: Job, storage: Storage, project_dir: str, state: dict) -> dict:
+    """ Delete a project with its indexes and uploads, see `imports.delete_project`. It is not cancelled once started. """
+    job.update(done=0, total=1)
+    tracker = imports.ImportTracker(os.path.join(project_dir, imports.FOLDER))
+    imports.delete_project(storage, tracker, project_dir, state['project'])
+    job.update(done=1)
+    return {}
+
+
+RUNNERS = {'import': import_job, 'export': export_job, 'delete': delete_job}
+
+
+class JobQueue:
+    """
+    Jobs of the api, run by a pool of processes started on the first job. Jobs
+    of the other api workers sharing the folder are listed and cancelled too,
+    but only run by the pool of the worker they were submitted to, a job whose
+    worker or process stopped is reported as failed.
+
+    Args:
+        folder (str): Folder of the jobs.
+        config (dict): Config of the api, to create the storage engine of job processes.
+        workers (int): Number of job processes.
+        ttl (float): Seconds finished jobs and their files are kept.
+    """
+    def __init__(self, folder: str, config: dict, workers: int = 1, ttl: float = TTL):
+        self.folder = folder
+        self.config = config
+        self.workers = workers
+        self.ttl = ttl
+        self.pool: Optional[Executor] = None
+        self.lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def _submit(self, job_id: str) -> Future:
+        with self.lock:
+            for _ in range(2):
+                if self.pool is None:
+                    from concurrent.futures import ProcessPoolExecutor  # only needed by jobs
+                    # not forked from the api, whose threads may hold locks, e.g. the warm-up
+                    context = multiprocessing.get_context(
+                        'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+                    self.pool = ProcessPoolExecutor(self.workers, mp_context=context, initializer=init_worker,
+                                                    initargs=(self.config['PROJECT_DIR'], ))
+                try:
+                    return self.pool.submit(run_job, self.config, self.folder, job_id)
+                except BrokenProcessPool:  # a job process was killed, e.g. out of memory
+                    self.pool = None
+            raise BrokenProcessPool('failed to start job processes')
+
+    def submit(self, kind: str, project_name: str, upload: Optional[Iterable[bytes]] = None,
+               **params) -> dict:
+        """
+        Queue a job.
+
+        Args:
+            kind (str): "import", "export" or "delete".
+            project_name (str): Project name.
+            upload (Iterable[bytes], optional): Content of the file imported by an import job.
+            params: Parameters of the job, e.g. the format of an export.
+
+        Returns:
+            State of the job, see `status`.
+        """
+        self.expire()
+        job = Job(self.folder, uuid.uuid4().hex)
+        os.makedirs(job.path())
+        if upload is not None:
+            try:
+                with open(job.path(UPLOAD), 'wb') as file:
+                    for block in upload:
+                        file.write(block)
+            except BaseException:  # e.g. an invalid body or a client gone
+                shutil.rmtree(job.path(), ignore_errors=True)
+                raise
+        state = {
+            'id': job.job_id,
+            'kind': kind,
+            'project': project_name,
+            'params': params,
+            'status': 'queued',
+            'done': 0,
+            'total': None,
+            'created': time.time(),
+            'started': None,
+            'finished': None,
+            'owner': os.getpid(),
+            'pid': None,
+            'error': None,
+            'result': None,
+        }
+        with utils.atomic_path(os.path.join(self.folder, f'{job.job_id}.json')) as tmp, \
+                open(tmp, 'w') as file:
+            json.dump(state, file)
+        try:
+            future = self._submit(job.job_id)
+        except BrokenProcessPool as e:
+            return job.update(status='failed', error=str(e), finished=time.time())
+        future.add_done_callback(lambda f: self._crashed(job, f))
+        return self.status(job.job_id)
+
+    def _crashed(self, job: Job, future: Future):
+        # run_job records its own errors, this is a job process dying
+        if future.cancelled() or future.exception() is None:
+            return
+        try:
+            job.update(status='failed', error=str(future.exception()) or 'job process died',
+                       finished=time.time())
+        except FileNotFoundError:
+            pass
+
+    def status(self, job_id: str) -> Optional[dict]:
+        """
+        Return the state of a job, None if unknown.
+
+        Returns:
+            {
+                'id': Job id, str
+                'kind': "import", "export" or "delete", str
+                'project': Project name, str
+                'params': Parameters of the job, dict
+                'status': "queued", "running", "done", "failed" or "cancelled", str
+                'done': Number of rows processed, int
+                'total': Number of rows to process, Optional[int]
+                'progress': Percentage of the work done, float
+                'created': Submission time, float
+                'started': Start time, Optional[float]
+                'finished': End time, Optional[float]
+                'error': Error of a failed job, Optional[str]
+                'result': Result of a finished job, e.g. the exported file, Optional[dict]
+            }
+        """
+        if not JOB_ID.fullmatch(job_id):
+            return None
+        job = Job(self.folder, job_id)
+        try:
+            state = job.load()
+        except (FileNotFoundError, ValueError):
+            return None
+        if state['status'] not in FINISHED and not alive(state['pid'] or state['owner']):
+            try:
+                state = job.update(status='failed', error='interrupted by a restart', finished=time.time())
+            except FileNotFoundError:  # deleted meanwhile
+                return None
+        if state['status'] == 'done':
+            state['progress'] = 100.0
+        elif state['total']:
+            state['progress'] = round(min(99.9, 100 * state['done'] / state['total']), 1)
+        else:
+            state['progress'] = 0.0
+        return state
+
+    def list(self, project_name: Optional[str] = None) -> List[dict]:
+        """ Return the states of the jobs, or of the jobs of a project, most recent first. """
+        jobs = []
+        for name in os.listdir(self.folder):
+            if name.endswith('.json'):
+                state = self.status(name[:-len('.json')])
+                if state is not None and project_name in (None, state['project']):
+                    jobs.append(state)
+        return sorted(jobs, key=lambda x: x['created'], reverse=True)
+
+    def cancel(self, job_id: str) -> Optional[dict]:
+        """ Cancel a job, return its state or None if unknown. A running job stops at its next chunk. """
+        state = self.status(job_id)
+        if state is None or state['status'] in FINISHED:
+            return state
+        open(os.path.join(self.folder, f'{job_id}.cancel'), 'w').close()
+        try:  # a running job finds the flag at its next chunk
+            Job(self.folder, job_id).update(only_if='queued', status='cancelled', finished=time.time())
+        except FileNotFoundError:
+            pass
+        return self.status(job_id)
+
+    def delete(self, job_id: str):
+        """ Forget a finished job and remove its files. """
+        if not JOB_ID.fullmatch(job_id):
+            return
+        for name in (f'{job_id}.json', f'{job_id}.cancel', f'{job_id}.lock'):
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except FileNotFoundError:
+                pass
+        shutil.rmtree(os.path.join(self.folder, job_id), ignore_errors=True)
+
+    def result_path(self, job_id: str) -> Optional[str]:
+        """ Return the path to the file written by a finished job, None if there is none. """
+        state = self.status(job_id)
+        if state is None or state['status'] != 'done' or not (state['result'] or {}).get('file'):
+            return None
+        return Job(self.folder, job_id).path(state['result']['file'])
+
+    def expire(self):
+        """ Delete jobs finished for more than `ttl` seconds. """
+        for state in self.list():
+            if state['status'] in FINISHED and state['finished'] < time.time() - self.ttl:
+                self.delete(state['id'])
@@ -0,0 +1,116 @@
+import os
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:  # not on posix, locks only work within the process
+    fcntl = None
+
+_open_fds = set()  # files of the locks held in this process
+_open_fds_lock = threading.Lock()
+
+
+def _close_inherited_fds():
+    # a forked child shares the open files of its parent, the locks would only be
+    # released once both closed them, so the child closes them right away
+    for fd in _open_fds:
+        os.close(fd)
+    _open_fds.clear()
+    _open_fds_lock.release()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(before=_open_fds_lock.acquire, after_in_parent=_open_fds_lock.release,
+                        after_in_child=_close_inherited_fds)
+
+
+class RWLock:
+    """
+    Reader-writer lock shared by the threads and processes opening the same lock
+    file, through `flock`. Any number of readers hold it in `shared` mode at once,
+    a writer holds it in `exclusive` mode alone, and using the lock itself as
+    a context manager takes it in exclusive mode. It is reentrant within a thread,
+    but a thread holding it in shared mode cannot take it in exclusive mode.
+    Processes forked while it is held, e.g. by a process pool, do not hold it.
+    Without `fcntl` it falls back to a lock of the process.
+
+    Args:
+        path (str): Path to the lock file, created if missing.
+    """
+    _process_locks = {}  # path -> threading.RLock, if fcntl is not available
+    _process_locks_lock = threading.Lock()
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()  # holding mode and depth of each thread
+
+    @contextmanager
+    def shared(self) -> Iterator[None]:
+        """ Hold the lock in shared mode, along with other readers. """
+        with self._hold(exclusive=False):
+            yield
+
+    @contextmanager
+    def exclusive(self) -> Iterator[None]:
+        """ Hold the lock in exclusive mode, waiting for all other holders to release it. """
+        with self._hold(exclusive=True):
+            yield
+
+    def __enter__(self):
+        self._acquire(exclusive=True)
+        return self
+
+    def __exit__(self, *exc):
+        self._release()
+
+    @contextmanager
+    def _hold(self, exclusive: bool) -> Iterator[None]:
+        self._acquire(exclusive)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _acquire(self, exclusive: bool):
+        depth = getattr(self._local, 'depth', 0)
+        if depth > 0:
+            if exclusive and not self._local.exclusive:
+                raise RuntimeError(f'Cannot take "{self.path}" exclusively while holding it shared.')
+            self._local.depth = depth + 1
+            return
+        if fcntl is None:
+            with self._process_locks_lock:
+                lock = self._process_locks.setdefault(self.path, threading.RLock())
+            lock.acquire()
+            self._local.handle = lock
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with _open_fds_lock:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                _open_fds.add(fd)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            except BaseException:
+                self._close(fd)
+                raise
+            self._local.handle = fd
+        self._local.exclusive = exclusive
+        self._local.depth = 1
+
+    def _release(self):
+        self._local.depth -= 1
+        if self._local.depth > 0:
+            return
+        if fcntl is None:
+            self._local.handle.release()
+        else:
+            self._close(self._local.handle)  # closing the file releases the flock
+        self._local.handle = None
+
+    @staticmethod
+    def _close(fd: int):
+        with _open_fds_lock:
+            _open_fds.discard(fd)
+            os.close(fd)
@@ -0,0 +1,225 @@
+"""
+Metrics of the api kept in memory: request counts and latency histograms of
+each route, bytes read and written per project file and time spent in pandas
+`read_csv` and `to_csv`. Recording a value takes a lock and a dict update, so
+metrics are always on. Each worker process records its own and, once
+configured, writes them to "<PROJECT_DIR>/.metrics/<pid>.json" at most every
+SNAPSHOT_INTERVAL seconds, so the METRICS route of any worker renders the sum
+of all workers in the Prometheus text format.
+"""
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from srcs import utils
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)  # seconds
+SNAPSHOT_INTERVAL = 1  # min seconds between two snapshots written by a process
+FOLDER = '.metrics'  # folder of the snapshots under the project directory
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+METRICS = {  # name: (type, help)
+    'http_requests_total': ('counter', 'Requests answered by route, method and status.'),
+    'http_request_duration_seconds': (
+        'histogram', 'Time to answer a request by route and method, until the last byte of its body.'),
+    'storage_read_bytes_total': ('counter', 'Bytes read from each file of a project.'),
+    'storage_written_bytes_total': ('counter', 'Bytes written to each file of a project.'),
+    'storage_csv_seconds': ('histogram', 'Time spent in pandas read_csv and to_csv by file.'),
+}
+
+
+def label_string(**labels: str) -> str:
+    """ Return labels in the Prometheus format, e.g. 'route="get_data",method="GET"'. """
+    return ','.join(f'{key}="{escape(value)}"' for key, value in labels.items())
+
+
+def number(value: float) -> str:
+    """ Format a value without losing digits of large counters. """
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def escape(value) -> str:
+    """ Escape a label value. """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Registry:
+    """
+    Counters and histograms of a process, keyed by metric name and label string.
+    A histogram keeps the number of values of each bucket of BUCKETS, plus the
+    values above them, followed by the sum of the values.
+
+    Args:
+        folder (str, optional): Folder of the snapshots of all processes, None
+            to keep metrics in this process only.
+        root (str, optional): Project directory, files under it are labelled with
+            their project and name.
+    """
+    def __init__(self, folder: Optional[str] = None, root: Optional[str] = None):
+        self.folder = folder
+        self.root = root
+        self.lock = threading.Lock()
+        self.counters: Dict[str, Dict[str, float]] = {}
+        self.histograms: Dict[str, Dict[str, List[float]]] = {}
+        self.saved = time.monotonic()
+
+    def inc(self, name: str, labels: str, value: float = 1):
+        """ Increase a counter. """
+        with self.lock:
+            counter = self.counters.setdefault(name, {})
+            counter[labels] = counter.get(labels, 0) + value
+
+    def observe(self, name: str, labels: str, value: float):
+        """ Add a value to a histogram. """
+        i = 0
+        while i < len(BUCKETS) and value > BUCKETS[i]:
+            i += 1
+        with self.lock:
+            histogram = self.histograms.setdefault(name, {})
+            counts = histogram.get(labels)
+            if counts is None:
+                counts = histogram[labels] = [0] * (len(BUCKETS) + 2)
+            counts[i] += 1
+            counts[-1] += value
+
+    def snapshot(self) -> dict:
+        """ Return a copy of the metrics of the process. """
+        with self.lock:
+            return {
+                'counters': {name: dict(values) for name, values in self.counters.items()},
+                'histograms': {name: {labels: list(counts) for labels, counts in values.items()}
+                               for name, values in self.histograms.items()},
+            }
+
+    def save(self, force: bool = False):
+        """ Write a snapshot of the process, unless the last one is recent. """
+        if self.folder is None or (not force and time.monotonic() - self.saved < SNAPSHOT_INTERVAL):
+            return
+        self.saved = time.monotonic()
+        os.makedirs(self.folder, exist_ok=True)
+        path = os.path.join(self.folder, f'{os.getpid()}.json')
+        with utils.atomic_path(path) as tmp, open(tmp, 'w') as file:
+            json.dump(self.snapshot(), file)
+
+    def collect(self) -> dict:
+        """ Return the sum of the current metrics of the process and the snapshots of the others. """
+        snapshots = [self.snapshot()]
+        own = f'{os.getpid()}.json'
+        if self.folder is not None and os.path.isdir(self.folder):
+            for name in os.listdir(self.folder):
+                if not name.endswith('.json') or name == own:
+                    continue
+                try:
+                    with open(os.path.join(self.folder, name), 'r') as file:
+                        snapshots.append(json.load(file))
+                except (FileNotFoundError, ValueError):  # removed by a restart
+                    continue
+        return merge(snapshots)
+
+    def file_labels(self, path: str) -> Dict[str, str]:
+        """ Return the project and file name labels of a file, the project of files at the root is ''. """
+        if self.root is not None:
+            path = os.path.relpath(path, self.root)
+        else:
+            path = os.path.join(os.path.basename(os.path.dirname(path)), os.path.basename(path))
+        project, _, name = path.rpartition(os.sep)
+        return {'project': project, 'file': name}
+
+
+def merge(snapshots: List[dict]) -> dict:
+    """ Return the sum of metric snapshots. """
+    total = {'counters': {}, 'histograms': {}}
+    for snapshot in snapshots:
+        for name, values in snapshot['counters'].items():
+            counter = total['counters'].setdefault(name, {})
+            for labels, value in values.items():
+                counter[labels] = counter.get(labels, 0) + value
+        for name, values in snapshot['histograms'].items():
+            histogram = total['histograms'].setdefault(name, {})
+            for labels, counts in values.items():
+                if labels in histogram:
+                    histogram[labels] = [a + b for a, b in zip(histogram[labels], counts)]
+                else:
+                    histogram[labels] = list(counts)
+    return total
+
+
+def render(snapshot: dict) -> str:
+    """ Render metrics in the Prometheus text exposition format. """
+    lines = []
+    for name, (kind, description) in METRICS.items():
+        lines += [f'# HELP {name} {description}', f'# TYPE {name} {kind}']
+        if kind == 'counter':
+            for labels, value in sorted(snapshot['counters'].get(name, {}).items()):
+                lines.append(f'{name}{{{labels}}} {number(value)}')
+            continue
+        for labels, counts in sorted(snapshot['histograms'].get(name, {}).items()):
+            prefix = f'{labels},' if labels else ''
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf', ), counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {number(cumulative)}')
+            lines.append(f'{name}_sum{{{labels}}} {counts[-1]:.6f}')
+            lines.append(f'{name}_count{{{labels}}} {number(cumulative)}')
+    return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def configure(project_dir: str):
+    """ Share the metrics of the process with the other workers serving a project directory. """
+    REGISTRY.folder = os.path.join(project_dir, FOLDER)
+    REGISTRY.root = project_dir
+
+
+def reset(project_dir: str):
+    """
+    Remove the snapshots of processes which are not running anymore, e.g. workers
+    of a previous server, to be called once a server starts. Snapshots of the
+    other servers sharing the project directory are kept.
+    """
+    folder = os.path.join(project_dir, FOLDER)
+    if not os.path.isdir(folder):
+        return
+    for name in os.listdir(folder):
+        try:
+            os.kill(int(name.split('.')[0]), 0)
+            continue
+        except (ValueError, ProcessLookupError):
+            pass
+        except PermissionError:  # running as another user
+            continue
+        try:
+            os.remove(os.path.join(folder, name))
+        except FileNotFoundError:  # removed by another server starting
+            pass
+
+
+def record_request(route: str, method: str, status: int, seconds: float):
+    """ Record an answered request and save a snapshot if the last one is old enough. """
+    REGISTRY.inc('http_requests_total', label_string(route=route, method=method, status=status))
+    REGISTRY.observe('http_request_duration_seconds', label_string(route=route, method=method), seconds)
+    REGISTRY.save()
+
+
+def record_io(path: str, read: int = 0, written: int = 0):
+    """ Record bytes read from or written to a project file. """
+    labels = label_string(**REGISTRY.file_labels(path))
+    if read:
+        REGISTRY.inc('storage_read_bytes_total', labels, read)
+    if written:
+        REGISTRY.inc('storage_written_bytes_total', labels, written)
+
+
+@contextmanager
+def csv_timer(operation: str, path: str) -> Iterator[None]:
+    """ Record the time spent in a pandas csv operation, "read_csv" or "to_csv", on a file. """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        REGISTRY.observe('storage_csv_seconds', label_string(
+            operation=operation, file=os.path.basename(path)), time.perf_counter() - start)
@@ -0,0 +1,358 @@
+"""
+Router spreading projects over several api processes. Requests about a project
+are forwarded to the process owning it, chosen by consistent hashing of the
+project name, so each process keeps the data of its own projects in its cache
+and a large import or export only holds up the projects of one process. The
+processes share the projects on disk, so any of them answers correctly, e.g.
+requests which are not about a project or whose owner is down. Processes are
+added or removed at runtime with a handoff of the projects changing owner. The
+router listens to API_ADDRESS, clients do not know about the processes behind
+it. Run it from the repo root, it starts ROUTER_WORKERS api processes listening
+to the next ports:
+
+    python -m srcs.router --workers 4
+"""
+import sys
+import json
+import time
+import bisect
+import socket
+import hashlib
+import logging
+import argparse
+import itertools
+import threading
+import subprocess
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import unquote, urlparse
+
+import urllib3
+from werkzeug.wrappers import Request, Response
+from werkzeug.wsgi import ClosingIterator
+
+from srcs import utils
+
+REPLICAS = 64  # points of each process on the hash ring, more points split projects more evenly
+ADMIN_PATH = '/router/workers'
+UNSCOPED = ('LOAD_PROJECTS', 'METRICS', 'READY', 'JOBS')  # endpoints which are not about a project
+HOP_HEADERS = {'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te',
+               'trailer', 'transfer-encoding', 'upgrade', 'host'}
+STREAM_CHUNK_BYTES = 2 ** 16  # responses are forwarded in pieces of this size
+CONNECT_TIMEOUT = 5
+START_TIMEOUT = 60  # seconds to wait for a started api process to listen
+
+logger = logging.getLogger(__name__)
+
+
+def ring_hash(key: str) -> int:
+    """ Return the position of a key on the hash ring. """
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """
+    Consistent hash ring of nodes, each placed at `replicas` points. A key belongs
+    to the node of the first point following its hash, so adding or removing a
+    node only moves the keys of the points it takes or leaves.
+
+    Args:
+        nodes (Iterable[str]): Nodes of the ring, e.g. addresses of api processes.
+        replicas (int): Number of points of each node.
+    """
+    def __init__(self, nodes: Iterable[str] = (), replicas: int = REPLICAS):
+        self.replicas = replicas
+        self.nodes: List[str] = []
+        self._points = []  # sorted (hash, node)
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node: str):
+        """ Add a node to the ring. """
+        if node in self.nodes:
+            return
+        self.nodes.append(node)
+        for i in range(self.replicas):
+            bisect.insort(self._points, (ring_hash(f'{node}#{i}'), node))
+
+    def remove(self, node: str):
+        """ Remove a node from the ring, raise ValueError if it is not in the ring. """
+        self.nodes.remove(node)
+        self._points = [point for point in self._points if point[1] != node]
+
+    def copy(self) -> 'HashRing':
+        """ Return a copy of the ring. """
+        return HashRing(self.nodes, self.replicas)
+
+    def owner(self, key: str) -> str:
+        """ Return the node owning a key. """
+        i = bisect.bisect(self._points, (ring_hash(key), ))
+        return self._points[i % len(self._points)][1]
+
+    def owners(self, key: str) -> List[str]:
+        """ Return all nodes in the order a key falls back to them, its owner first. """
+        start = bisect.bisect(self._points, (ring_hash(key), ))
+        nodes = []
+        for i in range(len(self._points)):
+            node = self._points[(start + i) % len(self._points)][1]
+            if node not in nodes:
+                nodes.append(node)
+                if len(nodes) == len(self.nodes):
+                    break
+        return nodes
+
+
+class Router:
+    """
+    WSGI application forwarding requests to the api processes owning their
+    projects. Requests to ADMIN_PATH list the processes and the number of
+    projects each owns (GET), add (PUT) or remove (DELETE) the process whose
+    address is given in a json body, e.g. {"address": "http://127.0.0.1:5005"}.
+
+    Args:
+        workers (List[str]): Addresses of the api processes.
+        endpoints (Dict[str, str]): API_ENDPOINTS of the config, to find the
+            project of a request.
+        pool_size (int): Max number of kept connections to each process.
+        timeout (float): Seconds to wait for a process to answer.
+    """
+    def __init__(self, workers: List[str], endpoints: Dict[str, str], pool_size: int = 32,
+                 timeout: float = 300):
+        self.ring = HashRing(workers)
+        self.endpoints = endpoints
+        # longest first, e.g. ".../data/download" before ".../data"
+        self.prefixes = sorted({path.rstrip('/') for name, path in endpoints.items()
+                                if name not in UNSCOPED}, key=len, reverse=True)
+        self.timeout = urllib3.Timeout(connect=CONNECT_TIMEOUT, read=timeout)
+        self.pool = urllib3.PoolManager(maxsize=pool_size, retries=False, timeout=self.timeout)
+        self.next_worker = itertools.count()  # spreads requests which are not about a project
+        self.active = Counter()  # requests in flight of each (process, project)
+        self.active_changed = threading.Condition()
+        self.handoff_lock = threading.Lock()
+        self.releasing = 0  # projects waiting for their old owner to be idle
+
+    def project_of(self, path: str) -> Optional[str]:
+        """
+        Return the project of a request path, the segment following the endpoint,
+        None if it is not about a project. Projects named like the segments of
+        longer endpoints, e.g. "download", may be taken for another one, which
+        only costs a cache miss.
+        """
+        for prefix in self.prefixes:
+            if path.startswith(prefix + '/'):
+                name = path[len(prefix) + 1:].split('/', 1)[0]
+                return unquote(name) if name else None
+        return None
+
+    def __call__(self, environ: dict, start_response):
+        request = Request(environ)
+        if request.path == ADMIN_PATH:
+            return self.admin(request)(environ, start_response)
+        if request.path == self.endpoints.get('READY'):
+            return self.ready()(environ, start_response)
+
+        project = self.project_of(request.path)
+        ring = self.ring
+        if project is not None:
+            workers = ring.owners(project)
+        else:
+            i = next(self.next_worker) % len(ring.nodes)
+            workers = ring.nodes[i:] + ring.nodes[:i]
+        url = environ.get('RAW_URI') or request.full_path.rstrip('?')
+        headers = {name: value for name, value in request.headers.items()
+                   if name.lower() not in HOP_HEADERS}
+        headers['X-Forwarded-For'] = request.remote_addr or ''
+        body = request.get_data()
+        for worker in workers:
+            self.enter(worker, project)
+            try:
+                upstream = self.pool.urlopen(request.method, worker + url, body=body, headers=headers,
+                                             preload_content=False, decode_content=False, redirect=False)
+            except (urllib3.exceptions.NewConnectionError, urllib3.exceptions.ConnectTimeoutError):
+                self.leave(worker, project)  # not running, the next process answers as well
+                continue
+            except urllib3.exceptions.HTTPError as e:
+                self.leave(worker, project)
+                return Response(f'{worker} failed to answer: {e}', 502)(environ, start_response)
+            start_response(f'{upstream.status} {upstream.reason}',
+                           [(name, value) for name, value in upstream.headers.items()
+                            if name.lower() not in HOP_HEADERS])
+            return ClosingIterator(upstream.stream(STREAM_CHUNK_BYTES, decode_content=False), [
+                upstream.release_conn, lambda: self.leave(worker, project)])
+        return Response('No api process is reachable.', 502)(environ, start_response)
+
+    def enter(self, worker: str, project: Optional[str]):
+        """ Count a request forwarded to a process. """
+        with self.active_changed:
+            self.active[worker, project] += 1
+
+    def leave(self, worker: str, project: Optional[str]):
+        """ Count a request answered by a process. """
+        with self.active_changed:
+            self.active[worker, project] -= 1
+            if self.active[worker, project] <= 0:
+                del self.active[worker, project]
+                self.active_changed.notify_all()
+
+    def call(self, worker: str, method: str, path: str, body: dict = None) -> dict:
+        """ Send a request to a process and return its json response, raise urllib3 errors. """
+        r = self.pool.request(method, worker + path, body=None if body is None else json.dumps(body),
+                              headers={'Content-Type': 'application/json'})
+        if r.status >= 400:
+            raise urllib3.exceptions.HTTPError(f'{worker}{path} answered {r.status}')
+        return json.loads(r.data)
+
+    def list_projects(self) -> List[str]:
+        """ Return the names of all projects, from the first process answering. """
+        error = None
+        for worker in self.ring.nodes:
+            try:
+                return self.call(worker, 'GET', self.endpoints['LOAD_PROJECTS'])['projects']
+            except urllib3.exceptions.HTTPError as e:
+                error = e
+        raise error
+
+    def add_worker(self, address: str) -> Dict[str, List[str]]:
+        """ Add a process, which must be listening, and hand over the projects it owns from now on. """
+        address = address.rstrip('/')
+        self.call(address, 'GET', self.endpoints['LOAD_PROJECTS'])
+        with self.handoff_lock:
+            ring = self.ring.copy()
+            ring.add(address)
+            return self.hand_off(ring)
+
+    def remove_worker(self, address: str) -> Dict[str, List[str]]:
+        """ Remove a process and hand over its projects, raise ValueError if unknown or the last one. """
+        address = address.rstrip('/')
+        with self.handoff_lock:
+            if len(self.ring.nodes) == 1 and address in self.ring.nodes:
+                raise ValueError('the last api process cannot be removed')
+            ring = self.ring.copy()
+            ring.remove(address)
+            return self.hand_off(ring)
+
+    def hand_off(self, ring: HashRing) -> Dict[str, List[str]]:
+        """
+        Switch to a new ring. Projects changing owner are first warmed up by their
+        new owner, then forwarded to it, and their old owner drops them from memory
+        once it answered their requests in flight.
+
+        Returns:
+            Old and new owner of each project changing owner, Dict[str, List[str]].
+        """
+        moved = {}
+        for project_name in self.list_projects():
+            old, new = self.ring.owner(project_name), ring.owner(project_name)
+            if old != new:
+                moved[project_name] = [old, new]
+        for project_name, (_, new) in moved.items():
+            try:
+                self.call(new, 'PUT', f'{self.endpoints["WARM_PROJECT"]}/{project_name}')
+            except urllib3.exceptions.HTTPError:  # served anyway, just not warm
+                logger.exception('Failed to warm up "%s" on %s', project_name, new)
+        self.ring = ring
+        with self.active_changed:
+            self.releasing += len(moved)
+        threading.Thread(target=self.release, args=(moved, ), daemon=True).start()
+        return moved
+
+    def release(self, moved: Dict[str, List[str]]):
+        """ Have the old owners of handed over projects drop them once they are idle. """
+        for project_name, (old, _) in moved.items():
+            with self.active_changed:
+                self.active_changed.wait_for(lambda: self.active[old, project_name] == 0)
+            try:
+                self.call(old, 'DELETE', f'{self.endpoints["WARM_PROJECT"]}/{project_name}')
+            except urllib3.exceptions.HTTPError:  # removed process which was stopped
+                pass
+            with self.active_changed:
+                self.releasing -= 1
+
+    def admin(self, request: Request) -> Response:
+        """ Answer the requests listing, adding and removing api processes. """
+        if request.method == 'GET':
+            try:
+                owned = Counter(self.ring.owner(name) for name in self.list_projects())
+            except urllib3.exceptions.HTTPError as e:
+                return Response(str(e), 502)
+            return Response(json.dumps({
+                'workers': {worker: owned[worker] for worker in self.ring.nodes},
+                'releasing': self.releasing,
+            }), mimetype='application/json')
+        address = (request.get_json(silent=True) or {}).get('address')
+        if not isinstance(address, str) or request.method not in ('PUT', 'DELETE'):
+            return Response('expected PUT or DELETE of {"address": "http://host:port"}', 400)
+        try:
+            moved = self.add_worker(address) if request.method == 'PUT' else self.remove_worker(address)
+        except ValueError as e:
+            return Response(str(e), 400)
+        except urllib3.exceptions.HTTPError as e:
+            return Response(f'{address} is not reachable: {e}', 502)
+        return Response(json.dumps({'workers': self.ring.nodes, 'moved': moved}),
+                        mimetype='application/json')
+
+    def ready(self) -> Response:
+        """ Answer 200 once all api processes are ready, with the readiness of each, see `api.get_ready`. """
+        workers, ready = {}, True
+        for worker in self.ring.nodes:
+            try:
+                r = self.pool.request('GET', worker + self.endpoints['READY'])
+                workers[worker] = json.loads(r.data)
+                ready &= r.status == 200
+            except (urllib3.exceptions.HTTPError, ValueError) as e:
+                workers[worker] = {'ready': False, 'error': str(e)}
+                ready = False
+        return Response(json.dumps({'ready': ready, 'workers': workers}), 200 if ready else 503,
+                        mimetype='application/json')
+
+
+def wait_listening(host: str, port: int, process: subprocess.Popen, timeout: float = START_TIMEOUT):
+    """ Wait until a started process accepts connections on a port, raise RuntimeError if it does not. """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'api process of port {port} exited with code {process.returncode}')
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'api process of port {port} did not start within {timeout}s')
+
+
+if __name__ == '__main__':
+    from srcs.serve import APIServer
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of api processes, ROUTER_WORKERS of the config by default.')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='Number of threads forwarding requests, ROUTER_THREADS of the config by default.')
+    parser.add_argument('--asgi', action='store_true', help='Run the ASGI variant of the api processes.')
+    args = parser.parse_args()
+    config = utils.load_yaml('./config.yaml')
+    address = urlparse(config['API_ADDRESS'])
+    host, port = address.hostname, address.port or 80
+    n_workers = args.workers or config.get('ROUTER_WORKERS') or 4
+    threads = args.threads or config.get('ROUTER_THREADS') or 32
+
+    processes = []
+    try:
+        for i in range(1, n_workers + 1):
+            command = [sys.executable, '-m', 'srcs.serve', '--workers', '1', '--port', str(port + i)]
+            processes.append(subprocess.Popen(command + (['--asgi'] if args.asgi else [])))
+        for i, process in enumerate(processes, 1):
+            wait_listening(host, port + i, process)
+        workers = [f'{address.scheme}://{host}:{port + i}' for i in range(1, n_workers + 1)]
+        APIServer({
+            'bind': f'{host}:{port}',
+            'workers': 1,  # a single ring, threads wait on the api processes
+            'threads': threads,
+            'worker_class': 'gthread',
+            'timeout': 300,
+        }, load_app=lambda: Router(workers, config['API_ENDPOINTS'], pool_size=threads)).run()
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
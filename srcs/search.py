@@ -0,0 +1,206 @@
+import os
+import re
+from typing import Iterable, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from srcs import utils
+
+TOKEN = r'\w+'  # tokens are runs of word characters, matched case-insensitively
+K1, B = 1.2, 0.75  # BM25 term frequency saturation and length normalization
+SNIPPET_CHARS = 160  # max length of a snippet
+
+
+def term_hashes(tokens: List[str]) -> np.ndarray:
+    """ Return 64-bit hashes of lower case tokens, which identify terms in the index. """
+    return pd.util.hash_pandas_object(pd.Series(tokens, dtype=object),
+                                      index=False).to_numpy(dtype='uint64')
+
+
+def tokenize(texts: List[str], offset: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Tokenize texts into postings of (term hash, row index, number of occurrences),
+    sorted by term then row, and the number of tokens of each text. This is a
+    plain function of its arguments, so chunks of texts can be tokenized by a
+    pool of worker processes.
+
+    Args:
+        texts (List[str]): Texts of consecutive rows.
+        offset (int): Row index of the first text.
+
+    Returns:
+        Postings, np.ndarray of shape (3, n) and dtype uint64, and number of
+        tokens per text, np.ndarray.
+    """
+    tokens = pd.Series(texts, dtype=object).astype(str).str.lower().str.findall(TOKEN)
+    lengths = tokens.str.len().to_numpy(dtype='uint32')
+    tokens = tokens.explode().dropna()
+    # hash each distinct token once, then count (term, row) pairs ordered by term hash
+    codes, terms = pd.factorize(tokens.to_numpy())
+    terms = term_hashes(list(terms))
+    order = np.argsort(terms)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    n_rows = max(len(texts), 1)
+    keys, counts = np.unique(rank[codes] * n_rows + tokens.index.to_numpy(dtype='int64'),
+                             return_counts=True)
+    postings = np.empty((3, len(keys)), dtype='uint64')
+    postings[0] = terms[order][keys // n_rows]
+    postings[1] = keys % n_rows + offset
+    postings[2] = counts
+    return postings, lengths
+
+
+def snippet(text: str, query: str, width: int = SNIPPET_CHARS) -> str:
+    """ Return the part of a text around the first occurrence of a query term. """
+    terms = set(re.findall(TOKEN, query.lower()))
+    match = next((m for m in re.finditer(TOKEN, text) if m.group().lower() in terms), None)
+    start = 0 if match is None else max(0, match.start() - width // 3)
+    end = start + width
+    return ('...' if start > 0 else '') + text[start:end] + ('...' if end < len(text) else '')
+
+
+class SearchIndex:
+    """
+    Persistent inverted index from the terms of texts to the rows containing
+    them, used to rank rows by BM25 relevance to a query without reading the
+    texts. Postings of (term hash, row, number of occurrences) are kept sorted
+    in a packed uint64 file, which is memory-mapped and binary searched, next
+    to the number of tokens of each row. Like `dedup.HashIndex`, postings of new
+    rows go to a small delta level first, merged into the base level once it
+    grows beyond an eighth of it.
+
+    Args:
+        folder (str): Directory keeping the index files.
+    """
+    LEVELS = ('search', 'search.delta')
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.lengths_path = os.path.join(folder, 'search.lengths.u32')
+
+    def _path(self, level: str) -> str:
+        return os.path.join(self.folder, f'{level}.u64')
+
+    def exists(self) -> bool:
+        """ Check if the index has been built. """
+        return os.path.exists(self._path(self.LEVELS[0]))
+
+    def _read(self, level: str, mmap: bool = False) -> np.ndarray:
+        path = self._path(level)
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return np.empty((3, 0), dtype='uint64')
+        if mmap:
+            return np.memmap(path, dtype='uint64', mode='r').reshape(3, -1)
+        return np.fromfile(path, dtype='uint64').reshape(3, -1)
+
+    def _write(self, level: str, postings: np.ndarray):
+        # one file per level, so readers never see parts of two versions
+        os.makedirs(self.folder, exist_ok=True)
+        path = self._path(level)
+        with utils.atomic_path(path) as tmp:
+            np.ascontiguousarray(postings, dtype='uint64').tofile(tmp)
+
+    def _read_lengths(self) -> np.ndarray:
+        if not os.path.exists(self.lengths_path) or os.path.getsize(self.lengths_path) == 0:
+            return np.empty(0, dtype='uint32')
+        return np.memmap(self.lengths_path, dtype='uint32', mode='r')
+
+    def _write_lengths(self, lengths: np.ndarray):
+        os.makedirs(self.folder, exist_ok=True)
+        with utils.atomic_path(self.lengths_path) as tmp:
+            np.asarray(lengths, dtype='uint32').tofile(tmp)
+
+    def add(self, postings: np.ndarray, lengths: np.ndarray):
+        """ Add postings and token counts of new rows, appended after the indexed ones. """
+        # lengths go first, so postings never refer to rows without a length
+        os.makedirs(self.folder, exist_ok=True)
+        with open(self.lengths_path, 'ab') as file:
+            file.write(np.asarray(lengths, dtype='uint32').tobytes())
+        base = self._read(self.LEVELS[0], mmap=True)
+        delta = np.concatenate([self._read(self.LEVELS[1]), postings], axis=1)
+        delta = delta[:, np.lexsort((delta[1], delta[0]))]
+        if delta.shape[1] > max(2 ** 16, base.shape[1] // 8):
+            merged = np.concatenate([base, delta], axis=1)
+            self._write(self.LEVELS[0], merged[:, np.lexsort((merged[1], merged[0]))])
+            self._write(self.LEVELS[1], np.empty((3, 0), dtype='uint64'))
+        else:
+            if not self.exists():
+                self._write(self.LEVELS[0], base)
+            self._write(self.LEVELS[1], delta)
+
+    def truncate(self, total: int):
+        """ Drop postings of rows from index `total` onwards. """
+        for level in self.LEVELS:
+            postings = self._read(level)
+            if (postings[1] >= total).any():
+                self._write(level, postings[:, postings[1] < total])
+        lengths = self._read_lengths()
+        if len(lengths) > total:
+            self._write_lengths(np.array(lengths[:total]))
+
+    def rebuild(self, chunks: Iterable[Tuple[np.ndarray, np.ndarray]]):
+        """ Replace the index with chunks of (postings, token counts) from `tokenize`, in row order. """
+        chunks = list(chunks)
+        postings = np.concatenate([np.empty((3, 0), dtype='uint64')] + [c[0] for c in chunks],
+                                  axis=1)
+        self._write_lengths(np.concatenate([np.empty(0, dtype='uint32')] + [c[1] for c in chunks]))
+        self._write(self.LEVELS[0], postings[:, np.lexsort((postings[1], postings[0]))])
+        self._write(self.LEVELS[1], np.empty((3, 0), dtype='uint64'))
+
+    def search(self, query: str, start: int = 0,
+               limit: int = 20) -> Tuple[int, np.ndarray, np.ndarray]:
+        """
+        Rank rows containing any term of a query by BM25 relevance.
+
+        Args:
+            query (str): Query text, tokenized like the indexed texts.
+            start (int): Number of best ranked rows to skip.
+            limit (int): Max number of rows returned.
+
+        Returns:
+            Number of matching rows, int, indices of the matching rows from rank
+            `start` on, np.ndarray, and their scores, np.ndarray.
+        """
+        terms = np.unique(term_hashes(re.findall(TOKEN, query.lower())))
+        levels = [self._read(level, mmap=True) for level in self.LEVELS]
+        lengths = self._read_lengths()
+        if len(lengths) == 0 or len(terms) == 0:
+            return 0, np.empty(0, dtype='int64'), np.empty(0)
+        average = max(float(lengths.mean()), 1.0)
+        rows, weights = [], []
+        for term in terms:
+            found = [level[:, np.searchsorted(level[0], term, 'left'):
+                           np.searchsorted(level[0], term, 'right')] for level in levels]
+            found = np.concatenate(found, axis=1)
+            found = found[:, found[1] < len(lengths)]  # rows being truncated
+            if found.shape[1] == 0:
+                continue
+            idf = np.log(1 + (len(lengths) - found.shape[1] + 0.5) / (found.shape[1] + 0.5))
+            tf = found[2].astype('float64')
+            norm = K1 * (1 - B + B * lengths[found[1].astype('int64')] / average)
+            rows.append(found[1].astype('int64'))
+            weights.append(idf * tf * (K1 + 1) / (tf + norm))
+        if len(rows) == 0:
+            return 0, np.empty(0, dtype='int64'), np.empty(0)
+        rows, weights = np.concatenate(rows), np.concatenate(weights)
+        if len(terms) > 1:  # sum the scores of rows containing several terms
+            rows, inverse = np.unique(rows, return_inverse=True)
+            weights = np.bincount(inverse, weights=weights)
+        # rank only the rows of the requested page, best score then lowest index
+        stop = min(start + limit, len(rows))
+        if start >= stop:
+            return len(rows), np.empty(0, dtype='int64'), np.empty(0)
+        if stop < len(rows):  # rows scoring at least as the last one of the page
+            top = np.flatnonzero(weights >= -np.partition(-weights, stop - 1)[stop - 1])
+        else:
+            top = np.arange(len(rows))
+        top = top[np.lexsort((rows[top], -weights[top]))][start:stop]
+        return len(rows), rows[top], weights[top]
+
+    def remove(self):
+        """ Delete the index files. """
+        for path in [self._path(level) for level in self.LEVELS] + [self.lengths_path]:
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,73 @@
+"""
+Serve the REST API with gunicorn, several worker processes each running a pool
+of threads. Every worker loads the api on its own, projects are shared through
+the storage engine, which locks and replaces files safely across processes.
+With --asgi, workers run the event loop of `srcs.asgi` instead (requires
+uvicorn). Run it from the repo root:
+
+    python -m srcs.serve --workers 4 --threads 8
+"""
+import argparse
+from typing import Callable, Optional
+from urllib.parse import urlparse
+
+from gunicorn.app.base import BaseApplication
+
+from srcs import metrics, utils
+
+
+class APIServer(BaseApplication):
+    """
+    Gunicorn application serving `srcs.api.app`, or `srcs.asgi.app` if `asgi`.
+
+    Args:
+        options (dict): Gunicorn settings, e.g. "bind", "workers" and "threads".
+        asgi (bool): Serve the ASGI variant of the api with uvicorn workers if True.
+        load_app (Callable, optional): Function returning another WSGI application
+            to serve instead, called in each worker, e.g. the router of `srcs.router`.
+    """
+    def __init__(self, options: dict, asgi: bool = False,
+                 load_app: Optional[Callable[[], Callable]] = None):
+        self.options = options
+        self.asgi = asgi
+        self.load_app = load_app
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        # imported in each worker, so workers do not share storage engines or threads
+        if self.load_app is not None:
+            return self.load_app()
+        if self.asgi:
+            from srcs.asgi import app
+        else:
+            from srcs.api import app
+        from srcs.api import WARMUP
+        WARMUP.start()  # warm up before the first request
+        return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of worker processes, API_WORKERS of the config by default.')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='Number of threads per worker, API_THREADS of the config by default.')
+    parser.add_argument('--asgi', action='store_true',
+                        help='Serve the ASGI variant of the api with uvicorn workers.')
+    parser.add_argument('--port', type=int, default=None,
+                        help='Port to listen to, the one of API_ADDRESS of the config by default.')
+    args = parser.parse_args()
+    config = utils.load_yaml('./config.yaml')  # the api reads it from the working directory
+    address = urlparse(config['API_ADDRESS'])
+    metrics.reset(config['PROJECT_DIR'])  # metrics of the workers of a previous server
+    APIServer({
+        'bind': f'{address.hostname}:{args.port or address.port or 80}',
+        'workers': args.workers or config.get('API_WORKERS') or 1,
+        'threads': args.threads or config.get('API_THREADS') or 1,
+        'worker_class': 'uvicorn.workers.UvicornWorker' if args.asgi else 'gthread',
+        'timeout': 300,  # imports of large chunks take a while
+    }, asgi=args.asgi).run()
@@ -0,0 +1,29 @@
+import os
+
+from srcs.storage.base import Storage
+from srcs.storage.csv_storage import CSVStorage
+from srcs.storage.sqlite_storage import SQLiteStorage
+
+
+def load_storage(config: dict) -> Storage:
+    """
+    Create the storage engine selected by "STORAGE_ENGINE" in the configurations,
+    either "csv" (default), "arrow", which requires pyarrow, or "sqlite".
+
+    Args:
+        config (dict): Project configurations.
+    """
+    engine = config.get('STORAGE_ENGINE', 'csv')
+    if engine in ('csv', 'arrow'):
+        if engine == 'arrow':  # optional dependency
+            from srcs.storage.arrow_storage import ArrowStorage as engine_class
+        else:
+            engine_class = CSVStorage
+        return engine_class(config['PROJECT_DIR'],
+                            config.get('CACHE_MEMORY_MB', 1024) * 2 ** 20,
+                            journal_bytes=config.get('JOURNAL_MAX_MB', 4) * 2 ** 20,
+                            journal_age=config.get('JOURNAL_MAX_AGE_S', 300),
+                            fsync=config.get('JOURNAL_FSYNC', True))
+    if engine == 'sqlite':
+        return SQLiteStorage(os.path.join(config['PROJECT_DIR'], 'projects.db'))
+    raise ValueError(f'Unknown storage engine "{engine}".')
@@ -0,0 +1,267 @@
+import os
+import re
+import time
+from typing import Iterator, List, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from srcs import metrics, utils
+from srcs.storage import journal, stats
+from srcs.storage.csv_storage import CSVStorage
+
+VERIFIED_FORMAT = '%Y-%m-%d %H:%M'  # format of verification datetimes sent by the app
+SCHEMA = pa.schema([
+    ('texts', pa.large_string()),
+    ('verified', pa.timestamp('s')),  # null if unlabeled
+    ('mask', pa.int64()),  # label bitmask
+])
+BATCH_SIZE = 2 ** 16  # rows per record batch of a written file
+SEGMENT = re.compile(r'(\d+)\.(\d+)')  # suffix "<generation>.<first row>" of a segment of appended rows
+
+
+def to_timestamps(verified: pd.Series) -> pd.Series:
+    """ Parse verification datetimes, '0' (unlabeled) becomes NaT. Raise ValueError if invalid. """
+    verified = pd.Series(verified, dtype=object)
+    return pd.to_datetime(verified.where(verified != '0'), format=VERIFIED_FORMAT)
+
+
+def to_table(df: pd.DataFrame) -> pa.Table:
+    """ Convert data with "texts", "verified" and "mask" columns to a table. """
+    return pa.Table.from_arrays([
+        pa.array(df['texts'].to_numpy(dtype=object), type=pa.large_string()),
+        pa.array(to_timestamps(df['verified']), type=pa.timestamp('s'), from_pandas=True),
+        pa.array(df['mask'].to_numpy(dtype='int64')),
+    ], schema=SCHEMA)
+
+
+def to_frame(table: pa.Table) -> pd.DataFrame:
+    """
+    Convert a table back to data with "texts", "verified" and "mask" columns, or
+    a dictionary-encoded "label" column if written before labels were bitmasks.
+    """
+    verified = table['verified'].to_pandas()
+    df = pd.DataFrame({
+        'texts': table['texts'].to_pandas(),
+        'verified': verified.dt.strftime(VERIFIED_FORMAT).fillna('0'),
+    })
+    if 'mask' in table.column_names:
+        df['mask'] = table['mask'].to_numpy()
+    else:
+        df['label'] = table['label'].to_pandas().astype(str)
+    return df
+
+
+def read_table(path: str) -> pa.Table:
+    """ Return the table of an arrow file, memory-mapped so columns are not copied. """
+    return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+
+def write_table(table: pa.Table, path: str, generation: int = 0):
+    """ Write a table to an arrow file through a temporary file, tagged with the generation of its segments. """
+    table = table.unify_dictionaries()  # a file cannot replace dictionaries between batches
+    with utils.atomic_path(path) as tmp, pa.OSFile(tmp, 'wb') as sink:
+        with pa.ipc.new_file(sink, SCHEMA.with_metadata({'generation': str(generation)})) as writer:
+            writer.write_table(table, max_chunksize=BATCH_SIZE)
+        metrics.record_io(path, written=sink.tell())
+
+
+def segment_paths(path: str) -> List[Tuple[int, int, str]]:
+    """ Return (generation, first row, path) of the segment files of a data file, in this order. """
+    folder, name = os.path.split(path)
+    segments = []
+    for file in os.listdir(folder):
+        match = SEGMENT.fullmatch(file[len(name) + 1:]) if file.startswith(name + '.') else None
+        if match is not None:
+            segments.append((int(match[1]), int(match[2]), os.path.join(folder, file)))
+    return sorted(segments)
+
+
+def read_parts(path: str) -> Tuple[int, List[Tuple[str, pa.Table]], List[str]]:
+    """
+    Return the generation of a data file, its parts as (path, table), i.e. the
+    file followed by the segments of rows appended to it, and the segment files
+    which are stale: left by a rewrite of the file, i.e. of another generation,
+    or covered by a merge, i.e. starting before the rows read so far end.
+    """
+    reader = pa.ipc.open_file(pa.memory_map(path, 'r'))
+    generation = int((reader.schema.metadata or {}).get(b'generation', b'0'))
+    parts = [(path, reader.read_all())]
+    end = parts[0][1].num_rows
+    stale = []
+    for segment_generation, start, segment in segment_paths(path):
+        if segment_generation != generation or start != end:
+            stale.append(segment)
+            continue
+        parts.append((segment, read_table(segment)))
+        end += parts[-1][1].num_rows
+    return generation, parts, stale
+
+
+def read_segments(path: str) -> pa.Table:
+    """ Return the table of a data file followed by the segments of rows appended to it, memory-mapped. """
+    _, parts, _ = read_parts(path)
+    return pa.concat_tables([table for _, table in parts]) if len(parts) > 1 else parts[0][1]
+
+
+class ArrowStorage(CSVStorage):
+    """
+    Storage engine keeping the data of each project in a columnar Arrow IPC file
+    "<project>/data.arrow" instead of a csv. Texts are memory-mapped, verification
+    datetimes are a timestamp column which is null if unlabeled and labels are
+    a bitmask column. Single rows and labeled rows are read from the mapped
+    file without converting the whole table. Project information, statistics
+    and the label journal are kept the same way as `CSVStorage`.
+
+    An IPC file cannot grow in place, so appended rows are written to segment
+    files "data.arrow.<generation>.<first row>" read after it. After an append,
+    the last two parts are merged, the data file included, as long as the newer
+    one has at least as many rows, so k appends copy each row O(log k) times
+    and keep O(log k) segments. A merge replaces the older part, the newer one
+    it covers is skipped by readers until removed. A rewrite of the whole data,
+    e.g. a compaction of the label journal, starts a new generation, which
+    drops all segments at once.
+
+    Verification datetimes are exchanged as strings formatted as VERIFIED_FORMAT,
+    or '0' if unlabeled.
+    """
+    DATA_FILE = 'data.arrow'
+
+    def __init__(self, *args, **kwargs):
+        self._tables = {}  # project -> (stamp of the data file, mapped table with its segments)
+        super().__init__(*args, **kwargs)
+
+    def load_data(self, paths: Tuple[str, ...]) -> pd.DataFrame:
+        return journal.replay(to_frame(read_segments(paths[0])), *paths[1:])
+
+    def write_file(self, df: pd.DataFrame, path: str):
+        write_table(to_table(df), path, time.time_ns())  # segments of older generations are stale
+        with self.lock(os.path.basename(os.path.dirname(path))):  # no reader listing them
+            for _, _, segment in segment_paths(path):
+                os.remove(segment)
+
+    def read_table(self, project_name: str) -> pa.Table:
+        """
+        Return the table of the data of a project, see `read_segments`, mapped
+        again once the data file changes, which every append touches.
+        """
+        path = self.data_path(project_name)
+        stat = os.stat(path)
+        entry = self._tables.get(project_name)
+        if entry is not None and entry[0] == (stat.st_ino, stat.st_mtime_ns, stat.st_size):
+            return entry[1]
+        with self.lock(project_name).shared():  # no segment merged or removed halfway
+            stat = os.stat(path)
+            table = read_segments(path)
+        self._tables[project_name] = ((stat.st_ino, stat.st_mtime_ns, stat.st_size), table)
+        return table
+
+    def release(self, project_name: str):
+        super().release(project_name)
+        self._tables.pop(project_name, None)
+
+    def data_columns(self, path: str) -> List[str]:
+        return pa.ipc.open_file(pa.memory_map(path, 'r')).schema.names
+
+    def append_texts(self, project_name: str, texts: List[str]) -> int:
+        df = pd.DataFrame({'texts': texts}).astype(str)
+        df['verified'] = '0'
+        df['mask'] = 0
+        path = self.data_path(project_name)
+        with self.file_lock(project_name), self.lock(project_name):
+            exists = os.path.exists(path)
+            project_stats = self.load_stats(project_name) if exists else stats.empty()
+            if exists:
+                self.append_segment(path, to_table(df))
+            else:
+                write_table(to_table(df), path, time.time_ns())
+            self.cache.bump(project_name)
+            before = self.write_stamp(project_name)
+            stats.save(self.stats_path(project_name),
+                       stats.merge(project_stats, stats.empty(len(df))))
+            self.queries.append(project_name, before, self.write_stamp(project_name), len(df))
+        return project_stats['total']
+
+    def append_segment(self, path: str, table: pa.Table):
+        """ Write rows appended to a data file as a segment, merged with the last parts as long as they are smaller. """
+        generation, parts, stale = read_parts(path)
+        for segment in stale:
+            os.remove(segment)
+        target = f'{path}.{generation}.{sum(part.num_rows for _, part in parts)}'
+        covered = []
+        while len(parts) > 0 and table.num_rows >= parts[-1][1].num_rows:
+            covered.append(target)
+            target, part = parts.pop()
+            # existing batches are copied as they are, without converting them
+            table = pa.concat_tables([part, table])
+        write_table(table, target, generation)
+        for segment in covered[1:]:  # the first one was never written
+            os.remove(segment)
+        os.utime(path)  # the cached data of other processes is stamped with the data file
+
+    def read_records(self, project_name: str, start: int,
+                     stop: int) -> List[Tuple[str, str, int]]:
+        updates = self.journal_updates(project_name)
+        table = self.read_table(project_name)
+        start = max(start, 0)
+        table = table.slice(start, max(min(stop, table.num_rows) - start, 0))
+        # a few rows convert faster to python objects than through pandas
+        texts, verified, mask = (table[name].to_pylist() for name in SCHEMA.names)
+        verified = [value.strftime(VERIFIED_FORMAT) if value else '0' for value in verified]
+        return [(text, *updates.get(index, (verified, mask)))
+                for index, (text, verified, mask) in enumerate(zip(texts, verified, mask), start)]
+
+    def check_verified(self, verified: str):
+        to_timestamps([verified])  # reject what cannot be compacted into the file
+
+    def update_label(self, project_name: str, index: int, labels: List[str],
+                     verified: str):
+        self.check_verified(verified)
+        super().update_label(project_name, index, labels, verified)
+
+    def update_labels(self, project_name: str,
+                      updates: List[Tuple[int, List[str], str]]):
+        to_timestamps([str(update[2]) for update in updates])
+        super().update_labels(project_name, updates)
+
+    def get_rows(self, project_name: str, labeled_only: bool = False) -> pd.DataFrame:
+        if not labeled_only or self.cache.peek(project_name, self.data_paths(project_name)) \
+                is not None:
+            return super().get_rows(project_name, labeled_only)
+        # select labeled rows on the mapped file, then convert only those
+        updates = self.journal_updates(project_name)
+        table = self.read_table(project_name)
+        mask = pc.is_valid(table['verified']).to_numpy(zero_copy_only=False)
+        for index, (verified, _) in updates.items():
+            if index < len(mask):
+                mask[index] = verified != '0'
+        rows = np.flatnonzero(mask)
+        df = to_frame(table.take(rows))
+        df.index = rows
+        hit = [index for index in rows if index in updates]
+        if len(hit) > 0:
+            df.loc[hit, 'verified'] = [updates[index][0] for index in hit]
+            df.loc[hit, 'mask'] = [updates[index][1] for index in hit]
+        return df
+
+    def iter_rows(self, project_name: str, labeled_only: bool = False,
+                  chunk_size: int = 10000) -> Iterator[pd.DataFrame]:
+        if self.cache.peek(project_name, self.data_paths(project_name)) is not None:
+            yield from super().iter_rows(project_name, labeled_only, chunk_size)
+            return
+        updates = self.journal_updates(project_name)
+        updated = np.array(sorted(updates), dtype='int64')
+        table = self.read_table(project_name)
+        for start in range(0, table.num_rows, chunk_size):
+            chunk = to_frame(table.slice(start, chunk_size))
+            chunk.index = pd.RangeIndex(start, start + len(chunk))
+            hit = updated[np.searchsorted(updated, start):
+                          np.searchsorted(updated, start + len(chunk))]
+            if len(hit) > 0:
+                chunk.loc[hit, 'verified'] = [updates[index][0] for index in hit]
+                chunk.loc[hit, 'mask'] = [updates[index][1] for index in hit]
+            if labeled_only:
+                chunk = chunk[chunk['verified'] != '0']
+            yield chunk
@@ -0,0 +1,220 @@
+from contextlib import nullcontext
+from typing import ContextManager, Dict, Hashable, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from srcs.storage import bitmask, query
+
+
+class Storage:
+    """
+    Interface of a storage engine keeping projects and their data. Row labels are
+    kept as bitmasks over the label vocabulary of each project (see `bitmask`) and
+    passed around as lists of label names, except for bulk reads returning the
+    bitmasks, the api takes care of any formatting.
+    """
+    def list_projects(self) -> List[str]:
+        """ Return list of project names. """
+        raise NotImplementedError
+
+    def create_project(self, project_name: str, create_date: str, description: str):
+        """ Create a new project without labels and data. """
+        raise NotImplementedError
+
+    def delete_project(self, project_name: str):
+        """ Delete a project together with its data. """
+        raise NotImplementedError
+
+    def get_project(self, project_name: str) -> dict:
+        """
+        Return information of a project, raise KeyError if it does not exist.
+
+        Returns:
+            {
+                'createDate': Project creation datetime, str,
+                'description': Project description, str,
+                'label': List of labels defined, List[str],
+            }
+        """
+        raise NotImplementedError
+
+    def update_project(self, project_name: str, description: str, labels: List[str],
+                       renames: Optional[Dict[str, str]] = None):
+        """
+        Update description and defined labels of a project. Labels no longer
+        defined are deleted from the data, renamed labels are given in `renames`
+        as {old name: new name}. Raise ValueError if a rename is invalid or there
+        are too many labels.
+        """
+        raise NotImplementedError
+
+    def get_vocabulary(self, project_name: str) -> List[str]:
+        """ Return the label name of each bit of the label bitmasks, '' if deleted. """
+        raise NotImplementedError
+
+    def projects_lock(self) -> ContextManager:
+        """ Return the lock held while project information is read and updated, none by default. """
+        return nullcontext()
+
+    def write_stamp(self, project_name: str) -> Hashable:
+        """ Return a value which changes whenever rows or labels of a project are written. """
+        raise NotImplementedError
+
+    def projects_stamp(self) -> Hashable:
+        """ Return a value which changes whenever a project is created, deleted or its information updated. """
+        raise NotImplementedError
+
+    def project_stamp(self, project_name: str) -> Hashable:
+        """ Return a value which changes whenever the information, rows or labels of a project are written. """
+        return self.projects_stamp(), self.write_stamp(project_name)
+
+    def last_modified(self, project_name: str) -> float:
+        """ Return when rows or labels of a project were last written in epoch seconds, 0 if never. """
+        raise NotImplementedError
+
+    def recent_projects(self) -> List[str]:
+        """ Return list of project names, the most recently modified first. """
+        return sorted(self.list_projects(), key=self.last_modified, reverse=True)
+
+    def release(self, project_name: str):
+        """ Drop what is kept in memory for a project, e.g. once another process serves it. """
+        queries = getattr(self, 'queries', None)
+        if queries is not None:
+            queries.discard(project_name)
+
+    def warm(self, project_name: str, max_bytes: int) -> int:
+        """
+        Prepare a project for its first requests, e.g. after the api starts, by
+        building its query index if it takes at most `max_bytes` of memory. Engines
+        caching data load it too. Return the bytes of memory taken.
+        """
+        total = self.count(project_name)
+        if total is None or total * query.ROW_BYTES > max_bytes:
+            return 0
+        self.query(project_name, limit=1, unlabeled=True)
+        return total * query.ROW_BYTES
+
+    def encode_labels(self, project_name: str, label_lists: List[List[str]]) -> List[int]:
+        """
+        Return the bitmask of each list of labels, adding labels not defined yet to
+        the project. Raise ValueError if the project would have more than 63 labels.
+        """
+        vocabulary = self.get_vocabulary(project_name)
+        if any(name and name not in vocabulary for names in label_lists for name in names):
+            with self.projects_lock():  # check again, another writer may have added them
+                vocabulary = self.get_vocabulary(project_name)
+                new = list(dict.fromkeys(name for names in label_lists for name in names
+                                         if name and name not in vocabulary))
+                if len(new) > 0:
+                    info = self.get_project(project_name)
+                    self.update_project(project_name, info['description'], info['label'] + new)
+                    vocabulary = self.get_vocabulary(project_name)
+        return [bitmask.encode(names, vocabulary) for names in label_lists]
+
+    def add_texts(self, project_name: str, texts: List[str]):
+        """ Replace the data of a project with unlabeled texts. """
+        raise NotImplementedError
+
+    def append_texts(self, project_name: str, texts: List[str]) -> int:
+        """ Append unlabeled texts to the data of a project and return the new number of rows. """
+        raise NotImplementedError
+
+    def truncate(self, project_name: str, total: int):
+        """ Drop all rows of a project from index `total` onwards. """
+        raise NotImplementedError
+
+    def count(self, project_name: str) -> Optional[int]:
+        """ Return number of rows of a project, None if no data been added. """
+        raise NotImplementedError
+
+    def get_stats(self, project_name: str) -> Optional[dict]:
+        """
+        Return statistics of a project, None if no data been added.
+
+        Returns:
+            {
+                'total': Number of rows, int,
+                'labeled': Number of verified rows, int,
+                'labels': Number of rows per label, Dict[str, int],
+            }
+        """
+        raise NotImplementedError
+
+    def rebuild_stats(self, project_name: str) -> Optional[dict]:
+        """ Recompute statistics of a project from its data and return them. """
+        raise NotImplementedError
+
+    def get_row(self, project_name: str, index: int) -> Tuple[str, str, List[str]]:
+        """ Return text, verification datetime and labels of a row. """
+        raise NotImplementedError
+
+    def get_range(self, project_name: str, offset: int,
+                  limit: int) -> List[Tuple[str, str, List[str]]]:
+        """ Return text, verification datetime and labels of up to `limit` rows from `offset`. """
+        raise NotImplementedError
+
+    def check_verified(self, verified: str):
+        """ Raise ValueError if a verification datetime cannot be stored, any string can by default. """
+
+    def update_label(self, project_name: str, index: int, labels: List[str],
+                     verified: str):
+        """ Set labels and verification datetime of a row. """
+        raise NotImplementedError
+
+    def update_labels(self, project_name: str,
+                      updates: List[Tuple[int, List[str], str]]):
+        """
+        Set labels and verification datetimes of many rows at once. Updates are
+        given as (row index, labels, verification datetime), if a row appears more
+        than once its last update wins.
+        """
+        for index, labels, verified in updates:
+            self.update_label(project_name, index, labels, verified)
+
+    def get_rows(self, project_name: str, labeled_only: bool = False) -> pd.DataFrame:
+        """
+        Return data of a project as a dataframe with "texts", "verified" and
+        label bitmask "mask" columns.
+        """
+        raise NotImplementedError
+
+    def iter_rows(self, project_name: str, labeled_only: bool = False,
+                  chunk_size: int = 10000) -> Iterator[pd.DataFrame]:
+        """
+        Iterate over the data of a project in chunks of at most `chunk_size` rows,
+        same columns as `get_rows`, without loading all data into memory.
+        """
+        raise NotImplementedError
+
+    def query(self, project_name: str, start: int = 0, limit: int = 100,
+              unlabeled: Optional[bool] = None, has: List[str] = (), lacks: List[str] = (),
+              before: Optional[str] = None,
+              after: Optional[str] = None) -> Tuple[List[int], Optional[int]]:
+        """
+        Return indices of up to `limit` rows from index `start` matching all given
+        conditions, and the index to start the next page from, None if there are
+        no more matching rows. Rows are looked up in the query index of the
+        project, kept by engines in their `queries` along with `write_stamp`. Raise
+        KeyError if a label is not defined and ValueError if a datetime is invalid.
+
+        Args:
+            project_name (str): Project name.
+            start (int): Index of the first row to look at.
+            limit (int): Max number of rows returned.
+            unlabeled (bool, optional): Only unlabeled rows if True, only labeled
+                rows if False.
+            has (List[str]): Labels a row must all have.
+            lacks (List[str]): Labels a row must not have.
+            before (str, optional): Only rows verified before this datetime.
+            after (str, optional): Only rows verified after this datetime.
+        """
+        vocabulary = self.get_vocabulary(project_name)
+        times = {name: None if value is None else int(pd.Timestamp(value).timestamp())
+                 for name, value in (('before', before), ('after', after))}
+        if self.count(project_name) is None:  # if no data been added
+            return [], None
+        return self.queries.search(
+            project_name, self.write_stamp(project_name),
+            lambda: query.QueryIndex.build(self.iter_rows(project_name)),
+            start=start, limit=limit, unlabeled=unlabeled, has=bitmask.encode(has, vocabulary),
+            lacks=bitmask.encode(lacks, vocabulary), **times)
@@ -0,0 +1,118 @@
+"""
+Labels of a row are kept as an integer bitmask over the label vocabulary of its
+project, bit i being set if the row has the i-th label of the vocabulary. A
+deleted label leaves an empty name at its position and a renamed label keeps
+its position, so neither touches the data. Bits of deleted labels are ignored
+and only cleared from the data once the vocabulary runs out of bits.
+"""
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+MAX_LABELS = 63  # bits of a signed 64-bit integer
+SEP = ':sep:'
+
+
+def parse_vocabulary(value: str) -> List[str]:
+    """ Parse a ":sep:" separated vocabulary, deleted labels are empty names. """
+    return value.split(SEP) if value else []
+
+
+def format_vocabulary(vocabulary: List[str]) -> str:
+    """ Join a vocabulary with ":sep:". """
+    return SEP.join(vocabulary)
+
+
+def encode(labels: List[str], vocabulary: List[str]) -> int:
+    """ Return the bitmask of a list of labels, raise KeyError if a label is not in the vocabulary. """
+    mask = 0
+    for label in labels:
+        if label == '':
+            continue
+        if label not in vocabulary:
+            raise KeyError(label)
+        mask |= 1 << vocabulary.index(label)
+    return mask
+
+
+def decode(mask: int, vocabulary: List[str]) -> List[str]:
+    """ Return the labels of a bitmask, in vocabulary order. """
+    return [name for bit, name in enumerate(vocabulary) if name and mask >> bit & 1]
+
+
+def decode_all(masks: np.ndarray, vocabulary: List[str]) -> Dict[int, List[str]]:
+    """ Return the labels of each distinct bitmask of many rows. """
+    return {int(mask): decode(int(mask), vocabulary) for mask in np.unique(masks)}
+
+
+def join_all(masks: np.ndarray, vocabulary: List[str], sep: str = SEP) -> np.ndarray:
+    """ Return the labels of each row joined with `sep`, decoding each distinct bitmask once. """
+    masks = np.asarray(masks, dtype='int64')
+    unique, inverse = np.unique(masks, return_inverse=True)
+    names = np.array([sep.join(decode(int(mask), vocabulary)) for mask in unique], dtype=object)
+    return names[inverse] if len(masks) > 0 else np.empty(0, dtype=object)
+
+
+def encode_all(labels: pd.Series, vocabulary: List[str]) -> np.ndarray:
+    """ Return the bitmask of each row from ":sep:" separated labels, e.g. of a legacy file. """
+    codes, unique = pd.factorize(labels.fillna(''))
+    masks = np.array([encode(value.split(SEP) if value else [], vocabulary)
+                      for value in unique], dtype='int64')
+    return masks[codes] if len(codes) > 0 else np.empty(0, dtype='int64')
+
+
+def bit_counts(masks: np.ndarray) -> List[int]:
+    """ Return the number of rows with each bit set, up to the highest bit set. """
+    masks = np.asarray(masks, dtype='int64')
+    n_bits = int(np.bitwise_or.reduce(masks)).bit_length() if len(masks) > 0 else 0
+    return [int(np.count_nonzero(masks >> bit & 1)) for bit in range(n_bits)]
+
+
+def cooccurrence(masks: np.ndarray, n_bits: int, chunk_size: int = 2 ** 16) -> np.ndarray:
+    """ Return the matrix of the number of rows having both bit i and bit j. """
+    masks = np.asarray(masks, dtype='int64')
+    matrix = np.zeros((n_bits, n_bits), dtype='int64')
+    for start in range(0, len(masks), chunk_size):
+        chunk = masks[start:start + chunk_size, None] >> np.arange(n_bits, dtype='int64') & 1
+        matrix += chunk.T @ chunk
+    return matrix
+
+
+def update_vocabulary(vocabulary: List[str], labels: List[str],
+                      renames: Optional[Dict[str, str]] = None) -> Tuple[List[str], int]:
+    """
+    Update a vocabulary to the defined labels of a project after renaming some
+    of them. Labels no longer defined are deleted and new labels take a new bit,
+    or if all bits are used the bit of a deleted label.
+
+    Args:
+        vocabulary (List[str]): Current vocabulary.
+        labels (List[str]): Labels defined after the update.
+        renames (Dict[str, str], optional): New name of renamed labels.
+
+    Returns:
+        The new vocabulary, List[str], and the bitmask of deleted labels whose bit
+        has been given to a new label, which must be cleared from the data, int.
+    """
+    vocabulary = list(vocabulary)
+    for old, new in (renames or {}).items():
+        if old not in vocabulary or old == '':
+            raise ValueError(f'Label "{old}" does not exist.')
+        if new in vocabulary or new == '':
+            raise ValueError(f'Label "{new}" already exists.')
+        vocabulary[vocabulary.index(old)] = new
+    vocabulary = [name if name in labels else '' for name in vocabulary]
+    reused = 0
+    for name in labels:
+        if name == '' or name in vocabulary:
+            continue
+        if len(vocabulary) < MAX_LABELS:
+            vocabulary.append(name)
+        elif '' in vocabulary:
+            bit = vocabulary.index('')
+            vocabulary[bit] = name
+            reused |= 1 << bit
+        else:
+            raise ValueError(f'A project cannot have more than {MAX_LABELS} labels.')
+    return vocabulary, reused
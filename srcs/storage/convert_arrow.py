@@ -0,0 +1,48 @@
+"""
+Convert the data.csv of every project under PROJECT_DIR into the data.arrow file
+used by the "arrow" storage engine. Label journals are folded into data.csv
+first, which is kept as it is. Projects already converted are skipped, so the
+script can be rerun safely. Run it from the repo root:
+
+    python -m srcs.storage.convert_arrow --config ./config.yaml
+"""
+import os
+import argparse
+
+from srcs import utils
+from srcs.storage import CSVStorage
+from srcs.storage.arrow_storage import ArrowStorage, to_table, write_table
+
+
+def convert(project_dir: str):
+    """
+    Write an arrow data file for each project which only has a data csv.
+
+    Args:
+        project_dir (str): Directory containing projects.csv and project folders.
+    """
+    csv_storage = CSVStorage(project_dir, cache_bytes=0)  # nothing to cache
+    for project_name in csv_storage.list_projects():
+        path = os.path.join(project_dir, project_name, ArrowStorage.DATA_FILE)
+        if os.path.exists(path):
+            print(f'Skip "{project_name}", already converted.')
+            continue
+        if not os.path.exists(csv_storage.data_path(project_name)):
+            print(f'Skip "{project_name}", no data.')
+            continue
+        csv_storage.compact(project_name)
+        df = csv_storage.read_data(project_name)
+        try:
+            write_table(to_table(df), path)
+        except ValueError as e:  # verification datetime not written by the app
+            print(f'Failed to convert "{project_name}": {e}')
+            continue
+        print(f'Converted "{project_name}" with {len(df)} rows.')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--config', default='./config.yaml',
+                        help='Path to the configuration file.')
+    args = parser.parse_args()
+    convert(utils.load_yaml(args.config)['PROJECT_DIR'])
@@ -0,0 +1,649 @@
+import io
+import os
+import csv
+import shutil
+import logging
+import threading
+from typing import Dict, Hashable, Iterable, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from srcs import metrics, utils
+from srcs.cache import DatasetCache
+from srcs.locks import RWLock
+from srcs.storage import bitmask, journal, query, row_index, stats
+from srcs.storage.base import Storage
+
+SEEK_ROWS = 1000  # label updates of more uncached rows load the whole data instead
+ROW_BYTES = 120  # memory of a parsed row besides its text, to estimate the memory of a dataset
+
+logger = logging.getLogger(__name__)
+
+
+def load_csv(path: str) -> pd.DataFrame:
+    """ Parse a csv file keeping every value as string, empty labels become ''. """
+    size = os.path.getsize(path)
+    with metrics.csv_timer('read_csv', path):
+        df = pd.read_csv(path, dtype=str, keep_default_na=False)
+    metrics.record_io(path, read=size)
+    return df
+
+
+def read_csv_chunks(path: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+    """ Stream the rows of a data csv, `chunk_size` at a time. """
+    metrics.record_io(path, read=os.path.getsize(path))
+    chunks = pd.read_csv(path, dtype={'texts': str, 'verified': str, 'mask': 'int64'},
+                         keep_default_na=False, chunksize=chunk_size)
+    while True:
+        with metrics.csv_timer('read_csv', path):
+            chunk = next(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+def load_data(paths: Tuple[str, ...]) -> pd.DataFrame:
+    """ Parse a data csv and apply the label journals following it. """
+    df = load_csv(paths[0])
+    if 'mask' in df.columns:  # not a csv written before labels were bitmasks
+        df['mask'] = df['mask'].astype('int64')
+    return journal.replay(df, *paths[1:])
+
+
+def load_projects(path: str) -> pd.DataFrame:
+    """ Parse projects.csv, the vocabulary of a project kept before it existed is its labels. """
+    df = load_csv(path)
+    if 'vocabulary' not in df.columns:
+        df['vocabulary'] = df['label']
+    return df
+
+
+def journal_stamp(paths: Iterable[str]) -> Tuple[Optional[Tuple[int, int]], ...]:
+    """ Return the modification time and size of each journal, None if missing. """
+    stamps = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stamps.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            stamps.append(None)
+    return tuple(stamps)
+
+
+def write_csv(df: pd.DataFrame, path: str):
+    """ Write a csv to a temporary file then move it over the original one. """
+    with utils.atomic_path(path) as tmp:
+        with metrics.csv_timer('to_csv', path):
+            df.to_csv(tmp, index=False)
+        metrics.record_io(path, written=os.path.getsize(tmp))
+
+
+class CSVStorage(Storage):
+    """
+    Storage engine keeping project information in "projects.csv" and data of
+    each project in "<project>/data.csv" under the project directory. Parsed
+    files are shared by all requests through an in-memory cache.
+
+    Statistics of each project are kept in "<project>/stats.json" and updated
+    along with the data. Label updates are appended to "<project>/labels.journal" instead of
+    rewriting data.csv, reads overlay the journal on data.csv and a background
+    thread folds the journal into data.csv once it is large or old enough.
+
+    Single rows are read by seeking to their byte offset, kept in
+    "<project>/data.csv.idx", so data which is not cached is not parsed as a whole.
+
+    Labels of each row are kept as a bitmask in the "mask" column, over the label
+    vocabulary kept in the "vocabulary" column of projects.csv. Data written
+    before are converted when the storage is created.
+
+    Several processes may share the project directory, writes are serialized by
+    lock files under "<project_dir>/.locks" and files are replaced atomically, so
+    readers never see a partially written file.
+
+    Args:
+        project_dir (str): Directory containing all projects.
+        cache_bytes (int): Memory budget of the dataset cache in bytes.
+        journal_bytes (int): Journal size in bytes triggering a compaction.
+        journal_age (float): Seconds after which pending label updates are compacted.
+        fsync (bool): Flush each label update to disk before acknowledging it.
+    """
+    DATA_FILE = 'data.csv'
+
+    def __init__(self, project_dir: str, cache_bytes: int,
+                 journal_bytes: int = 4 * 2 ** 20, journal_age: float = 300,
+                 fsync: bool = True):
+        self.project_dir = project_dir
+        self.projects_csv = os.path.join(project_dir, 'projects.csv')
+        self.cache = DatasetCache(cache_bytes)
+        self.fsync = fsync
+        self.compactor = journal.Compactor(self.compact, journal_bytes, journal_age)
+        self.lock_dir = os.path.join(project_dir, '.locks')
+        self._locks = {}
+        self._file_locks = {}
+        self._locks_lock = threading.Lock()
+        self._projects_lock = RWLock(os.path.join(self.lock_dir, 'projects.lock'))
+        self._journals = {}  # project -> (journal stamps, {row: (verified, mask)})
+        self._vocabularies = (None, {})  # (parsed projects.csv, {project: vocabulary})
+        self.queries = query.QueryIndexes()
+        os.makedirs(project_dir, exist_ok=True)
+        with self.projects_lock():  # other processes may be starting too
+            self.upgrade()
+        self.compactor.start()
+        # compact journals left over by the previous run
+        for project_name in os.listdir(project_dir):
+            path = self.data_paths(project_name)[2]
+            if os.path.exists(path):
+                self.compactor.notify(project_name, os.path.getsize(path))
+
+    def lock(self, project_name: str) -> RWLock:
+        """
+        Return the lock serializing writes to the data of a project, held in shared
+        mode while the data is parsed so it does not change in between.
+        """
+        with self._locks_lock:
+            if project_name not in self._locks:
+                self._locks[project_name] = RWLock(
+                    os.path.join(self.lock_dir, f'{project_name}.lock'))
+            return self._locks[project_name]
+
+    def file_lock(self, project_name: str) -> RWLock:
+        """
+        Return the lock held while the data csv of a project is rewritten or grows,
+        which may take a while. Acquire it before `lock` if both are needed.
+        """
+        with self._locks_lock:
+            if project_name not in self._file_locks:
+                self._file_locks[project_name] = RWLock(
+                    os.path.join(self.lock_dir, f'{project_name}.file.lock'))
+            return self._file_locks[project_name]
+
+    def projects_lock(self) -> RWLock:
+        """ Return the lock serializing updates of projects.csv, acquire it before any other lock. """
+        return self._projects_lock
+
+    def write_stamp(self, project_name: str) -> Hashable:
+        # statistics are saved with a new version along with every change of rows or labels
+        try:
+            return stats.version(self.stats_path(project_name))
+        except FileNotFoundError:
+            return None
+
+    def last_modified(self, project_name: str) -> float:
+        # versions of the statistics never fall behind the time they are saved
+        try:
+            return stats.version(self.stats_path(project_name)) / 1e9
+        except FileNotFoundError:
+            return 0
+
+    def warm(self, project_name: str, max_bytes: int) -> int:
+        path = self.data_path(project_name)
+        if not os.path.exists(path):
+            return 0
+        self.read_records(project_name, 0, 1)  # builds a missing row index
+        # warming a dataset must not evict another one
+        max_bytes = min(max_bytes, self.cache.max_bytes - self.cache.nbytes)
+        if os.path.getsize(path) + (self.count(project_name) or 0) * ROW_BYTES > max_bytes:
+            return 0
+        self.read_data(project_name)
+        nbytes = self.cache.size(project_name)
+        return nbytes + super().warm(project_name, max_bytes - nbytes)
+
+    def release(self, project_name: str):
+        super().release(project_name)
+        self.cache.invalidate(project_name)
+
+    def projects_stamp(self) -> Hashable:
+        try:
+            stat = os.stat(self.projects_csv)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def data_path(self, project_name: str) -> str:
+        """ Return path to the data file of a project. """
+        return os.path.join(self.project_dir, project_name, self.DATA_FILE)
+
+    def stats_path(self, project_name: str) -> str:
+        """ Return path to the statistics of a project. """
+        return os.path.join(self.project_dir, project_name, stats.STATS)
+
+    def data_paths(self, project_name: str) -> Tuple[str, str, str]:
+        """ Return paths to the data file and label journals of a project, oldest first. """
+        folder = os.path.join(self.project_dir, project_name)
+        return (os.path.join(folder, self.DATA_FILE), os.path.join(folder, journal.COMPACTING),
+                os.path.join(folder, journal.JOURNAL))
+
+    def read_data(self, project_name: str) -> pd.DataFrame:
+        """
+        Return the cached data of a project. The returned dataframe is shared, copy
+        it before modifying unless the change is written back with `write_data`.
+        """
+        def load(paths: Tuple[str, ...]) -> pd.DataFrame:
+            with self.lock(project_name).shared():  # no compaction or append halfway
+                return self.load_data(paths)
+
+        return self.cache.get(project_name, self.data_paths(project_name), load)
+
+    def load_data(self, paths: Tuple[str, ...]) -> pd.DataFrame:
+        """ Parse a data file and apply the label journals following it. """
+        return load_data(paths)
+
+    def write_file(self, df: pd.DataFrame, path: str):
+        """ Write the data of a project to a file, replacing it atomically. """
+        write_csv(df, path)
+        row_index.build(path)
+
+    def data_columns(self, path: str) -> List[str]:
+        """ Return the column names of a data file. """
+        with open(path, 'r', encoding='utf-8', newline='') as file:
+            return next(csv.reader(file), [])
+
+    def upgrade(self):
+        """ Convert the ":sep:" separated labels of data written before labels were bitmasks. """
+        for project_name in self.list_projects():
+            path = self.data_path(project_name)
+            if not os.path.exists(path) or 'mask' in self.data_columns(path):
+                continue
+            df = self.load_data(self.data_paths(project_name))
+            info = self.get_project(project_name)
+            found = df['label'].str.split(bitmask.SEP).explode().unique()
+            labels = info['label'] + [name for name in found
+                                      if name and name not in info['label']]
+            try:
+                self.update_project(project_name, info['description'], labels)
+            except ValueError:
+                logger.exception('Failed to convert the labels of "%s"', project_name)
+                continue
+            df['mask'] = bitmask.encode_all(df['label'], self.get_vocabulary(project_name))
+            self.write_data(project_name, df[['texts', 'verified', 'mask']])
+            self.rebuild_stats(project_name)
+
+    def clear_bits(self, project_name: str, mask: int):
+        """ Clear bits of deleted labels from the labels of all rows. """
+        with self.file_lock(project_name), self.lock(project_name):
+            if not os.path.exists(self.data_path(project_name)):
+                return
+            df = self.read_data(project_name).copy()
+            df['mask'] &= ~mask
+            self.write_data(project_name, df)
+            self.queries.discard(project_name)
+            stats.save(self.stats_path(project_name),
+                       stats.clear(self.load_stats(project_name), mask))
+
+    def write_data(self, project_name: str, df: pd.DataFrame):
+        """ Replace the data of a project, dropping its journals, and keep it in the cache. """
+        with self.file_lock(project_name), self.lock(project_name):
+            for path in self.data_paths(project_name)[1:]:
+                if os.path.exists(path):
+                    os.remove(path)
+            self.write_file(df, self.data_path(project_name))
+            self.compactor.discard(project_name)
+            self.cache.update(project_name, self.data_paths(project_name), df)
+
+    def compact(self, project_name: str):
+        """
+        Fold the label journal of a project into its data csv. The journal is
+        renamed first so label updates can go on while the csv is written.
+        """
+        paths = self.data_paths(project_name)
+        with self.file_lock(project_name):
+            with self.lock(project_name):
+                if not os.path.exists(paths[2]):
+                    return
+                fresh = self.cache.peek(project_name, paths) is not None
+                if os.path.exists(paths[1]):  # left over by an interrupted compaction
+                    journal.append(paths[1], journal.read(paths[2]).itertuples(index=False),
+                                   fsync=self.fsync)
+                    os.remove(paths[2])
+                else:
+                    os.replace(paths[2], paths[1])
+                self.refresh_cache(project_name, fresh)
+                df = self.read_data(project_name).copy()
+
+            self.write_file(df, paths[0])
+            with self.lock(project_name):
+                fresh = self.cache.peek(project_name, paths) is not None
+                os.remove(paths[1])
+                self.refresh_cache(project_name, fresh)
+
+    def journal_updates(self, project_name: str) -> dict:
+        """
+        Return the last (verified, mask) update of each row found in the label
+        journals of a project, cached until the journals change on disk.
+        """
+        paths = self.data_paths(project_name)[1:]
+        with self.lock(project_name).shared():
+            stamp = journal_stamp(paths)
+            entry = self._journals.get(project_name)
+            if entry is None or entry[0] != stamp:
+                updates = journal.read_all(*paths)
+                entry = (stamp, dict(zip(updates.index, zip(updates['verified'],
+                                                            updates['mask'].astype(int)))))
+                self._journals[project_name] = entry
+            return entry[1]
+
+    def read_records(self, project_name: str, start: int,
+                     stop: int) -> List[Tuple[str, str, int]]:
+        """
+        Return rows of (text, verified, label bitmask) from index `start`
+        to `stop` by seeking to their offset in the data csv, without parsing
+        other rows. The offset index is rebuilt if the csv has changed.
+
+        Args:
+            project_name (str): Project name.
+            start (int): Index of the first row.
+            stop (int): Index after the last row.
+        """
+        path = self.data_path(project_name)
+        # read the journals before the csv, if a compaction folds them into the csv
+        # in between, the updates are applied twice instead of being missed
+        updates = self.journal_updates(project_name)
+        while True:
+            with open(path, 'rb') as file:
+                offsets = row_index.load(path, os.fstat(file.fileno()))
+                if offsets is not None:
+                    stop = min(stop, len(offsets) - 1)
+                    if start >= stop:
+                        return []
+                    header = file.read(int(offsets[0]))
+                    file.seek(int(offsets[start]))
+                    records = file.read(int(offsets[stop] - offsets[start]))
+                    metrics.record_io(path, read=len(header) + len(records))
+                    break
+            with self.file_lock(project_name):  # index missing or out of date
+                if row_index.load(path) is None:
+                    row_index.build(path)
+
+        reader = csv.reader(io.StringIO((header + records).decode('utf-8'), newline=''))
+        columns = next(reader)
+        text, verified, mask = (columns.index(name) for name in ('texts', 'verified', 'mask'))
+        return [(row[text], *updates.get(index, (row[verified], int(row[mask]))))
+                for index, row in enumerate(reader, start)]
+
+    def read_projects(self) -> pd.DataFrame:
+        """ Return the cached projects.csv. """
+        return self.cache.get(self.projects_csv, self.projects_csv, load_projects)
+
+    def write_projects(self, df: pd.DataFrame):
+        """ Write projects.csv and keep it in the cache. """
+        write_csv(df, self.projects_csv)
+        self.cache.update(self.projects_csv, self.projects_csv, df)
+        self._vocabularies = (None, {})
+
+    def list_projects(self) -> List[str]:
+        try:
+            return self.read_projects().project.to_list()
+        except FileNotFoundError:
+            return []
+
+    def create_project(self, project_name: str, create_date: str, description: str):
+        # create folder
+        os.makedirs(os.path.join(self.project_dir, project_name), exist_ok=True)
+        # add project info
+        df_to_append = pd.DataFrame({
+            'project': [project_name],
+            'createDate': [create_date],
+            'description': [description],
+            'label': [''],
+            'vocabulary': [''],
+        })
+        with self.projects_lock():
+            try:
+                df = pd.concat([self.read_projects(), df_to_append], ignore_index=True)
+            except FileNotFoundError:
+                df = df_to_append
+
+            self.write_projects(df)
+
+    def delete_project(self, project_name: str):
+        with self.projects_lock():
+            # delete folder
+            with self.file_lock(project_name), self.lock(project_name):
+                shutil.rmtree(os.path.join(self.project_dir, project_name))
+                self.compactor.discard(project_name)
+                self._journals.pop(project_name, None)
+                self.queries.discard(project_name)
+                self.cache.bump(project_name)
+            # delete project info
+            df = self.read_projects()
+            self.write_projects(df[df['project'] != project_name])
+
+    def get_project(self, project_name: str) -> dict:
+        df = self.read_projects()
+        selected_df = df.loc[df.project == project_name].reset_index()
+        if len(selected_df) == 0:
+            raise KeyError(project_name)
+        label = selected_df.label[0]
+        return {
+            'createDate': selected_df.createDate[0],
+            'description': selected_df.description[0],
+            'label': label.split(':sep:') if label else [],
+        }
+
+    def update_project(self, project_name: str, description: str, labels: List[str],
+                       renames: Optional[Dict[str, str]] = None):
+        with self.projects_lock():
+            vocabulary, reused = bitmask.update_vocabulary(
+                self.get_vocabulary(project_name), labels, renames)
+            if reused:  # bits of deleted labels given to new labels
+                self.clear_bits(project_name, reused)
+            df = self.read_projects()
+            id = df.project == project_name
+            df.loc[id, 'description'] = description
+            df.loc[id, 'label'] = ':sep:'.join(labels)
+            df.loc[id, 'vocabulary'] = bitmask.format_vocabulary(vocabulary)
+            self.write_projects(df)
+
+    def get_vocabulary(self, project_name: str) -> List[str]:
+        df = self.read_projects()
+        if self._vocabularies[0] is not df:  # parse once per version of projects.csv
+            self._vocabularies = (df, {name: bitmask.parse_vocabulary(vocabulary)
+                                       for name, vocabulary in zip(df.project, df.vocabulary)})
+        return list(self._vocabularies[1][project_name])
+
+    def add_texts(self, project_name: str, texts: List[str]):
+        df = pd.DataFrame({'texts': texts}).astype(str)
+        df['verified'] = '0'
+        df['mask'] = 0
+        with self.file_lock(project_name), self.lock(project_name):
+            self.write_data(project_name, df)
+            self.queries.discard(project_name)
+            stats.save(self.stats_path(project_name), stats.empty(len(df)))
+
+    def append_texts(self, project_name: str, texts: List[str]) -> int:
+        df = pd.DataFrame({'texts': texts}).astype(str)
+        df['verified'] = '0'
+        df['mask'] = 0
+        path = self.data_path(project_name)
+        with self.file_lock(project_name), self.lock(project_name):
+            exists = os.path.exists(path)
+            project_stats = self.load_stats(project_name) if exists else stats.empty()
+            offsets = row_index.load(path) if exists else None
+            with open(path, 'a', encoding='utf-8', newline='') as file:
+                size = file.tell()
+                with metrics.csv_timer('to_csv', path):
+                    df.to_csv(file, index=False, header=not exists)
+                file.flush()
+                os.fsync(file.fileno())
+                metrics.record_io(path, written=file.tell() - size)
+            if offsets is not None:
+                row_index.extend(path, offsets)
+            else:
+                row_index.build(path)
+            self.cache.bump(project_name)  # reparse on next read instead of copying
+            before = self.write_stamp(project_name)
+            stats.save(self.stats_path(project_name),
+                       stats.merge(project_stats, stats.empty(len(df))))
+            self.queries.append(project_name, before, self.write_stamp(project_name), len(df))
+        return project_stats['total']
+
+    def truncate(self, project_name: str, total: int):
+        with self.file_lock(project_name), self.lock(project_name):
+            self.write_data(project_name, self.read_data(project_name).iloc[:total].copy())
+            self.queries.discard(project_name)
+            self.rebuild_stats(project_name)
+
+    def count(self, project_name: str) -> Optional[int]:
+        project_stats = self.get_stats(project_name)
+        return None if project_stats is None else project_stats['total']
+
+    def load_stats(self, project_name: str) -> Optional[dict]:
+        """ Return statistics of a project counting rows per label bit, None if no data been added. """
+        if not os.path.exists(self.data_path(project_name)):  # if no data been added
+            return None
+        try:
+            return stats.load(self.stats_path(project_name))
+        except (FileNotFoundError, ValueError):  # created before stats were kept
+            return self.compute_stats(project_name)
+
+    def compute_stats(self, project_name: str) -> dict:
+        """ Recompute statistics of a project counting rows per label bit and save them. """
+        with self.lock(project_name):
+            df = self.read_data(project_name)
+            project_stats = stats.compute(df['verified'], df['mask'])
+            stats.save(self.stats_path(project_name), project_stats)
+        return project_stats
+
+    def get_stats(self, project_name: str) -> Optional[dict]:
+        project_stats = self.load_stats(project_name)
+        if project_stats is None:
+            return None
+        return stats.named(project_stats, self.get_vocabulary(project_name))
+
+    def rebuild_stats(self, project_name: str) -> Optional[dict]:
+        try:
+            project_stats = self.compute_stats(project_name)
+        except FileNotFoundError:
+            return None
+        return stats.named(project_stats, self.get_vocabulary(project_name))
+
+    def read_rows(self, project_name: str, offset: int,
+                  limit: int) -> List[Tuple[str, str, int]]:
+        """ Return text, verification datetime and label bitmask of up to `limit` rows from `offset`. """
+        df = self.cache.peek(project_name, self.data_paths(project_name))
+        if df is not None:
+            df = df.iloc[max(offset, 0):offset + limit]
+            return list(zip(df.texts, df.verified, df['mask'].tolist()))
+        # seek to the rows instead of loading the whole csv
+        return self.read_records(project_name, offset, offset + limit)
+
+    def get_row(self, project_name: str, index: int) -> Tuple[str, str, List[str]]:
+        rows = self.get_range(project_name, index, 1) if index >= 0 else []
+        if len(rows) == 0:
+            raise IndexError(index)
+        return rows[0]
+
+    def get_range(self, project_name: str, offset: int,
+                  limit: int) -> List[Tuple[str, str, List[str]]]:
+        rows = self.read_rows(project_name, offset, limit)
+        vocabulary = self.get_vocabulary(project_name)
+        return [(text, verified, bitmask.decode(mask, vocabulary))
+                for text, verified, mask in rows]
+
+    def update_label(self, project_name: str, index: int, labels: List[str],
+                     verified: str):
+        mask = self.encode_labels(project_name, [labels])[0]
+        paths = self.data_paths(project_name)
+        with self.lock(project_name):
+            rows = self.read_rows(project_name, index, 1) if index >= 0 else []
+            if len(rows) == 0:
+                raise IndexError(index)
+            _, old_verified, old_mask = rows[0]
+            project_stats = self.load_stats(project_name)
+            stats.update(project_stats, old_verified, old_mask, verified, mask)
+            df = self.cache.peek(project_name, paths)
+            if df is not None:
+                df.at[index, 'verified'] = verified
+                df.at[index, 'mask'] = mask
+            size = self.append_journal(project_name, [(index, verified, mask)])
+            before = self.write_stamp(project_name)
+            stats.save(self.stats_path(project_name), project_stats)
+            self.queries.update(project_name, before, self.write_stamp(project_name),
+                                [index], [verified], [mask])
+        self.compactor.notify(project_name, size)
+
+    def update_labels(self, project_name: str,
+                      updates: List[Tuple[int, List[str], str]]):
+        updates = pd.DataFrame(updates, columns=['index', 'labels', 'verified'])
+        updates = updates.drop_duplicates('index', keep='last')
+        index = updates['index'].to_numpy(dtype='int64')
+        verified = updates['verified'].astype(str)
+        mask = pd.Series(self.encode_labels(project_name, updates['labels'].to_list()),
+                         dtype='int64')
+        paths = self.data_paths(project_name)
+        with self.lock(project_name):
+            project_stats = self.load_stats(project_name)
+            total = 0 if project_stats is None else project_stats['total']
+            if len(index) > 0 and (index.min() < 0 or index.max() >= total):
+                raise IndexError(index)
+            df = self.cache.peek(project_name, paths)
+            if df is None and len(index) > SEEK_ROWS:  # cheaper to load everything
+                df = self.read_data(project_name)
+            if df is not None:
+                old = df[['verified', 'mask']].iloc[index]
+            else:
+                old = pd.DataFrame([self.read_records(project_name, i, i + 1)[0][1:]
+                                    for i in index], columns=['verified', 'mask'])
+            stats.merge(project_stats, stats.compute(old['verified'], old['mask']), sign=-1)
+            stats.merge(project_stats, stats.compute(verified, mask))
+            if df is not None:
+                df.loc[index, 'verified'] = verified.to_numpy()
+                df.loc[index, 'mask'] = mask.to_numpy()
+            size = self.append_journal(project_name, zip(index, verified, mask))
+            before = self.write_stamp(project_name)
+            stats.save(self.stats_path(project_name), project_stats)
+            self.queries.update(project_name, before, self.write_stamp(project_name),
+                                index, verified, mask)
+        self.compactor.notify(project_name, size)
+
+    def append_journal(self, project_name: str,
+                       entries: Iterable[Tuple[int, str, int]]) -> int:
+        """
+        Append label updates to the journal of a project, already applied to the
+        cached data if any, and return the journal size. Hold `lock` when calling.
+        """
+        paths = self.data_paths(project_name)
+        entries = list(entries)
+        updates = self.journal_updates(project_name)
+        fresh = self.cache.peek(project_name, paths) is not None
+        size = journal.append(paths[2], entries, fsync=self.fsync)
+        for index, verified, mask in entries:
+            updates[int(index)] = (verified, int(mask))
+        self._journals[project_name] = (journal_stamp(paths[1:]), updates)
+        self.refresh_cache(project_name, fresh)
+        return size
+
+    def refresh_cache(self, project_name: str, fresh: bool):
+        """
+        Mark the cached data of a project as fresh after a change of its journals
+        done under `lock`, if it was fresh before. Data cached before a write by
+        another process is dropped instead.
+        """
+        if fresh:
+            self.cache.refresh(project_name, self.data_paths(project_name))
+        else:
+            self.cache.bump(project_name)
+
+    def get_rows(self, project_name: str, labeled_only: bool = False) -> pd.DataFrame:
+        df = self.read_data(project_name)
+        if labeled_only:
+            df = df[df['verified'] != '0']
+        return df
+
+    def iter_rows(self, project_name: str, labeled_only: bool = False,
+                  chunk_size: int = 10000) -> Iterator[pd.DataFrame]:
+        paths = self.data_paths(project_name)
+        df = self.cache.peek(project_name, paths)
+        if df is not None:
+            chunks = (df.iloc[i:i + chunk_size] for i in range(0, len(df), chunk_size))
+        else:  # stream the csv and apply the journals chunk by chunk
+            updates = journal.read_all(*paths[1:])
+            chunks = read_csv_chunks(paths[0], chunk_size)
+        for chunk in chunks:
+            if df is None:
+                hit = updates.index.intersection(chunk.index)
+                chunk.loc[hit, 'verified'] = updates.loc[hit, 'verified'].to_numpy()
+                chunk.loc[hit, 'mask'] = updates.loc[hit, 'mask'].to_numpy()
+            if labeled_only:
+                chunk = chunk[chunk['verified'] != '0']
+            yield chunk
@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import logging
+import threading
+from typing import Callable, Iterable, Tuple
+
+import pandas as pd
+
+from srcs import metrics
+
+JOURNAL = 'labels.journal'
+COMPACTING = 'labels.journal.compacting'
+
+logger = logging.getLogger(__name__)
+
+
+def append(path: str, entries: Iterable[Tuple[int, str, int]], fsync: bool = True) -> int:
+    """
+    Append label updates to a journal file and return the new journal size.
+
+    Args:
+        path (str): Path to the journal file.
+        entries (Iterable[Tuple[int, str, int]]): Updates of (row index,
+            verification datetime, label bitmask).
+        fsync (bool): Flush the journal to disk before returning if True.
+    """
+    lines = ''.join(json.dumps({'index': int(index), 'verified': verified, 'mask': int(mask)})
+                    + '\n' for index, verified, mask in entries)
+    with open(path, 'a', encoding='utf-8') as file:
+        size = file.tell()
+        file.write(lines)
+        file.flush()
+        if fsync:
+            os.fsync(file.fileno())
+        metrics.record_io(path, written=file.tell() - size)
+        return file.tell()
+
+
+def read(path: str) -> pd.DataFrame:
+    """
+    Read a journal file into a dataframe with "index", "verified" and "mask"
+    columns, keeping only the last update of each row. A torn line left by a
+    crash in the middle of an append is ignored. Journals written before labels
+    were bitmasks have a ":sep:" separated "label" column instead of "mask".
+
+    Args:
+        path (str): Path to the journal file.
+    """
+    entries = []
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            metrics.record_io(path, read=os.fstat(file.fileno()).st_size)
+            for line in file:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        pass
+    df = pd.DataFrame(entries) if len(entries) > 0 else \
+        pd.DataFrame(columns=['index', 'verified', 'mask'])
+    return df.drop_duplicates('index', keep='last')
+
+
+def read_all(*paths: str) -> pd.DataFrame:
+    """
+    Read journal files, oldest first, into a dataframe of the last "verified" and
+    "mask" update of each row, indexed by row index.
+    """
+    updates = pd.concat([read(path) for path in paths], ignore_index=True)
+    return updates.drop_duplicates('index', keep='last').set_index('index')
+
+
+def replay(df: pd.DataFrame, *paths: str) -> pd.DataFrame:
+    """
+    Apply the updates of journal files, oldest first, to the data in place.
+
+    Args:
+        df (pd.DataFrame): Data of a project.
+        paths (str): Paths to the journal files.
+    """
+    for path in paths:
+        updates = read(path)
+        updates = updates[updates['index'] < len(df)]
+        if len(updates) > 0:
+            index = updates['index'].to_numpy()
+            for column in updates.columns.drop('index').intersection(df.columns):
+                df.loc[index, column] = updates[column].to_numpy()
+    return df
+
+
+class Compactor(threading.Thread):
+    """
+    Background thread folding label journals into their base files once a
+    journal grows beyond a size or has not been compacted for a while.
+
+    Args:
+        compact (Callable[[str], None]): Function compacting the journal of a project.
+        max_bytes (int): Journal size triggering a compaction.
+        max_age (float): Seconds after the first pending update triggering a compaction.
+    """
+    def __init__(self, compact: Callable[[str], None], max_bytes: int, max_age: float):
+        super().__init__(name='journal-compactor', daemon=True)
+        self.compact = compact
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._pending = {}  # project -> (time of first update, journal size)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    def notify(self, project_name: str, journal_size: int):
+        """ Record that the journal of a project has grown to the given size. """
+        with self._lock:
+            since = self._pending.get(project_name, (time.monotonic(), 0))[0]
+            self._pending[project_name] = (since, journal_size)
+        if journal_size >= self.max_bytes:
+            self._wakeup.set()
+
+    def discard(self, project_name: str):
+        """ Forget a project, e.g. its journal has been removed. """
+        with self._lock:
+            self._pending.pop(project_name, None)
+
+    def run(self):
+        while True:
+            self._wakeup.wait(timeout=min(self.max_age, 5))
+            self._wakeup.clear()
+            now = time.monotonic()
+            with self._lock:
+                due = [name for name, (since, size) in self._pending.items()
+                       if size >= self.max_bytes or now - since >= self.max_age]
+                for name in due:
+                    del self._pending[name]
+            for name in due:
+                try:
+                    self.compact(name)
+                except FileNotFoundError:  # project deleted in the meantime
+                    pass
+                except Exception:  # keep the thread alive, retry on next update
+                    logger.exception('Failed to compact the journal of "%s"', name)
@@ -0,0 +1,52 @@
+"""
+One-shot migration of the csv project layout under PROJECT_DIR into the SQLite
+database used by the "sqlite" storage engine. Projects already in the database
+are skipped, so the script can be rerun safely. Run it from the repo root:
+
+    python -m srcs.storage.migrate --config ./config.yaml
+"""
+import os
+import argparse
+
+import pandas as pd
+
+from srcs import utils
+from srcs.storage import CSVStorage, SQLiteStorage, bitmask
+
+
+def migrate(project_dir: str, db_path: str):
+    """
+    Copy all projects and their data from csv files into a SQLite database.
+
+    Args:
+        project_dir (str): Directory containing projects.csv and project folders.
+        db_path (str): Path to the SQLite database file.
+    """
+    csv_storage = CSVStorage(project_dir, cache_bytes=0)  # nothing to cache
+    db = SQLiteStorage(db_path)
+    existing = set(db.list_projects())
+    for project_name in csv_storage.list_projects():
+        if project_name in existing:
+            print(f'Skip "{project_name}", already migrated.')
+            continue
+        info = csv_storage.get_project(project_name)
+        db.create_project(project_name, info['createDate'], info['description'])
+        db.update_project(project_name, info['description'], info['label'])
+        n_rows = 0
+        if os.path.exists(csv_storage.data_path(project_name)):
+            df = csv_storage.read_data(project_name)
+            # bits of the same label may differ between the csv and the database
+            names = bitmask.join_all(df['mask'], csv_storage.get_vocabulary(project_name))
+            masks = bitmask.encode_all(pd.Series(names), db.get_vocabulary(project_name))
+            db.insert_rows(project_name, zip(df['texts'], df['verified'], masks))
+            n_rows = len(df)
+        print(f'Migrated "{project_name}" with {n_rows} rows.')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--config', default='./config.yaml',
+                        help='Path to the configuration file.')
+    args = parser.parse_args()
+    config = utils.load_yaml(args.config)
+    migrate(config['PROJECT_DIR'], os.path.join(config['PROJECT_DIR'], 'projects.db'))
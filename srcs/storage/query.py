@@ -0,0 +1,216 @@
+"""
+In-memory indexes answering row queries of a project, e.g. the next unlabeled
+row or rows having or lacking some labels, without scanning all rows. Indexes
+are built from the data on the first query and kept up to date by the storage
+engines on every write afterwards.
+"""
+import threading
+from typing import Callable, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+BLOCK_ROWS = 4096  # rows summarized together, blocks which cannot match are skipped
+NO_TIME = np.iinfo('int64').min  # verification time of unlabeled rows
+ROW_BYTES = 17  # memory of a row in an index, labeled flag, bitmask and time
+
+
+def to_seconds(verified: Sequence[str]) -> np.ndarray:
+    """ Parse verification datetimes into epoch seconds, NO_TIME if unlabeled or invalid. """
+    verified = pd.Series(verified, dtype=object)
+    times = pd.to_datetime(verified.where(verified != '0'), errors='coerce')
+    return times.to_numpy(dtype='datetime64[s]').astype('int64')
+
+
+class QueryIndex:
+    """
+    Index of the labels of a project. Next to the labeled flag, label bitmask
+    and verification time of each row, it keeps a summary of each block of
+    BLOCK_ROWS rows: number of unlabeled rows, union and intersection of the
+    label bitmasks, earliest and latest verification time. A query only looks
+    at the rows of the blocks whose summary may match.
+
+    Args:
+        labeled (np.ndarray): Whether each row is labeled.
+        masks (np.ndarray): Label bitmask of each row.
+        times (np.ndarray): Verification time of each row in epoch seconds.
+    """
+    def __init__(self, labeled: np.ndarray, masks: np.ndarray, times: np.ndarray):
+        self.labeled = labeled.astype(bool)
+        self.masks = masks.astype('int64')
+        self.times = times.astype('int64')
+        n_blocks = (len(self) + BLOCK_ROWS - 1) // BLOCK_ROWS
+        self.unlabeled = np.zeros(n_blocks, dtype='int64')
+        self.union = np.zeros(n_blocks, dtype='int64')
+        self.intersection = np.zeros(n_blocks, dtype='int64')
+        self.earliest = np.zeros(n_blocks, dtype='int64')
+        self.latest = np.zeros(n_blocks, dtype='int64')
+        self.summarize(0, n_blocks)
+
+    @classmethod
+    def build(cls, chunks: Iterable[pd.DataFrame]) -> 'QueryIndex':
+        """ Build the index from chunks of data with "verified" and "mask" columns. """
+        verified, masks = [], []
+        for chunk in chunks:
+            verified.append(chunk['verified'].to_numpy(dtype=object))
+            masks.append(chunk['mask'].to_numpy(dtype='int64'))
+        verified = np.concatenate(verified) if len(verified) > 0 else np.array([], dtype=object)
+        masks = np.concatenate(masks) if len(masks) > 0 else np.array([], dtype='int64')
+        return cls(verified != '0', masks, to_seconds(verified))
+
+    def __len__(self) -> int:
+        return len(self.labeled)
+
+    def summarize(self, first: int, last: int):
+        """ Recompute the summaries of blocks from `first` to `last` (excluded). """
+        if first >= last:
+            return
+        start, stop = first * BLOCK_ROWS, min(last * BLOCK_ROWS, len(self))
+        starts = np.arange(0, stop - start, BLOCK_ROWS)
+        times = self.times[start:stop]
+        valid = times != NO_TIME
+        self.unlabeled[first:last] = np.add.reduceat(
+            ~self.labeled[start:stop], starts, dtype='int64')
+        self.union[first:last] = np.bitwise_or.reduceat(self.masks[start:stop], starts)
+        self.intersection[first:last] = np.bitwise_and.reduceat(self.masks[start:stop], starts)
+        self.earliest[first:last] = np.minimum.reduceat(
+            np.where(valid, times, np.iinfo('int64').max), starts)
+        self.latest[first:last] = np.maximum.reduceat(times, starts)
+
+    def append(self, n_rows: int):
+        """ Add unlabeled rows at the end. """
+        first = len(self) // BLOCK_ROWS
+        self.labeled = np.concatenate([self.labeled, np.zeros(n_rows, dtype=bool)])
+        self.masks = np.concatenate([self.masks, np.zeros(n_rows, dtype='int64')])
+        self.times = np.concatenate([self.times, np.full(n_rows, NO_TIME, dtype='int64')])
+        n_blocks = (len(self) + BLOCK_ROWS - 1) // BLOCK_ROWS
+        for name in ('unlabeled', 'union', 'intersection', 'earliest', 'latest'):
+            summary = getattr(self, name)
+            setattr(self, name, np.concatenate(
+                [summary, np.zeros(n_blocks - len(summary), dtype='int64')]))
+        self.summarize(first, n_blocks)
+
+    def update(self, rows: Sequence[int], verified: Sequence[str], masks: Sequence[int]):
+        """ Set verification datetimes and label bitmasks of rows. """
+        rows = np.asarray(rows, dtype='int64')
+        verified = np.asarray(verified, dtype=object)
+        self.labeled[rows] = verified != '0'
+        self.masks[rows] = np.asarray(masks, dtype='int64')
+        self.times[rows] = to_seconds(verified)
+        for block in np.unique(rows // BLOCK_ROWS):
+            self.summarize(block, block + 1)
+
+    def search(self, start: int = 0, limit: int = 100, unlabeled: Optional[bool] = None,
+               has: int = 0, lacks: int = 0, before: Optional[int] = None,
+               after: Optional[int] = None) -> Tuple[List[int], Optional[int]]:
+        """
+        Return indices of up to `limit` rows from `start` matching all given
+        conditions, and the index to start the next page from, None if there
+        are no more matching rows.
+
+        Args:
+            start (int): Index of the first row to look at.
+            limit (int): Max number of rows returned.
+            unlabeled (bool, optional): Only unlabeled rows if True, only labeled
+                rows if False.
+            has (int): Bitmask of labels a row must all have.
+            lacks (int): Bitmask of labels a row must not have.
+            before (int, optional): Only rows verified before this epoch second.
+            after (int, optional): Only rows verified after this epoch second.
+        """
+        candidates = np.ones(len(self.unlabeled), dtype=bool)
+        if unlabeled is not None:
+            sizes = np.minimum(BLOCK_ROWS, len(self) - np.arange(len(candidates)) * BLOCK_ROWS)
+            candidates &= (self.unlabeled > 0) if unlabeled else (self.unlabeled < sizes)
+        if has:
+            candidates &= (self.union & has) == has
+        if lacks:
+            candidates &= (self.intersection & lacks) == 0
+        if before is not None:
+            candidates &= self.earliest < before
+        if after is not None:
+            candidates &= self.latest > after
+
+        rows = []
+        start = max(start, 0)
+        for block in np.flatnonzero(candidates[start // BLOCK_ROWS:]) + start // BLOCK_ROWS:
+            lo, hi = max(block * BLOCK_ROWS, start), min((block + 1) * BLOCK_ROWS, len(self))
+            match = np.ones(hi - lo, dtype=bool)
+            if unlabeled is not None:
+                match &= self.labeled[lo:hi] != unlabeled
+            if has:
+                match &= (self.masks[lo:hi] & has) == has
+            if lacks:
+                match &= (self.masks[lo:hi] & lacks) == 0
+            if before is not None:
+                match &= (self.times[lo:hi] != NO_TIME) & (self.times[lo:hi] < before)
+            if after is not None:
+                match &= self.times[lo:hi] > after
+            rows.extend((np.flatnonzero(match) + lo).tolist())
+            if len(rows) > limit:  # one more to know if there is a next page
+                return rows[:limit], rows[limit]
+        return rows, None
+
+
+class QueryIndexes:
+    """
+    Query indexes of the projects of a storage engine. An index is built on the
+    first query of a project and kept with the write stamp of the project at
+    that time, a stamp which changes on every write to its rows. A query finding
+    another stamp, e.g. after a write by another process, builds the index
+    again. Writes of this process are applied to the index instead, if it was up
+    to date before the write.
+    """
+    def __init__(self):
+        self._indexes = {}  # project -> (write stamp, index)
+        self._lock = threading.Lock()
+
+    def search(self, project_name: str, stamp: Hashable, build: Callable[[], QueryIndex],
+               **kwargs) -> Tuple[List[int], Optional[int]]:
+        """
+        Run a query on the index of a project, see `QueryIndex.search`.
+
+        Args:
+            project_name (str): Project name.
+            stamp (Hashable): Current write stamp of the project.
+            build (Callable[[], QueryIndex]): Function building the index from
+                the data if the project has no up to date index.
+        """
+        with self._lock:
+            entry = self._indexes.get(project_name)
+            if entry is not None and entry[0] == stamp:
+                return entry[1].search(**kwargs)
+        index = build()  # a write in the meantime changes the stamp again
+        with self._lock:
+            self._indexes[project_name] = (stamp, index)
+            return index.search(**kwargs)
+
+    def _apply(self, project_name: str, before: Hashable, after: Hashable,
+               change: Callable[[QueryIndex], None]):
+        with self._lock:
+            entry = self._indexes.get(project_name)
+            if entry is None:
+                return
+            if entry[0] != before:  # missed other writes
+                del self._indexes[project_name]
+                return
+            change(entry[1])
+            self._indexes[project_name] = (after, entry[1])
+
+    def update(self, project_name: str, before: Hashable, after: Hashable,
+               rows: Sequence[int], verified: Sequence[str], masks: Sequence[int]):
+        """
+        Report label updates of rows, see `QueryIndex.update`, which changed the
+        write stamp of the project from `before` to `after`.
+        """
+        self._apply(project_name, before, after,
+                    lambda index: index.update(rows, verified, masks))
+
+    def append(self, project_name: str, before: Hashable, after: Hashable, n_rows: int):
+        """ Report unlabeled rows appended to a project, which changed its write stamp. """
+        self._apply(project_name, before, after, lambda index: index.append(n_rows))
+
+    def discard(self, project_name: str):
+        """ Drop the index of a project after its data is replaced, it is built again when needed. """
+        with self._lock:
+            self._indexes.pop(project_name, None)
@@ -0,0 +1,23 @@
+"""
+Recompute the statistics of projects from their data, e.g. after the data files
+were edited by hand. Run it from the repo root:
+
+    python -m srcs.storage.rebuild_stats --config ./config.yaml [PROJECT ...]
+"""
+import argparse
+
+from srcs import utils
+from srcs.storage import load_storage
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('projects', nargs='*',
+                        help='Projects to rebuild, all projects if not given.')
+    parser.add_argument('--config', default='./config.yaml',
+                        help='Path to the configuration file.')
+    args = parser.parse_args()
+    storage = load_storage(utils.load_yaml(args.config))
+    for project_name in args.projects or storage.list_projects():
+        stats = storage.rebuild_stats(project_name)
+        print(f'"{project_name}": {stats}')
@@ -0,0 +1,85 @@
+"""
+Byte-offset index of the records of a csv file, kept next to it as a packed
+uint64 file "<csv>.idx". The first two values are the modification time and size
+of the csv when it was indexed, followed by the offset where each record starts
+and the offset where the last record ends, so record i is the bytes between
+offsets i and i + 1. Newlines inside quoted fields do not end a record.
+"""
+import os
+from typing import Optional
+
+import numpy as np
+
+from srcs import utils
+
+HEADER = 2  # modification time and size of the indexed csv
+BLOCK_SIZE = 2 ** 23  # bytes scanned at a time
+
+
+def scan(path: str, start: int = 0) -> np.ndarray:
+    """
+    Return the offsets following each newline which ends a record, scanning the
+    csv from `start`, which must be the start of a record.
+
+    Args:
+        path (str): Path to the csv file.
+        start (int): Offset to start scanning from.
+    """
+    size = os.path.getsize(path)
+    ends = [np.empty(0, dtype='uint64')]
+    if size <= start:
+        return ends[0]
+    data = np.memmap(path, dtype=np.uint8, mode='r')
+    in_quotes = 0
+    for pos in range(start, size, BLOCK_SIZE):
+        block = np.asarray(data[pos:pos + BLOCK_SIZE])
+        quotes = np.flatnonzero(block == ord('"'))
+        newlines = np.flatnonzero(block == ord('\n'))
+        # a newline ends a record if it is preceded by an even number of quotes
+        outside = (np.searchsorted(quotes, newlines) + in_quotes) % 2 == 0
+        ends.append((newlines[outside] + pos + 1).astype('uint64'))
+        in_quotes = (in_quotes + len(quotes)) % 2
+    if data[-1] != ord('\n'):  # last record without a trailing newline
+        ends.append(np.array([size], dtype='uint64'))
+    return np.concatenate(ends)
+
+
+def save(path: str, offsets: np.ndarray):
+    """ Write the index of a csv, stamped with its current modification time and size. """
+    stat = os.stat(path)
+    header = np.array([stat.st_mtime_ns, stat.st_size], dtype='uint64')
+    with utils.atomic_path(path + '.idx') as tmp:
+        np.concatenate([header, offsets.astype('uint64')]).tofile(tmp)
+
+
+def build(path: str) -> np.ndarray:
+    """ Index a csv from scratch, return and save the offsets. """
+    offsets = scan(path)  # the first record is the header
+    save(path, offsets)
+    return offsets
+
+
+def extend(path: str, offsets: np.ndarray) -> np.ndarray:
+    """ Index records appended to a csv after `offsets` was built, return and save the offsets. """
+    offsets = np.concatenate([offsets, scan(path, int(offsets[-1]))])
+    save(path, offsets)
+    return offsets
+
+
+def load(path: str, stat: Optional[os.stat_result] = None) -> Optional[np.ndarray]:
+    """
+    Return the memory-mapped offsets of a csv, None if missing or out of date.
+
+    Args:
+        path (str): Path to the csv file.
+        stat (os.stat_result): Status of the csv to check the index against,
+            e.g. of a file already opened, the current status of `path` if None.
+    """
+    try:
+        stat = stat or os.stat(path)
+        index = np.memmap(path + '.idx', dtype='uint64', mode='r')
+    except (FileNotFoundError, ValueError):  # ValueError if the index is empty
+        return None
+    if len(index) < HEADER or index[0] != stat.st_mtime_ns or index[1] != stat.st_size:
+        return None
+    return index[HEADER:]
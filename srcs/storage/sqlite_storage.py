@@ -0,0 +1,402 @@
+import os
+import json
+import time
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Hashable, Iterable, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from srcs.locks import RWLock
+from srcs.storage import bitmask, query, stats
+from srcs.storage.base import Storage
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    create_date TEXT NOT NULL,
+    description TEXT NOT NULL,
+    label TEXT NOT NULL DEFAULT '',
+    has_data INTEGER NOT NULL DEFAULT 0,
+    vocabulary TEXT NOT NULL DEFAULT '',
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS data (
+    project_id INTEGER NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+    row INTEGER NOT NULL,
+    texts TEXT NOT NULL,
+    verified TEXT NOT NULL DEFAULT '0',
+    mask INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (project_id, row)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS data_labeled ON data(project_id) WHERE verified != '0';
+CREATE TABLE IF NOT EXISTS stats (
+    project_id INTEGER PRIMARY KEY REFERENCES projects(id) ON DELETE CASCADE,
+    total INTEGER NOT NULL,
+    labeled INTEGER NOT NULL,
+    bits TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+class SQLiteStorage(Storage):
+    """
+    Storage engine keeping projects and their rows in indexed tables of a SQLite
+    database running in WAL mode. Each thread uses its own connection. Labels of
+    each row are kept as a bitmask over the vocabulary of its project.
+
+    Writes run in IMMEDIATE transactions, which take the write lock of the
+    database before reading the rows and statistics they change, so threads and
+    processes sharing the database never lose each other's updates.
+
+    Args:
+        db_path (str): Path to the database file.
+    """
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._projects_lock = RWLock(f'{db_path}.lock')
+        self.queries = query.QueryIndexes()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self.projects_lock():  # other processes may be starting too
+            columns = [row[1] for row in self.conn.execute('PRAGMA table_info(data)')]
+            legacy = len(columns) > 0 and 'mask' not in columns
+            if legacy:  # created before labels were bitmasks
+                with self.conn:
+                    self.conn.execute("ALTER TABLE projects ADD COLUMN vocabulary TEXT NOT NULL DEFAULT ''")
+                    self.conn.execute('ALTER TABLE data ADD COLUMN mask INTEGER NOT NULL DEFAULT 0')
+                    self.conn.execute('DROP TABLE stats')
+            for table in ('stats', 'projects'):
+                columns = [row[1] for row in self.conn.execute(f'PRAGMA table_info({table})')]
+                if len(columns) > 0 and 'version' not in columns:  # created before versions were kept
+                    with self.conn:
+                        self.conn.execute(
+                            f'ALTER TABLE {table} ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+            self.conn.executescript(SCHEMA)
+            if legacy:
+                self.upgrade()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """ Connection of the current thread. """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """ Run statements in a transaction holding the write lock of the database from its start. """
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            yield self.conn
+
+    def projects_lock(self) -> RWLock:
+        """ Return the lock serializing label additions of all processes using the database. """
+        return self._projects_lock
+
+    def write_stamp(self, project_name: str) -> Hashable:
+        # statistics are saved along with every change of rows or labels
+        row = self.conn.execute(
+            'SELECT stats.version FROM stats JOIN projects ON stats.project_id = projects.id '
+            'WHERE projects.name = ?', (project_name, )).fetchone()
+        return None if row is None else row[0]
+
+    def last_modified(self, project_name: str) -> float:
+        # versions of the statistics never fall behind the time they are saved
+        return (self.write_stamp(project_name) or 0) / 1e9
+
+    def projects_stamp(self) -> Hashable:
+        # versions of project information are increased on every update
+        return self.conn.execute('SELECT group_concat(version) FROM projects').fetchone()[0]
+
+    def project_stamp(self, project_name: str) -> Hashable:
+        row = self.conn.execute(
+            'SELECT projects.version, stats.version FROM projects LEFT JOIN stats '
+            'ON stats.project_id = projects.id WHERE projects.name = ?', (project_name, )).fetchone()
+        return None if row is None else tuple(row)
+
+    def upgrade(self):
+        """ Convert the ":sep:" separated labels of rows added before labels were bitmasks. """
+        for project_id, label in self.conn.execute('SELECT id, label FROM projects').fetchall():
+            df = pd.read_sql_query("SELECT row, label FROM data WHERE project_id = ? AND label != ''",
+                                   self.conn, params=(project_id, ))
+            labels = label.split(':sep:') if label else []
+            found = df['label'].str.split(bitmask.SEP).explode().unique()
+            labels += [name for name in found if name and name not in labels]
+            try:
+                vocabulary, _ = bitmask.update_vocabulary([], labels)
+            except ValueError:
+                logger.exception('Failed to convert the labels of project %s', project_id)
+                continue
+            masks = bitmask.encode_all(df['label'], vocabulary)
+            with self.transaction():
+                self.conn.execute('UPDATE projects SET label = ?, vocabulary = ? WHERE id = ?',
+                                  (':sep:'.join(labels), bitmask.format_vocabulary(vocabulary),
+                                   project_id))
+                self.conn.executemany(
+                    "UPDATE data SET mask = ?, label = '' WHERE project_id = ? AND row = ?",
+                    ((int(mask), project_id, int(row)) for mask, row in zip(masks, df['row'])))
+
+    def _project_id(self, project_name: str) -> int:
+        row = self.conn.execute('SELECT id FROM projects WHERE name = ?',
+                                (project_name, )).fetchone()
+        if row is None:
+            raise KeyError(project_name)
+        return row[0]
+
+    def list_projects(self) -> List[str]:
+        rows = self.conn.execute('SELECT name FROM projects ORDER BY id').fetchall()
+        return [row[0] for row in rows]
+
+    def create_project(self, project_name: str, create_date: str, description: str):
+        with self.transaction():
+            self.conn.execute(
+                'INSERT OR IGNORE INTO projects (name, create_date, description, version) '
+                'VALUES (?, ?, ?, ?)', (project_name, create_date, description, time.time_ns()))
+
+    def delete_project(self, project_name: str):
+        with self.transaction():
+            self.conn.execute('DELETE FROM projects WHERE name = ?', (project_name, ))
+        self.queries.discard(project_name)
+
+    def get_project(self, project_name: str) -> dict:
+        row = self.conn.execute(
+            'SELECT create_date, description, label FROM projects WHERE name = ?',
+            (project_name, )).fetchone()
+        if row is None:
+            raise KeyError(project_name)
+        return {
+            'createDate': row[0],
+            'description': row[1],
+            'label': row[2].split(':sep:') if row[2] else [],
+        }
+
+    def update_project(self, project_name: str, description: str, labels: List[str],
+                       renames: Optional[Dict[str, str]] = None):
+        project_id = self._project_id(project_name)
+        with self.projects_lock(), self.transaction():
+            vocabulary, reused = bitmask.update_vocabulary(
+                self.get_vocabulary(project_name), labels, renames)
+            if reused:  # bits of deleted labels given to new labels
+                self.conn.execute('UPDATE data SET mask = mask & ? WHERE project_id = ?',
+                                  (~reused, project_id))
+                self._save_stats(project_id, stats.clear(self._load_stats(project_id), reused))
+            self.conn.execute(
+                'UPDATE projects SET description = ?, label = ?, vocabulary = ?, '
+                'version = version + 1 WHERE id = ?',
+                (description, ':sep:'.join(labels), bitmask.format_vocabulary(vocabulary),
+                 project_id))
+        if reused:
+            self.queries.discard(project_name)
+
+    def get_vocabulary(self, project_name: str) -> List[str]:
+        row = self.conn.execute('SELECT vocabulary FROM projects WHERE name = ?',
+                                (project_name, )).fetchone()
+        if row is None:
+            raise KeyError(project_name)
+        return bitmask.parse_vocabulary(row[0])
+
+    def add_texts(self, project_name: str, texts: List[str]):
+        self.insert_rows(project_name, ((text, '0', 0) for text in texts),
+                         replace=True)
+
+    def append_texts(self, project_name: str, texts: List[str]) -> int:
+        self.insert_rows(project_name, ((text, '0', 0) for text in texts))
+        return self.count(project_name)
+
+    def truncate(self, project_name: str, total: int):
+        project_id = self._project_id(project_name)
+        with self.transaction():
+            self.conn.execute('DELETE FROM data WHERE project_id = ? AND row >= ?',
+                              (project_id, total))
+            self._save_stats(project_id, self._compute_stats(project_id))
+        self.queries.discard(project_name)
+
+    def insert_rows(self, project_name: str, rows: Iterable[Tuple[str, str, int]],
+                    replace: bool = False):
+        """
+        Append rows of (text, verified, label bitmask) to a project.
+
+        Args:
+            project_name (str): Project name.
+            rows (Iterable[Tuple[str, str, int]]): Rows to be inserted.
+            replace (bool): Delete existing rows of the project first if True.
+        """
+        project_id = self._project_id(project_name)
+        rows = [(str(text), str(verified), int(mask)) for text, verified, mask in rows]
+        new_stats = stats.compute(pd.Series([row[1] for row in rows], dtype=str),
+                                  pd.Series([row[2] for row in rows], dtype='int64'))
+        with self.transaction():
+            before = self.write_stamp(project_name)
+            if replace:
+                self.conn.execute('DELETE FROM data WHERE project_id = ?', (project_id, ))
+                project_stats = stats.empty()
+            else:
+                project_stats = self._load_stats(project_id)
+            start = self.conn.execute(
+                'SELECT coalesce(max(row) + 1, 0) FROM data WHERE project_id = ?',
+                (project_id, )).fetchone()[0]
+            self.conn.executemany(
+                'INSERT INTO data (project_id, row, texts, verified, mask) '
+                'VALUES (?, ?, ?, ?, ?)',
+                ((project_id, start + i, text, verified, mask)
+                 for i, (text, verified, mask) in enumerate(rows)))
+            self.conn.execute('UPDATE projects SET has_data = 1 WHERE id = ?',
+                              (project_id, ))
+            after = self._save_stats(project_id, stats.merge(project_stats, new_stats))
+        if replace:
+            self.queries.discard(project_name)
+        else:
+            self.queries.append(project_name, before, after, len(rows))
+
+    def _load_stats(self, project_id: int) -> dict:
+        row = self.conn.execute('SELECT total, labeled, bits FROM stats WHERE project_id = ?',
+                                (project_id, )).fetchone()
+        if row is None:  # created before stats were kept
+            return self._compute_stats(project_id)
+        return {'total': row[0], 'labeled': row[1], 'bits': json.loads(row[2])}
+
+    def _save_stats(self, project_id: int, project_stats: dict) -> int:
+        """
+        Save statistics of a project and return its new write stamp, a version
+        counter starting from the current time in nanoseconds, like `stats.save`.
+        Called within a transaction, an update falling back to an insert rather
+        than an upsert, which requires SQLite 3.24.
+        """
+        values = (project_stats['total'], project_stats['labeled'],
+                  json.dumps(project_stats['bits']), time.time_ns(), project_id)
+        cursor = self.conn.execute(
+            'UPDATE stats SET total = ?, labeled = ?, bits = ?, version = max(version + 1, ?) '
+            'WHERE project_id = ?', values)
+        if cursor.rowcount == 0:  # first statistics of the project
+            self.conn.execute(
+                'INSERT INTO stats (total, labeled, bits, version, project_id) VALUES (?, ?, ?, ?, ?)',
+                values)
+        return self.conn.execute('SELECT version FROM stats WHERE project_id = ?',
+                                 (project_id, )).fetchone()[0]
+
+    def _compute_stats(self, project_id: int) -> dict:
+        df = pd.read_sql_query('SELECT verified, mask FROM data WHERE project_id = ?',
+                               self.conn, params=(project_id, ))
+        return stats.compute(df['verified'], df['mask'])
+
+    def count(self, project_name: str) -> Optional[int]:
+        project_id, has_data = self.conn.execute(
+            'SELECT id, has_data FROM projects WHERE name = ?',
+            (project_name, )).fetchone() or (None, 0)
+        if not has_data:  # if no data been added
+            return None
+        return self._load_stats(project_id)['total']
+
+    def get_stats(self, project_name: str) -> Optional[dict]:
+        project_id, has_data = self.conn.execute(
+            'SELECT id, has_data FROM projects WHERE name = ?',
+            (project_name, )).fetchone() or (None, 0)
+        if not has_data:  # if no data been added
+            return None
+        return stats.named(self._load_stats(project_id), self.get_vocabulary(project_name))
+
+    def rebuild_stats(self, project_name: str) -> Optional[dict]:
+        project_id = self._project_id(project_name)
+        with self.transaction():
+            project_stats = self._compute_stats(project_id)
+            self._save_stats(project_id, project_stats)
+        return stats.named(project_stats, self.get_vocabulary(project_name))
+
+    def get_row(self, project_name: str, index: int) -> Tuple[str, str, List[str]]:
+        row = self.conn.execute(
+            'SELECT texts, verified, mask FROM data WHERE project_id = ? AND row = ?',
+            (self._project_id(project_name), index)).fetchone()
+        if row is None:
+            raise IndexError(index)
+        return row[0], row[1], bitmask.decode(row[2], self.get_vocabulary(project_name))
+
+    def get_range(self, project_name: str, offset: int,
+                  limit: int) -> List[Tuple[str, str, List[str]]]:
+        rows = self.conn.execute(
+            'SELECT texts, verified, mask FROM data '
+            'WHERE project_id = ? AND row >= ? AND row < ? ORDER BY row',
+            (self._project_id(project_name), offset, offset + limit)).fetchall()
+        vocabulary = self.get_vocabulary(project_name)
+        return [(text, verified, bitmask.decode(mask, vocabulary))
+                for text, verified, mask in rows]
+
+    def update_label(self, project_name: str, index: int, labels: List[str],
+                     verified: str):
+        project_id = self._project_id(project_name)
+        mask = self.encode_labels(project_name, [labels])[0]
+        with self.transaction():
+            before = self.write_stamp(project_name)
+            old = self.conn.execute(
+                'SELECT verified, mask FROM data WHERE project_id = ? AND row = ?',
+                (project_id, index)).fetchone()
+            if old is None:
+                raise IndexError(index)
+            project_stats = stats.update(self._load_stats(project_id), old[0], old[1],
+                                         verified, mask)
+            self.conn.execute(
+                'UPDATE data SET verified = ?, mask = ? WHERE project_id = ? AND row = ?',
+                (verified, mask, project_id, index))
+            after = self._save_stats(project_id, project_stats)
+        self.queries.update(project_name, before, after, [index], [verified], [mask])
+
+    def update_labels(self, project_name: str,
+                      updates: List[Tuple[int, List[str], str]]):
+        updates = {int(index): (labels, str(verified))
+                   for index, labels, verified in updates}  # last update wins
+        masks = self.encode_labels(project_name, [value[0] for value in updates.values()])
+        updates = {index: (mask, value[1]) for (index, value), mask in zip(updates.items(), masks)}
+        project_id = self._project_id(project_name)
+        with self.transaction():
+            before = self.write_stamp(project_name)
+            old = []
+            indices = list(updates)
+            for i in range(0, len(indices), 500):  # stay below the sql variable limit
+                chunk = indices[i:i + 500]
+                old += self.conn.execute(
+                    f'SELECT verified, mask FROM data WHERE project_id = ? AND '
+                    f'row IN ({", ".join("?" * len(chunk))})',
+                    [project_id] + chunk).fetchall()
+            if len(old) != len(updates):
+                raise IndexError(indices)
+            project_stats = self._load_stats(project_id)  # before the rows change
+            self.conn.executemany(
+                'UPDATE data SET verified = ?, mask = ? WHERE project_id = ? AND row = ?',
+                ((verified, mask, project_id, index)
+                 for index, (mask, verified) in updates.items()))
+            stats.merge(project_stats, stats.compute(pd.Series([row[0] for row in old], dtype=str),
+                                                     pd.Series([row[1] for row in old], dtype='int64')),
+                        sign=-1)
+            stats.merge(project_stats, stats.compute(
+                pd.Series([value[1] for value in updates.values()], dtype=str),
+                pd.Series([value[0] for value in updates.values()], dtype='int64')))
+            after = self._save_stats(project_id, project_stats)
+        self.queries.update(project_name, before, after, list(updates),
+                            [value[1] for value in updates.values()],
+                            [value[0] for value in updates.values()])
+
+    def get_rows(self, project_name: str, labeled_only: bool = False) -> pd.DataFrame:
+        query = 'SELECT texts, verified, mask FROM data WHERE project_id = ?'
+        if labeled_only:
+            query += " AND verified != '0'"
+        return pd.read_sql_query(query + ' ORDER BY row', self.conn,
+                                 params=(self._project_id(project_name), ))
+
+    def iter_rows(self, project_name: str, labeled_only: bool = False,
+                  chunk_size: int = 10000) -> Iterator[pd.DataFrame]:
+        query = 'SELECT texts, verified, mask FROM data WHERE project_id = ?'
+        if labeled_only:
+            query += " AND verified != '0'"
+        yield from pd.read_sql_query(query + ' ORDER BY row', self.conn, chunksize=chunk_size,
+                                     params=(self._project_id(project_name), ))
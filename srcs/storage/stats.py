@@ -0,0 +1,127 @@
+"""
+Statistics of a project, i.e. number of rows, number of labeled rows and number
+of rows per label bit, kept up to date on every import and label update so they do
+not have to be computed from the data. They also keep the version of the data,
+a counter increased on every save.
+"""
+import os
+import json
+import time
+from typing import List
+
+import pandas as pd
+
+from srcs import metrics, utils
+from srcs.storage import bitmask
+
+STATS = 'stats.json'
+
+
+def empty(total: int = 0) -> dict:
+    """ Return statistics of a project with `total` unlabeled rows. """
+    return {'total': total, 'labeled': 0, 'bits': []}
+
+
+def compute(verified: pd.Series, masks: pd.Series) -> dict:
+    """
+    Compute statistics from the verification datetimes and label bitmasks of
+    all rows.
+
+    Args:
+        verified (pd.Series): Verification datetime of each row, '0' if unlabeled.
+        masks (pd.Series): Label bitmask of each row.
+    """
+    return {
+        'total': len(verified),
+        'labeled': int((verified != '0').sum()),
+        'bits': bitmask.bit_counts(masks),
+    }
+
+
+def merge(stats: dict, other: dict, sign: int = 1) -> dict:
+    """
+    Add statistics of some rows to the statistics of a project in place, or
+    subtract them if `sign` is -1.
+    """
+    stats['total'] += sign * other['total']
+    stats['labeled'] += sign * other['labeled']
+    counts = stats['bits']
+    counts += [0] * (len(other['bits']) - len(counts))
+    for bit, count in enumerate(other['bits']):
+        counts[bit] += sign * count
+    return stats
+
+
+def update(stats: dict, old_verified: str, old_mask: int, verified: str, mask: int) -> dict:
+    """
+    Update statistics in place for a row whose labels have changed.
+
+    Args:
+        stats (dict): Statistics of the project.
+        old_verified (str): Previous verification datetime of the row.
+        old_mask (int): Previous label bitmask of the row.
+        verified (str): New verification datetime of the row.
+        mask (int): New label bitmask of the row.
+    """
+    stats['labeled'] += (verified != '0') - (old_verified != '0')
+    counts = stats['bits']
+    counts += [0] * (max(int(old_mask).bit_length(), int(mask).bit_length()) - len(counts))
+    for bit in range(len(counts)):
+        counts[bit] += (mask >> bit & 1) - (old_mask >> bit & 1)
+    return stats
+
+
+def clear(stats: dict, mask: int) -> dict:
+    """ Reset the counts of the bits of `mask` in place, e.g. after clearing them from the data. """
+    for bit in range(len(stats['bits'])):
+        if mask >> bit & 1:
+            stats['bits'][bit] = 0
+    return stats
+
+
+def named(stats: dict, vocabulary: List[str]) -> dict:
+    """
+    Return statistics with the number of rows per label name instead of per bit.
+
+    Returns:
+        {
+            'total': Number of rows, int,
+            'labeled': Number of verified rows, int,
+            'labels': Number of rows per label, Dict[str, int],
+        }
+    """
+    counts = {name: count for name, count in zip(vocabulary, stats['bits']) if name and count > 0}
+    return {'total': stats['total'], 'labeled': stats['labeled'], 'labels': counts}
+
+
+def load(path: str) -> dict:
+    """
+    Load statistics from a json file, raise FileNotFoundError if missing and
+    ValueError if kept by an older version.
+    """
+    with open(path, 'r') as file:
+        project_stats = json.load(file)
+        metrics.record_io(path, read=file.tell())
+    if 'bits' not in project_stats:
+        raise ValueError(f'Outdated statistics "{path}".')
+    return project_stats
+
+
+def version(path: str) -> int:
+    """ Return the version of the statistics in a json file, raise FileNotFoundError if missing. """
+    with open(path, 'r') as file:
+        project_stats = json.load(file)
+        metrics.record_io(path, read=file.tell())
+    return project_stats.get('version', 0)
+
+
+def save(path: str, stats: dict):
+    """
+    Write statistics to a json file through a temporary file, increasing their
+    version. Versions never fall behind the current time in nanoseconds, so a
+    project deleted and created again does not reuse the versions of the old one.
+    """
+    stats['version'] = max(stats.get('version', 0) + 1, time.time_ns())
+    with utils.atomic_path(path) as tmp, open(tmp, 'w') as file:
+        json.dump(stats, file)
+        metrics.record_io(path, written=file.tell())
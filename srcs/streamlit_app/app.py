@@ -1,3 +1,4 @@
+import time
 import streamlit as st
 
 from srcs.streamlit_app import app_utils, templates, widgets
@@ -39,13 +40,18 @@ def main():
                     on_change=lambda: st.session_state.update({'switching_project': True})
                 )  # set index to persist with the selected project during pagination
             st.session_state.current_project = current_project
+            # search texts of the selected project
+            widgets.search_data()
 
     left_column, _, right_column = st.columns([50, 2, 20])
     # display and update project info at the right column
     if st.session_state.current_project is not None:
-        # get project info for the first time or when switching projects
+        # get project info for the first time, when switching projects or to pick up
+        # changes of other users, a cheap revalidation (ETag) if nothing changed, unless
+        # label updates of this session are still queued, which it would miss
         if st.session_state.project_info is None or \
-                st.session_state.project_info['project'] != st.session_state.current_project:
+                st.session_state.project_info['project'] != st.session_state.current_project or \
+                app_utils.label_writer().pending(st.session_state.current_project) == 0:
             app_utils.get_project_info()
 
         with right_column:
@@ -64,10 +70,11 @@ def main():
             widgets.add_label()
             # expander to delete label
             widgets.delete_label()
+            # expander to rename label
+            widgets.rename_label()
 
             # import data
-            file, add_data, text_column = widgets.import_data()
-            app_utils.add_texts(file, add_data, text_column)
+            widgets.import_data()
             # export data
             download_placeholder = widgets.export_data()
 
@@ -81,12 +88,16 @@ def main():
             if data['total'] > 0:
                 st.write(templates.page_number_html(st.session_state.current_project, current_page, data['total']),
                          unsafe_allow_html=True)
+                # jump to the next unlabeled data
+                widgets.next_unlabeled()
                 st.write(templates.text_data_html(data['text']), unsafe_allow_html=True)
                 # display checkboxes for labeling
                 if len(st.session_state.project_info['label']) > 0:
                     widgets.label_data()
                 else:
                     st.write(templates.no_label_html(), unsafe_allow_html=True)
+                # warn about label updates failing to be saved
+                widgets.label_queue_status()
                 # display the verification datetime
                 if st.session_state.data['verified'] != '0':
                     st.write(templates.verified_datetime_html(st.session_state.data['verified']),
@@ -113,9 +124,16 @@ def main():
         # display a download button upon clicking the export button
         if st.session_state.download is not None:
             download_placeholder.write(
-                templates.save_csv_html(*st.session_state.download),
+                templates.save_file_html(*st.session_state.download),
                 unsafe_allow_html=True,
             )
+    # display the round-trip times of this run and the previous ones
+    with st.sidebar:
+        widgets.timings()
+    # rerun until the jobs of the session are finished, updating their progress bars
+    if app_utils.poll_jobs():
+        time.sleep(app_utils.JOB_POLL_INTERVAL)
+        app_utils.rerun()
 
 
 def set_session_state():
@@ -137,8 +155,18 @@ def set_session_state():
         st.session_state.project_info = None
     if 'data' not in st.session_state:
         st.session_state.data = None
+    if 'data_window' not in st.session_state:
+        st.session_state.data_window = None
+    if 'data_window_future' not in st.session_state:
+        st.session_state.data_window_future = None
+    if 'label_writer' not in st.session_state:
+        st.session_state.label_writer = None
+    if 'timings' not in st.session_state:
+        st.session_state.timings = {}
     if 'download' not in st.session_state:
         st.session_state.download = None
+    if 'jobs' not in st.session_state:
+        st.session_state.jobs = {}
     if 'current_project' not in st.session_state:
         st.session_state.current_project = None
     if 'current_page' not in st.session_state:
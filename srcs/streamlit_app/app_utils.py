@@ -1,171 +1,324 @@
-import os
-import json
-import base64
+import time
+import functools
 import requests
-import pandas as pd
 import streamlit as st
-from typing import List
+from collections import deque
+from typing import Callable, Dict, List, Optional
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
-from srcs import utils
+from srcs.client import APIClient, LabelWriter
 
+READ_AHEAD = 20  # number of data kept in session state before and after the current page
+EXECUTOR = ThreadPoolExecutor(max_workers=2)  # refills read-ahead windows in background
+CLIENT = None  # api client shared by all sessions, created by `load_config`
+TIMINGS_KEPT = 100  # number of recent round-trip times of each call kept in session state
+JOB_POLL_INTERVAL = 1  # seconds between two reruns polling the unfinished jobs of a session
+JOB_FINISHED = ('done', 'failed', 'cancelled')
 
-def add_texts(df: pd.DataFrame, add_data: bool, text_column: str,
-              url: str = None):
+
+def timed(function: Callable) -> Callable:
+    """
+    Decorator recording the round-trip time of a call in session state, shown by
+    `widgets.timings`. Only for calls made by the script, not in background.
     """
-    Send a put request to add text data to a project.
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timings = st.session_state.timings
+            if function.__name__ not in timings:
+                timings[function.__name__] = deque(maxlen=TIMINGS_KEPT)
+            timings[function.__name__].append(time.perf_counter() - start)
+    return wrapper
+
+
+@timed
+def start_import(file, text_column: str):
+    """
+    Start a job importing the texts of an uploaded csv file into the current
+    project, its progress is shown by `widgets.job_progress`.
 
     Args:
-        df (pd.DataFrame): Loaded csv.
-        add_data (bool): New data will be added if True (clicked "Import" button).
+        file (UploadedFile): Uploaded csv file.
         text_column (str): Name of the column containing text data.
-        url (str, optional): API address.
     """
-    headers = {
-        'content-type': 'application/json',
-        'Accept-Charset': 'UTF-8',
-    }
-    if url is None:
-        url = os.environ['API_ADDRESS'] + os.environ['ADD_DATA']
+    project_name = st.session_state.current_project
+    st.session_state.jobs['import', project_name] = CLIENT.start_import(
+        project_name, file.getvalue(), 'text/csv', text_column)
 
-    url = f'{url}/{st.session_state.current_project}'
-    if add_data and df is not None and text_column is not None:
-        new_data = {'texts': df[text_column].to_list()}
-        r = requests.put(url, data=json.dumps(new_data), headers=headers)
-        # update progress in session state if it is None
-        if st.session_state.project_info['progress'] is None:
-            st.session_state.project_info['progress'] = '0'
 
+@timed
+def start_export(all_or_labeled: str, file_format: str):
+    """
+    Start a job exporting all data or just labeled data of the current project,
+    a download button is shown once it is done.
+
+    Args:
+        all_or_labeled (str): Set "labeled" to export labeled data or "all"
+                              to export all data.
+        file_format (str): "csv" or "jsonl".
+    """
+    project_name = st.session_state.current_project
+    st.session_state.download = None
+    st.session_state.jobs['export', project_name] = CLIENT.start_export(
+        project_name, all_or_labeled, file_format)
 
-def create_project(project_name: str, url: str = None):
+
+def job(kind: str) -> Optional[dict]:
+    """ Return the state of the last job of a kind, "import" or "export", started on the current project. """
+    return st.session_state.jobs.get((kind, st.session_state.current_project))
+
+
+@timed
+def cancel_job(kind: str):
+    """ Cancel the last job of a kind started on the current project. """
+    state = job(kind)
+    if state is not None and state['status'] not in JOB_FINISHED:
+        st.session_state.jobs[kind, state['project']] = CLIENT.cancel_job(state['id'])
+
+
+@timed
+def poll_jobs() -> bool:
+    """
+    Refresh the state of the unfinished jobs of the session and apply the outcome
+    of the finished ones. Return True if any job is still unfinished.
+    """
+    running = False
+    for key, state in list(st.session_state.jobs.items()):
+        if state['status'] in JOB_FINISHED:
+            continue
+        try:
+            state = st.session_state.jobs[key] = CLIENT.get_job(state['id'])
+        except requests.RequestException:
+            running = True  # polled again on the next run
+            continue
+        if 'status' not in state:  # forgotten, e.g. expired
+            del st.session_state.jobs[key]
+        elif state['status'] not in JOB_FINISHED:
+            running = True
+        elif state['status'] == 'done' and state['kind'] == 'import' and \
+                state['project'] == st.session_state.current_project:
+            # drop the read-ahead window of the old data
+            st.session_state.data_window = None
+            st.session_state.data_window_future = None
+        elif state['status'] == 'done' and state['kind'] == 'export':
+            st.session_state.download = (state['result']['file'], CLIENT.job_result_url(state))
+    return running
+
+
+@timed
+def create_project(project_name: str):
     """
     Send a put request to create a new project.
 
     Args:
         project_name (str): Project name.
-        url (str, optional): API address.
     """
-    if url is None:
-        url = os.environ['API_ADDRESS'] + os.environ['CREATE_PROJECT']
+    CLIENT.create_project(project_name)
 
-    url = f'{url}/{project_name}'
-    r = requests.put(url)
 
-
-def delete_project(project_name: str, url: str = None):
+@timed
+def delete_project(project_name: str):
     """
-    Send a delete request to delete an existing project.
+    Start a job deleting an existing project, it is left out of the project
+    list until the job is finished.
 
     Args:
         project_name (str): Project name.
-        url (str, optional): API address.
     """
-    if url is None:
-        url = os.environ['API_ADDRESS'] + os.environ['DELETE_PROJECT']
-
-    url = f'{url}/{project_name}'
-    r = requests.delete(url)
+    label_writer().discard(project_name)
+    st.session_state.jobs['delete', project_name] = CLIENT.start_delete(project_name)
 
 
-def download_csv(project_name: str, all_or_labeled: str, url: str = None):
+def fetch_data_range(project_name: str, offset: int, limit: int) -> dict:
     """
-    Send a get request to download csv of all data or just labeled data.
+    Send a get request to get a window of consecutive data of a project. This does
+    not touch the session state, so it can run in a background thread.
 
     Args:
         project_name (str): Project name.
-        all_or_labeled (str): Set "labeled" to download labeled data or "all"
-                              to download all data.
-        url (str, optional): API address.
+        offset (int): Index of the first data.
+        limit (int): Max number of data.
     """
-    if url is None:
-        url = os.environ['API_ADDRESS'] + os.environ['DOWNLOAD_DATA']
+    window = CLIENT.get_data_range(project_name, offset, limit)
+    window['project'] = project_name
+    return window
 
-    url = f'{url}/{project_name}/{all_or_labeled}'
-    r = requests.get(url)
-    df = pd.DataFrame(r.json())
-    csv = df.to_csv(index=False)  # if no filename is given, a string is returned
-    csv = base64.b64encode(csv.encode()).decode()  # convert the csv into base64
-    return csv
 
+def fetch_window(project_name: str, page: int) -> dict:
+    """ Fetch the read-ahead window of data around a page index. """
+    offset = max(0, page - READ_AHEAD)
+    return fetch_data_range(project_name, offset, 2 * READ_AHEAD + 1)
 
-def get_data(url: str = None):
-    """
-    Send a get request to get data of the current page index and project.
 
-    Args:
-        url (str, optional): API address.
+def in_window(window: dict, project_name: str, page: int) -> bool:
+    """ Check if the data of a page index is in a read-ahead window. """
+    if window is None or window['project'] != project_name:
+        return False
+    if window['total'] == 0:
+        return True
+    page = min(window['total'] - 1, page)
+    return window['offset'] <= page < window['offset'] + len(window['text'])
+
+
+@timed
+def get_data():
     """
-    if url is None:
-        url = os.environ['API_ADDRESS'] + os.environ['GET_DATA']
+    Get data of the current page index and project from the read-ahead window in
+    session state. The window is fetched if the page is outside of it and refilled
+    in background when the page gets close to its edges.
+    """
+    project_name = st.session_state.current_project
+    page = st.session_state.current_page
+    window = st.session_state.data_window
+    # take over the window refilled in background
+    future = st.session_state.data_window_future
+    if future is not None and future.done():
+        st.session_state.data_window_future = None
+        try:
+            refilled = future.result()
+            if in_window(refilled, project_name, page):
+                window = apply_queued(refilled)
+        except requests.RequestException:
+            pass
+
+    if not in_window(window, project_name, page):
+        window = apply_queued(fetch_window(project_name, page))
+    elif st.session_state.data_window_future is None and window['total'] > 0:
+        start = window['offset']
+        end = window['offset'] + len(window['text'])
+        # refill if the page is close to an edge which is not the dataset boundary
+        if (page - start < READ_AHEAD // 2 and start > 0) or \
+                (end - page <= READ_AHEAD // 2 and end < window['total']):
+            st.session_state.data_window_future = EXECUTOR.submit(
+                fetch_window, project_name, page)
+    st.session_state.data_window = window
+
+    if window['total'] == 0:
+        return {'total': 0, 'text': None, 'verified': None, 'label': None}
+    i = min(window['total'] - 1, page) - window['offset']
+    return {
+        'total': window['total'],
+        'text': window['text'][i],
+        'verified': window['verified'][i],
+        'label': list(window['label'][i]),
+    }
 
-    url = f'{url}/{st.session_state.current_project}/{st.session_state.current_page}'
-    r = requests.get(url)
-    return r.json()
 
+def apply_queued(window: dict) -> dict:
+    """ Apply the label updates of the session not stored by the api yet to a fetched window. """
+    if window['total'] == 0:
+        return window
+    for index, update in label_writer().queued(window['project']).items():
+        i = index - window['offset']
+        if 0 <= i < len(window['text']):
+            window['label'][i] = update['labels']
+            window['verified'][i] = update['verified']
+    return window
 
-def get_project_info(url: str = None):
+
+@timed
+def query_data(project_name: str, start: int = 0, limit: int = 100, **conditions) -> dict:
     """
-    Send a get request to fetch information of current project.
+    Send a get request to find indices of data matching some conditions.
 
     Args:
-        url (str, optional): API address.
-    """
-    if url is None:
-        url = os.environ['API_ADDRESS'] + os.environ['GET_PROJECT_INFO']
+        project_name (str): Project name.
+        start (int): Index to start searching from.
+        limit (int): Max number of indices.
+        conditions: Conditions of `api.query_data`, e.g. unlabeled='true' or
+                    has=List[str].
 
-    url = f'{url}/{st.session_state.current_project}'
-    r = requests.get(url)
-    st.session_state.project_info = r.json()
+    Returns:
+        Matching indices and the start of the next page, see `api.query_data`.
+    """
+    return CLIENT.query(project_name, start, limit, **conditions)
 
 
-@st.cache(show_spinner=False)
-def load_config(config: str):
+@timed
+def next_unlabeled() -> bool:
     """
-    Load project configurations from a .yaml file.
+    Move the current page to the next unlabeled data, starting over from the
+    first data after the last one. Return False if all data are labeled.
+    """
+    project_name = st.session_state.current_project
+    flush_labels(project_name)  # the api has to know the queued labels
+    start = st.session_state.current_page + 1
+    rows = query_data(project_name, start, 1, unlabeled='true')['rows']
+    if len(rows) == 0 and start > 0:
+        rows = query_data(project_name, 0, 1, unlabeled='true')['rows']
+    if len(rows) == 0:
+        return False
+    st.session_state.current_page = rows[0]
+    return True
+
+
+@timed
+def search_data(project_name: str, query: str, start: int = 0, limit: int = 20) -> dict:
+    """
+    Send a get request to find data containing the words of a query.
 
     Args:
-        config (str): Path to the configuration file.
+        project_name (str): Project name.
+        query (str): Words to search for.
+        start (int): Number of best matching data to skip.
+        limit (int): Max number of data.
+
+    Returns:
+        Indices and snippets of the best matching data, see `api.search_data`.
+    """
+    return CLIENT.search(project_name, query, start, limit)
+
+
+@timed
+def get_project_info():
+    """
+    Send a get request to fetch information of current project, once the queued
+    label updates are stored so its progress is up to date.
     """
-    config = utils.load_yaml(config)
-    os.environ['PROJECT_DIR'] = config['PROJECT_DIR']
-    os.environ['API_ADDRESS'] = config['API_ADDRESS']
-    for name, value in config['API_ENDPOINTS'].items():
-        os.environ[name] = value
+    flush_labels()
+    st.session_state.project_info = CLIENT.get_project_info(st.session_state.current_project)
 
 
 @st.cache(allow_output_mutation=True, show_spinner=False)
-def load_projects(url: str = None) -> List[str]:
+def load_config(config: str) -> APIClient:
     """
-    Send a get request to load list of available projects.
+    Load project configurations from a .yaml file and create the api client,
+    whose pooled connections are shared by all sessions.
 
     Args:
-        url (str, optional): API address.
+        config (str): Path to the configuration file.
     """
-    if url is None:
-        url = os.environ['API_ADDRESS'] + os.environ['LOAD_PROJECTS']
+    global CLIENT
+    CLIENT = APIClient.from_config(config)
+    return CLIENT
 
-    r = requests.get(url)
-    return r.json()['projects']
+
+@timed
+def load_projects() -> List[str]:
+    """
+    Send a get request to load list of available projects, a cheap revalidation
+    of the cached list (ETag) unless another user created or deleted a project.
+    Projects being deleted by a job of the session are left out.
+    """
+    deleting = {name for (kind, name), state in st.session_state.jobs.items()
+                if kind == 'delete' and state['status'] not in JOB_FINISHED}
+    return [name for name in CLIENT.list_projects() if name not in deleting]
 
 
-def update_label_data(new_labels: List[str], url: str = None):
+@timed
+def update_label_data(new_labels: List[str]):
     """
-    Send a put request to update the labels of the labeled data.
+    Queue an update of the labels of the current data, sent in background by the
+    label writer of the session, and apply it to the session state at once.
 
     Args:
         new_labels (List[str]): List of selected labels.
-        url (str, optional): API address.
     """
-    headers = {
-        'content-type': 'application/json',
-        'Accept-Charset': 'UTF-8',
-    }
-    if url is None:
-        url = os.environ['API_ADDRESS'] + os.environ['UPDATE_LABEL_DATA']
-
-    url = f'{url}/{st.session_state.current_project}/{st.session_state.current_page}'
     verified = str(datetime.now()).split('.')[0][:-3] if len(new_labels) > 0 else '0'
-    data = {'new_labels': new_labels, 'verified': verified}
     # add new labels to unlabeled data
     if st.session_state.data['verified'] == '0':
         new_progress = f'{int(st.session_state.project_info["progress"]) + 1}'
@@ -176,32 +329,98 @@ def update_label_data(new_labels: List[str], url: str = None):
     else:
         new_progress = st.session_state.project_info['progress']
 
-    r = requests.put(url, data=json.dumps(data), headers=headers)
+    label_writer().add(st.session_state.current_project, st.session_state.current_page,
+                       new_labels, verified)
     # update label and progress status into session state
     st.session_state.data['label'] = new_labels
     st.session_state.data['verified'] = verified
     st.session_state.project_info['progress'] = new_progress
+    update_window(st.session_state.current_page, new_labels, verified)
 
 
-def update_project_info(url: str = None):
+def label_writer() -> LabelWriter:
+    """ Return the label writer of the session, which queues its label updates. """
+    if st.session_state.get('label_writer') is None:
+        st.session_state.label_writer = LabelWriter(CLIENT)
+    return st.session_state.label_writer
+
+
+@timed
+def flush_labels(project_name: str = None) -> bool:
     """
-    Send a post request to update project description and labels.
+    Wait until the queued label updates of a project, or of all projects, are
+    stored by the api. Return False if they could not be sent, they are retried
+    in background then, or if the api rejected the updates of the current
+    project as a whole, e.g. going over 63 labels. The error is shown by
+    `widgets.label_queue_status`.
 
     Args:
-        url (str, optional): API address.
+        project_name (str, optional): Project name.
     """
-    headers = {
-        'content-type': 'application/json',
-        'Accept-Charset': 'UTF-8',
-    }
-    if url is None:
-        url = os.environ['API_ADDRESS'] + os.environ['UPDATE_PROJECT_INFO']
+    try:
+        results = label_writer().flush(project_name)
+    except requests.RequestException:
+        return False
+    # keep the progress in session state correct if labeling the current project
+    current = st.session_state.get('current_project')
+    if current in results and 'progress' not in results[current]:  # rejected batch
+        return False
+    if current in results and st.session_state.get('project_info') is not None and \
+            st.session_state.project_info['project'] == current:
+        st.session_state.project_info['progress'] = results[current]['progress']
+    return True
+
+
+def update_window(page: int, new_labels: List[str], verified: str):
+    """
+    Apply a label update to the read-ahead window in session state and discard any
+    window being refilled in background, as it may miss the update.
+    """
+    st.session_state.data_window_future = None
+    window = st.session_state.data_window
+    if in_window(window, st.session_state.current_project, page) and window['total'] > 0:
+        i = min(window['total'] - 1, page) - window['offset']
+        window['label'][i] = new_labels
+        window['verified'][i] = verified
+
+
+@timed
+def update_labels(project_name: str, updates: List[dict]) -> dict:
+    """
+    Send a put request to update the labels of many data at once.
+
+    Args:
+        project_name (str): Project name.
+        updates (List[dict]): Updates of {'index': int, 'labels': List[str],
+                              'verified': str, optional}.
 
-    url = f'{url}/{st.session_state.current_project}'
-    r = requests.post(url, data=json.dumps(st.session_state.project_info),
-                      headers=headers)
+    Returns:
+        Status of each update and the new progress, see `api.update_labels`.
+    """
+    result = CLIENT.update_labels(project_name, updates)
+    # keep the progress in session state correct if labeling the current project
+    if st.session_state.get('current_project') == project_name and \
+            st.session_state.get('project_info') is not None:
+        st.session_state.project_info['progress'] = result['progress']
+    return result
+
+
+@timed
+def update_project_info(renames: Dict[str, str] = None):
+    """
+    Send a post request to update project description and labels. Labels of the
+    data may change, so the read-ahead window is dropped.
+
+    Args:
+        renames (Dict[str, str], optional): New name of renamed labels.
+    """
+    flush_labels(st.session_state.current_project)  # queued labels may be renamed
+    CLIENT.update_project_info(st.session_state.current_project,
+                               st.session_state.project_info, renames)
+    st.session_state.data_window = None
+    st.session_state.data_window_future = None
 
 
 def rerun():
-    """ A hack to rerun streamlit app. """
-    raise st.script_runner.RerunException(st.script_request_queue.RerunData(None))
+    """ Rerun streamlit app. """
+    st.experimental_rerun()
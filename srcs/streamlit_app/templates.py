@@ -1,3 +1,4 @@
+from html import escape
 from typing import List
 
 
@@ -101,8 +102,8 @@ def progress_bar_html(labeled_proportion: str) -> str:
     """
 
 
-def save_csv_html(filename: str, csv: str) -> str:
-    """ HTML scripts to display button to save exported data in csv file. """
+def save_file_html(filename: str, url: str) -> str:
+    """ HTML scripts to display button to download exported data from the API. """
     return f"""
         <style>
             #save_csv {{
@@ -131,7 +132,7 @@ def save_csv_html(filename: str, csv: str) -> str:
                 color: white;
                 }}
         </style>
-        <a download="{filename}" id="save_csv" href="data:file/csv;base64,{csv}">
+        <a download="{filename}" id="save_csv" href="{url}">
             Save to folder
         </a>
     """
@@ -161,3 +162,21 @@ def verified_datetime_html(date_time: str) -> str:
             Verified at {date_time}
         </div>
     """
+
+
+def search_results_html(current_project: str, total: int, rows: List[int],
+                        snippets: List[str]) -> str:
+    """ HTML scripts to display search results linking to their pages. """
+    html = f"""
+        <div style="color:grey;font-size:90%;margin-bottom:0.5em;">
+            {total} data found
+        </div>
+    """
+    for row, snippet in zip(rows, snippets):
+        html += f"""
+            <div style="font-size:90%;margin-bottom:0.5em;">
+                <a href="?project={current_project}&page={row + 1}">#{row + 1}</a>
+                {escape(snippet)}
+            </div>
+        """
+    return html
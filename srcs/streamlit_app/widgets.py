@@ -1,7 +1,7 @@
 import pandas as pd
 import streamlit as st
 
-from srcs.streamlit_app import app_utils
+from srcs.streamlit_app import app_utils, templates
 
 
 def add_label():
@@ -82,29 +82,67 @@ def delete_project():
 
 def export_data():
     """
-    An expander widget to export all data or only labeled data. This will return
-    a streamlit placeholder to display download button after clicking the export
-    button.
+    An expander widget to export all data or only labeled data, as csv or json
+    lines. Clicking the export button starts an export job whose progress is
+    shown, this will return a streamlit placeholder to display download button
+    once the job is done, the file is downloaded from the API.
     """
-    project_name = st.session_state.current_project
+    def submit_export(all_or_labeled, file_format):
+        # the export is read from the api, which has to store the queued labels first
+        if not app_utils.flush_labels(st.session_state.current_project):
+            st.session_state.export_failed = True
+        else:
+            app_utils.start_export(all_or_labeled, file_format)
+
     format_dict = {
         'labeled': 'Labeled data',
         'all': 'All data',
     }
+    file_format_dict = {
+        'csv': 'CSV',
+        'jsonl': 'JSON lines',
+    }
     with st.expander('Export data'):
         all_or_labeled = st.radio('Export all data or just labeled data',
                                   list(format_dict.keys()),
                                   format_func=lambda x: format_dict[x],
                                   key='button_all_or_labeled')
-        export = st.button('Export', key='button_submit_export_data')
-        if export:
-            filename = f'{project_name}_{all_or_labeled}.csv'
-            csv = app_utils.download_csv(project_name, all_or_labeled)
-            st.session_state.download = (filename, csv)
+        file_format = st.radio('File format', list(file_format_dict.keys()),
+                               format_func=lambda x: file_format_dict[x],
+                               key='button_export_file_format')
+        st.button('Export', key='button_submit_export_data', on_click=submit_export,
+                  args=(all_or_labeled, file_format, ))
+        if st.session_state.pop('export_failed', False):
+            st.warning('The latest labels could not be saved, please export again later.')
+        job_progress('export')
 
         return st.empty()
 
 
+def job_progress(kind: str):
+    """
+    A progress bar of the last job of a kind, "import" or "export", started on
+    the current project, with a button to cancel it, or its outcome once finished.
+    """
+    state = app_utils.job(kind)
+    if state is None:
+        return
+    if state['status'] in ('queued', 'running'):
+        st.progress(int(state['progress']))
+        rows = f'{state["done"]} / {state["total"]} rows' if state['total'] else state['status']
+        st.caption(f'{kind.capitalize()}: {rows}')
+        st.button('Cancel', key=f'button_cancel_{kind}', on_click=app_utils.cancel_job, args=(kind, ))
+    elif state['status'] == 'failed':
+        st.error(f'{kind.capitalize()} failed: {state["error"]}')
+    elif state['status'] == 'cancelled':
+        st.warning(f'{kind.capitalize()} cancelled after {state["done"]} rows.')
+    elif kind == 'import':
+        st.success(f'Imported {state["result"]["new"]} texts, '
+                   f'skipped {state["result"]["duplicates"]} duplicates.')
+    else:
+        st.success(f'Exported {state["result"]["rows"]} rows.')
+
+
 def label_data():
     """
     Checkboxes to label data. Click or unclick a label to add or delete a label
@@ -129,24 +167,70 @@ def label_data():
                   on_click=submit_verify, args=(new_labels, ))
 
 
+def label_queue_status():
+    """
+    A warning shown while queued label updates fail to be sent, with a button to
+    retry at once, they are retried in background anyway, or once the api
+    rejected some of them.
+    """
+    writer = app_utils.label_writer()
+    if writer.error is None:
+        return
+    pending = writer.pending()
+    if pending == 0:  # rejected updates are not retried
+        st.warning(f'Label updates were not saved: {writer.error}')
+        return
+    st.warning(f'{pending} label updates are not saved yet: {writer.error}')
+    st.button('Retry', key='button_retry_labels', on_click=app_utils.flush_labels)
+
+
+def timings():
+    """
+    An expander widget showing the round-trip time of the recent calls of the
+    session to the api, in milliseconds, to tell slow pages apart from a slow app.
+    """
+    with st.expander('Timings'):
+        if len(st.session_state.timings) == 0:
+            st.write('No call yet.')
+            return
+        rows = {}
+        for name, seconds in sorted(st.session_state.timings.items()):
+            ms = pd.Series(seconds) * 1000
+            rows[name] = {'calls': len(ms), 'last': ms.iloc[-1], 'p50': ms.quantile(0.5),
+                          'p95': ms.quantile(0.95), 'max': ms.max()}
+        st.table(pd.DataFrame.from_dict(rows, orient='index').round(1))
+
+
+def next_unlabeled():
+    """
+    A button to jump to the next unlabeled data, a message is shown instead if
+    all data are labeled.
+    """
+    def submit_next():
+        if not app_utils.next_unlabeled():
+            st.session_state.all_labeled = True
+
+    st.button('Next unlabeled', key='button_next_unlabeled', on_click=submit_next)
+    if st.session_state.pop('all_labeled', False):
+        st.info('All data are labeled.')
+
+
 def import_data():
     """
     An expander widget to import data. Click to select file or drag a file into
     the box then select a desired column containing the data and finally click
-    "Import" button to import the data to a project.
+    "Import" button to start a job importing the data to a project, whose
+    progress is shown.
     """
     with st.expander('Import data'):
         file = st.file_uploader(label='Upload your csv file here.')
         if file is not None:
-            df = pd.read_csv(file)
+            columns = pd.read_csv(file, nrows=0).columns
             # select the column containing the texts to be labelled
-            column = st.radio('Column containing the texts', list(df.columns))
-            _add = st.button('Import', key='button_submit_add_data')
-            file = df
-        else:
-            _add, column = None, None
-
-    return file, _add, column
+            column = st.radio('Column containing the texts', list(columns))
+            st.button('Import', key='button_submit_add_data', on_click=app_utils.start_import,
+                      args=(file, column, ))
+        job_progress('import')
 
 
 def project_description():
@@ -167,3 +251,41 @@ def project_description():
     if new_description != description:
         st.button('Save', key='button_save_description', on_click=submit_save,
                   args=(new_description, ))
+
+
+def search_data():
+    """
+    A text input to search the texts of the current project. The best matching
+    data are listed with a link to their page.
+    """
+    project_name = st.session_state.current_project
+    query = st.text_input('Search texts:', key='text_input_search_data')
+    if query.strip():
+        result = app_utils.search_data(project_name, query)
+        st.write(templates.search_results_html(project_name, result['total'], result['rows'],
+                                               result['snippets']),
+                 unsafe_allow_html=True)
+
+
+def rename_label():
+    """
+    An expander widget to rename a label. Select a defined label from the drop
+    down list, enter its new name then click "Rename" button to rename it in all
+    data.
+    """
+    def submit_rename(expander, label, new_label):
+        labels = st.session_state.project_info['label']
+        if new_label in labels:
+            expander.warning(f'The label "{new_label}" is already exist.')
+        else:
+            labels[labels.index(label)] = new_label
+            app_utils.update_project_info(renames={label: new_label})
+
+    labels = ['- Select -'] + st.session_state.project_info['label']
+    expander = st.expander('Rename label')
+    with expander:
+        to_rename = st.selectbox('Rename a label:', labels, key='selectbox_rename_label')
+        new_label = st.text_input('New name:', key='text_input_rename_label')
+        if to_rename != '- Select -' and new_label:
+            st.button('Rename', key='button_submit_rename_label', on_click=submit_rename,
+                      args=(expander, to_rename, new_label, ))
@@ -1,3 +1,8 @@
+import os
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
 import yaml
 
 
@@ -8,3 +13,18 @@ def load_yaml(config: str) -> dict:
 
     return config
 
+
+@contextmanager
+def atomic_path(path: str) -> Iterator[str]:
+    """
+    Yield a temporary path to write a file to, which is then moved over `path`,
+    so readers see either the old or the new file but never a partial one. The
+    temporary path is unique to the thread, so concurrent writers do not clash.
+    """
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):  # failed before the file was moved
+            os.remove(tmp)
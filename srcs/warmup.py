@@ -0,0 +1,110 @@
+"""
+Warm-up of the api after it starts: a background thread prepares the most
+recently modified projects for their first requests within a memory budget,
+loading their data into the cache of the storage engine and building their
+indexes, see `Storage.warm`. Its progress is reported by the READY route, so a
+load balancer only routes requests to workers which are warm.
+"""
+import time
+import logging
+import threading
+from typing import List, Optional
+
+from srcs.storage.base import Storage
+
+logger = logging.getLogger(__name__)
+
+
+class Warmup:
+    """
+    Warm-up of the projects of a storage engine, most recently modified first.
+    Projects whose data does not fit in the remaining budget only get their
+    indexes kept on disk built.
+
+    Args:
+        storage (Storage): Storage engine of the api.
+        max_bytes (int): Memory budget of the warmed projects in bytes.
+        max_projects (int): Max number of projects warmed.
+    """
+    def __init__(self, storage: Storage, max_bytes: int, max_projects: int):
+        self.storage = storage
+        self.max_bytes = max_bytes
+        self.max_projects = max_projects
+        self.projects: List[str] = []
+        self.warmed: List[str] = []  # projects loaded into memory
+        self.done = 0
+        self.nbytes = 0
+        self.current: Optional[str] = None
+        self.errors = {}
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+        self.thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Start warming projects in a background thread, ready at once if there is
+        nothing to warm. Only the first call starts it, later ones do nothing.
+        """
+        with self._lock:
+            if self.thread is not None or self.finished is not None:
+                return
+            self.started = time.monotonic()
+            if self.max_projects <= 0 or self.max_bytes <= 0:
+                self.finished = self.started
+                return
+            self.thread = threading.Thread(target=self.run, name='warmup', daemon=True)
+            self.thread.start()
+
+    def run(self):
+        """ Warm the most recently modified projects, one at a time. """
+        try:
+            self.projects = self.storage.recent_projects()[:self.max_projects]
+            for project_name in self.projects:
+                self.current = project_name
+                try:
+                    nbytes = self.storage.warm(project_name, self.max_bytes - self.nbytes)
+                except Exception as e:  # a broken project must not keep the api unready
+                    logger.exception('Failed to warm up "%s"', project_name)
+                    self.errors[project_name] = str(e)
+                    nbytes = 0
+                if nbytes > 0:
+                    self.warmed.append(project_name)
+                    self.nbytes += nbytes
+                self.done += 1
+        except Exception as e:
+            logger.exception('Failed to warm up projects')
+            self.errors[''] = str(e)
+        finally:
+            self.current = None
+            self.finished = time.monotonic()
+
+    def status(self) -> dict:
+        """
+        Return the progress of the warm-up.
+
+        Returns:
+            {
+                'ready': True once the warm-up is finished, bool
+                'done': Number of projects warmed up so far, int
+                'total': Number of projects to warm up, int
+                'current': Project being warmed up, Optional[str]
+                'warmed': Projects whose data was loaded into memory, List[str]
+                'memory_mb': Memory taken by the warmed projects, float
+                'budget_mb': Memory budget of the warm-up, float
+                'seconds': Time taken by the warm-up so far, float
+                'errors': Error of each project failing to warm up, Dict[str, str]
+            }
+        """
+        finished = self.finished
+        return {
+            'ready': finished is not None,
+            'done': self.done,
+            'total': len(self.projects),
+            'current': self.current,
+            'warmed': list(self.warmed),
+            'memory_mb': round(self.nbytes / 2 ** 20, 1),
+            'budget_mb': round(self.max_bytes / 2 ** 20, 1),
+            'seconds': round((finished or time.monotonic()) - self.started, 2),
+            'errors': dict(self.errors),
+        }